@@ -22,11 +22,9 @@ Functions:
 # %% ---- 2023-11-28 ------------------------
 # Requirements and constants
 import os
-import mne
 import json
+import asyncio
 import traceback
-import numpy as np
-import pandas as pd
 
 from pathlib import Path
 from rich import print, inspect
@@ -39,26 +37,68 @@ from fastapi.responses import (
     RedirectResponse,
 )
 
-from util import LOGGER
+from util import LOGGER, LazyModule
 from util.experiments import Experiments
 from util.session_system import ZccSessionSystem, ZccSession
-from util.dataframe_converter import df2csv
+from util.recording_cache import ZccRecordingCache
+from util.job_system import ZccJobSystem
+from util.notifier import ZccNotifier, format_sse
+from util.compute_executor import ZccComputeExecutor
+from util.data_watcher import ZccDataWatcher
+from util.metrics import ZccMetrics
+from util.error_box import eb
+from util.dataframe_converter import (
+    iter_csv,
+    iter_json,
+    df2bin,
+    is_numeric_df,
+    BINARY_MEDIA_TYPE,
+)
 from util.doc import ZccErrorCode
 
-from route.app import app, check_user_name
+from route.app import app, check_user_name, check_admin_name
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
 
 # %% ---- 2023-11-28 ------------------------
 # Global variables
 experiments = Experiments()
 zss = ZccSessionSystem()
+zrc = ZccRecordingCache()
+zjs = ZccJobSystem()
+zn = ZccNotifier()
+zce = ZccComputeExecutor()
+zm = ZccMetrics()
 zec = ZccErrorCode
+zdw = ZccDataWatcher(ZccSession.zfs)
+
+
+@app.on_event("startup")
+async def start_data_crawler():
+    # Crawl the data_root in the background, the app serves the persisted index meanwhile
+    ZccSession.zfs.start()
+
+
+@app.on_event("startup")
+async def start_data_watcher():
+    # Keep the data files live, so the new recordings are found without restarting
+    zdw.start()
+
+
+@app.on_event("startup")
+async def start_session_reaper():
+    # Remove the idle sessions and keep the sessions inside the memory budget
+    zss.start_reaper()
 
 
 # %% ---- 2023-12-29 ------------------------
 # Tool functions
-def fetch_user_identity_and_session(request: Request):
+async def fetch_user_identity_and_session(request: Request):
     """
     Fetches the user identity and session based on the provided request.
+    In the shared state mode, the session is rehydrated outside the event loop,
+    since it may reload the raw of the state saved by the other worker.
 
     Args:
         request (Request): The request object.
@@ -68,7 +108,7 @@ def fetch_user_identity_and_session(request: Request):
 
     Example:
         request = Request()
-        username, session = fetch_user_identity_and_session(request)
+        username, session = await fetch_user_identity_and_session(request)
         print(username, session)"""
 
     username = check_user_name(request)
@@ -78,7 +118,9 @@ def fetch_user_identity_and_session(request: Request):
         LOGGER.warning("Failed check username.")
         return None, None
 
-    session = zss.get_session(username)
+    session = zss.get_session(username, sync_state=False)
+    if session.store is not None:
+        await zce.run_cheap(session.name, session.sync_state)
     LOGGER.debug(f"Current session: {session.subjectID} | {session.name} | {session}")
 
     return username, session
@@ -90,9 +132,7 @@ def handle_known_failure(fail_reason: str, _successFlag: zec, res: dict = None):
     LOGGER.warning(fail_reason)
     res |= dict(_successFlag=_successFlag.value, _failReason=fail_reason)
     return (
-        StreamingResponse(
-            iter(json.dumps(res)), media_type="text/json", status_code=404
-        ),
+        StreamingResponse(iter_json(res), media_type="text/json", status_code=404),
         res,
     )
 
@@ -161,6 +201,31 @@ def mk_res(
     return res
 
 
+def mk_frame_response(df: "pd.DataFrame", request: Request, format: str = ""):
+    """
+    Makes the response of the dataframe, in the .csv format or the binary frame format.
+    The binary frame is used if format is "bin", or the Accept header requires it.
+
+    Args:
+        df (pd.DataFrame): The dataframe.
+        request (Request): The request object.
+        format (str): The required format, "csv" or "bin", "" refers using the Accept header.
+
+    Returns:
+        Response: The response."""
+
+    if not format:
+        accept = request.headers.get("accept", "")
+        format = "bin" if BINARY_MEDIA_TYPE in accept else "csv"
+
+    if format == "bin":
+        if is_numeric_df(df):
+            return Response(df2bin(df), media_type=BINARY_MEDIA_TYPE)
+        LOGGER.warning("Can not use binary frame for non-numerical data, using .csv")
+
+    return StreamingResponse(iter_csv(df), media_type="text/csv")
+
+
 # %% ---- 2023-11-28 ------------------------
 # Function and class
 @app.get("/favicon.ico", include_in_schema=False)
@@ -170,13 +235,12 @@ async def favicon():
 
 @app.get("/zcc/getExperiments.csv")
 async def get_experiments_csv(request: Request):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     try:
         df = experiments.to_df()
         assert len(df) > 0, "No experiments found"
-        csv = df2csv(df)
-        return StreamingResponse(iter(csv), media_type="text/csv")
+        return StreamingResponse(iter_csv(df), media_type="text/csv")
     except Exception:
         fail_reason = traceback.format_exc()
         resp, _ = handle_known_failure(fail_reason, zec.FAIL_PROCESSING)
@@ -187,13 +251,37 @@ async def get_experiments_csv(request: Request):
 async def get_data_files_csv(
     request: Request, response_class=StreamingResponse, experimentName: str = ""
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
-    df = session.zfs.search_data()
+    df = await zce.run_cheap(session.name, session.zfs.search_data)
     if experimentName:
         df = df.query(f'experiment=="{experimentName}"')
-    csv = df2csv(df)
-    return StreamingResponse(iter(csv), media_type="text/csv")
+    return StreamingResponse(iter_csv(df), media_type="text/csv")
+
+
+@app.get("/zcc/refreshDataFiles.json")
+async def refresh_data_files(request: Request):
+    """
+    Refreshes the data files, only the changed directories are listed.
+    The new data files are found without restarting the server.
+    The crawling runs outside the event loop, since it may wait for the background crawling."""
+
+    username, session = await fetch_user_identity_and_session(request)
+
+    try:
+        delta = await zce.run(session.name, session.zfs.refresh)
+        res = dict(
+            _successFlag=0,
+            added=len(delta["added"]),
+            removed=len(delta["removed"]),
+            total=len(session.zfs.df),
+        )
+        return Response(json.dumps(res), media_type="text/json")
+
+    except Exception:
+        fail_reason = traceback.format_exc()
+        resp, _ = handle_known_failure(fail_reason, zec.FAIL_PROCESSING)
+        return resp
 
 
 @app.get("/zcc/startWithEEGRaw.json")
@@ -202,13 +290,12 @@ async def start_with_eeg_raw(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
     try:
-        df = session.zfs.search_data()
-        df = df.query(f'subjectID=="{subjectID}"')
+        df = await zce.run(session.name, session.zfs.find_subject, subjectID)
         assert len(df) > 0, "No experiments found"
 
         # Found multiple data
@@ -219,13 +306,18 @@ async def start_with_eeg_raw(
         selected = dict(df.iloc[0])
         LOGGER.debug(f"Selected subjectID ({subjectID}): {selected}")
 
-        # Do something with the session
-        session.starts_with_raw(Path(selected["path"]), selected["subjectID"])
+        # Do something with the session, the raw is loaded outside the event loop
+        await zce.run(
+            session.name,
+            session.starts_with_raw,
+            Path(selected["path"]),
+            selected["subjectID"],
+        )
 
         # Return the stuff
         selected["path"] = Path(selected["path"]).as_posix()
         res |= selected
-        return StreamingResponse(iter(json.dumps(res)), media_type="text/json")
+        return StreamingResponse(iter_json(res), media_type="text/json")
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -239,7 +331,7 @@ async def get_eeg_montage_info(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -251,7 +343,7 @@ async def get_eeg_montage_info(
         res |= dict(ch_names=montage.ch_names)
 
         return StreamingResponse(
-            iter(json.dumps(res, default=lambda o: f"{o}")),
+            iter_json(res, default=lambda o: f"{o}"),
             media_type="text/json",
         )
     except Exception:
@@ -266,7 +358,7 @@ async def get_eeg_raw_info(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -293,14 +385,16 @@ async def get_eeg_raw_data_csv(
     subjectID: str = "",
     seconds: float = 0,
     windowLength: float = 10,
+    maxPoints: int = 0,
+    format: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(
         session,
         experimentName,
         subjectID,
-        {"seconds": seconds, "windowLength": windowLength},
+        {"seconds": seconds, "windowLength": windowLength, "maxPoints": maxPoints},
     )
 
     raw, res = get_attr_from_session(session, res, attr_name="raw")
@@ -316,21 +410,20 @@ async def get_eeg_raw_data_csv(
     )
 
     try:
-        # Data size is converted into (time points x channels)
-        data = raw.get_data().transpose()
-        data -= np.mean(data, axis=0)
 
-        data_df = pd.DataFrame(data, columns=raw.info["ch_names"])
-        data_df["seconds"] = data_df.index / raw.info["sfreq"]
-        lower = seconds - windowLength / 2
-        upper = seconds + windowLength / 2
-        data_df = data_df.query(f"seconds < {upper}").query(f"seconds > {lower}")
+        def _compute():
+            # Data size is (time points x channels), only the window is read
+            data, samples = session.eeg_data.get_data_window(
+                seconds, windowLength, maxPoints
+            )
 
-        events_df = pd.DataFrame(events, columns=["samples", "duration", "label"])
-        events_df["seconds"] = events_df["samples"] / raw.info["sfreq"]
+            data_df = pd.DataFrame(data, columns=raw.info["ch_names"], index=samples)
+            data_df["seconds"] = samples / raw.info["sfreq"]
+            return data_df
 
-        csv = df2csv(data_df)
-        return Response(csv, media_type="text/csv")
+        data_df = await zce.run(session.name, _compute)
+
+        return mk_frame_response(data_df, request, format)
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -344,7 +437,7 @@ async def get_eeg_raw_events_csv(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -367,8 +460,7 @@ async def get_eeg_raw_events_csv(
         df["label"] = df["label"].map(lambda num: inv_event_id[num])
         df["seconds"] = df["timestamp"] / raw.info["sfreq"]
 
-        csv = df2csv(df)
-        return Response(csv, media_type="text/csv")
+        return StreamingResponse(iter_csv(df), media_type="text/csv")
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -382,7 +474,7 @@ async def get_eeg_epochs_events_csv(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -395,9 +487,8 @@ async def get_eeg_epochs_events_csv(
         inv_event_id = {v: k for k, v in epochs.event_id.items()}
         # Convert number label into its string label
         df["label"] = df["label"].map(lambda num: inv_event_id[num])
-        csv = df2csv(df)
 
-        return Response(csv, media_type="text/csv")
+        return StreamingResponse(iter_csv(df), media_type="text/csv")
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -405,6 +496,127 @@ async def get_eeg_epochs_events_csv(
         return resp
 
 
+@app.get("/zcc/getJobStatus.json")
+async def get_job_status_json(
+    request: Request,
+    experimentName: str = "",
+    subjectID: str = "",
+    jobID: str = "",
+):
+    """
+    Reports the status, stage and progress of the job.
+    The session's latest job is reported if the jobID is not provided.
+    """
+    username, session = await fetch_user_identity_and_session(request)
+
+    res = mk_res(session, experimentName, subjectID)
+
+    job = zjs.get(jobID) if jobID else session.job
+    if job is None and session.store is not None:
+        # The job may run in the other worker, the rehydrated session has its own job
+        job = session.job
+    if job is None or job.owner != session.name:
+        resp, _ = handle_known_failure(
+            f"Invalid job {jobID} | {session.name} | {session.subjectID}",
+            zec.SHOULD_NOT_NONE,
+            res,
+        )
+        return resp
+
+    res |= job.to_dict()
+    return Response(json.dumps(res), media_type="text/json")
+
+
+def mk_trace_response(trace, res: dict, format: str = ""):
+    """
+    Makes the response of the trace, the spans or the Chrome trace JSON.
+
+    Args:
+        trace (ZccTrace): The trace.
+        res (dict): The response.
+        format (str): The chrome refers the Chrome trace JSON, others refer the spans.
+
+    Returns:
+        Response: The response."""
+
+    spans = trace.list_spans()
+    if format == "chrome":
+        return StreamingResponse(
+            iter_json(trace.to_chrome_trace(spans), default=lambda o: f"{o}"),
+            media_type="application/json",
+            headers={"Content-Disposition": 'attachment; filename="zcc-trace.json"'},
+        )
+
+    res |= dict(spans=spans)
+    return StreamingResponse(
+        iter_json(res, default=lambda o: f"{o}"), media_type="text/json"
+    )
+
+
+@app.get("/zcc/getTrace.json")
+async def get_trace_json(
+    request: Request,
+    experimentName: str = "",
+    subjectID: str = "",
+    format: str = "",
+):
+    """
+    Gets the spans of the pipeline stages of the session's recording and epochs.
+    The format=chrome returns the Chrome trace JSON, it is opened by chrome://tracing or Perfetto.
+    """
+    username, session = await fetch_user_identity_and_session(request)
+
+    res = mk_res(session, experimentName, subjectID)
+
+    trace, res = get_attr_from_session(session, res, attr_name="trace")
+    if res["_successFlag"] > 0:
+        return trace
+
+    return mk_trace_response(trace, res, format)
+
+
+@app.get("/zcc/events")
+async def get_events_stream(request: Request):
+    """
+    Pushes the session's events as the Server-Sent Events.
+    The current state is sent first, so the tab knows if the epochs are already ready.
+    """
+    username, session = await fetch_user_identity_and_session(request)
+
+    subscriber = zn.subscribe(session.name)
+
+    async def _stream():
+        try:
+            eeg_data = session.eeg_data
+            if eeg_data is not None and eeg_data.epochs is not None:
+                yield format_sse("epochsReady", dict(subjectID=session.subjectID))
+            elif session.job is not None:
+                # The job may be ended before the tab subscribes
+                event = dict(failed="jobFailed", cancelled="jobCancelled").get(
+                    session.job.status, "jobProgress"
+                )
+                yield format_sse(event, session.job.to_dict())
+
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=zn.keepalive_secs
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+
+        finally:
+            zn.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/zcc/getEEGSingleSensorAveragedTfrMorlet.csv")
 async def get_eeg_single_sensor_averaged_tfr_morlet_csv(
     request: Request,
@@ -412,8 +624,9 @@ async def get_eeg_single_sensor_averaged_tfr_morlet_csv(
     eventLabel: str,
     experimentName: str = "",
     subjectID: str = "",
+    format: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -422,22 +635,24 @@ async def get_eeg_single_sensor_averaged_tfr_morlet_csv(
         return epochs
 
     try:
-        tfr_epochs, averaged_data, freqs, times = session.eeg_data.compute_tfr_morlet(
-            sensorName, eventLabel
-        )
 
-        buffer = []
-        for i, freq in enumerate(freqs):
-            buffer.extend(
-                dict(freq=freq, secs=secs, v=averaged_data[i][j])
-                for j, secs in enumerate(times)
+        def _compute():
+            tfr_epochs, averaged_data, freqs, times = session.eeg_data.compute_tfr_morlet(
+                sensorName, eventLabel
             )
-        df = pd.DataFrame(buffer)
 
-        print(df)
+            # The rows of (freq, secs), freq by freq
+            return pd.DataFrame(
+                dict(
+                    freq=np.repeat(freqs, len(times)),
+                    secs=np.tile(times, len(freqs)),
+                    v=np.ravel(averaged_data),
+                )
+            )
 
-        csv = df2csv(df)
-        return Response(csv, media_type="text/csv")
+        df = await zce.run(session.name, _compute)
+
+        return mk_frame_response(df, request, format)
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -453,7 +668,7 @@ async def get_eeg_single_sensor_averaged_data_csv(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -462,16 +677,17 @@ async def get_eeg_single_sensor_averaged_data_csv(
         return epochs
 
     try:
-        epochs = epochs[eventLabel]
-        LOGGER.debug(f"Selected epochs: {epochs}")
-        evoked = epochs.average(picks=[sensorName])
 
-        # Data shape is (1 x times)
-        data = evoked.get_data()
+        def _compute():
+            selected = epochs[eventLabel]
+            LOGGER.debug(f"Selected epochs: {selected}")
+            evoked = selected.average(picks=[sensorName])
+
+            # Data shape is (1 x times)
+            return pd.DataFrame(evoked.get_data())
 
-        df = pd.DataFrame(data)
-        csv = df2csv(df)
-        return Response(csv, media_type="text/csv")
+        df = await zce.run_cheap(session.name, _compute)
+        return StreamingResponse(iter_csv(df), media_type="text/csv")
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -485,8 +701,9 @@ async def get_eeg_single_sensor_data_csv(
     sensorName: str,
     experimentName: str = "",
     subjectID: str = "",
+    format: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -495,15 +712,18 @@ async def get_eeg_single_sensor_data_csv(
         return epochs
 
     try:
-        # Raw data shape is (events x 1 x times)
-        # The data is squeezed into (events x times)
-        data = epochs.get_data(picks=[sensorName]).squeeze()
-        # Append the times into the data, as the last raw.
-        # It changes the data into (events+1 x times) shape
-        data = np.concatenate([data, epochs.times[np.newaxis, :]], axis=0)
-        df = pd.DataFrame(data)
-        csv = df2csv(df)
-        return Response(csv, media_type="text/csv")
+
+        def _compute():
+            # Raw data shape is (events x 1 x times)
+            # The data is squeezed into (events x times)
+            data = epochs.get_data(picks=[sensorName]).squeeze()
+            # Append the times into the data, as the last raw.
+            # It changes the data into (events+1 x times) shape
+            data = np.concatenate([data, epochs.times[np.newaxis, :]], axis=0)
+            return pd.DataFrame(data)
+
+        df = await zce.run_cheap(session.name, _compute)
+        return mk_frame_response(df, request, format)
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -518,8 +738,9 @@ async def get_eeg_evoked_data_csv(
     experimentName: str = "",
     subjectID: str = "",
     dataType: str = "timeCourse",
+    format: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     res = mk_res(session, experimentName, subjectID)
 
@@ -528,31 +749,77 @@ async def get_eeg_evoked_data_csv(
         return epochs
 
     try:
-        evoked = epochs[f"{event}"].average()
-        # Data shape is (timepoints x channels)
-        data = evoked.get_data().transpose()
 
-        if dataType == "timeCourse":
-            df = pd.DataFrame(data, columns=epochs.ch_names)
-            df["_times"] = epochs.times
+        def _compute():
+            evoked = epochs[f"{event}"].average()
+            # Data shape is (timepoints x channels)
+            data = evoked.get_data().transpose()
+
+            if dataType == "timeCourse":
+                df = pd.DataFrame(data, columns=epochs.ch_names)
+                df["_times"] = epochs.times
+
+            elif dataType == "freqDomain":
+                n = data.shape[0]
+                fft = np.fft.fft(data, axis=0)
+                # abs_fft = np.abs(fft) / n
+                # df = pd.DataFrame(abs_fft, columns=epochs.ch_names)
+
+                # Return the complex value of (re) + (im) x j
+                # Only the first half is used, and it is formatted in the vectorized way
+                m = int(n / 2)
+                fft = fft[:m] / n
+                text = np.char.add(
+                    np.char.add(fft.real.astype(str), ","), fft.imag.astype(str)
+                )
+                df = pd.DataFrame(text, columns=epochs.ch_names)
 
-        elif dataType == "freqDomain":
-            n = data.shape[0]
-            fft = np.fft.fft(data, axis=0)
-            # abs_fft = np.abs(fft) / n
-            # df = pd.DataFrame(abs_fft, columns=epochs.ch_names)
+                df["_freq"] = np.linspace(0, evoked.info["sfreq"], n)[:m]
 
-            # Return the complex value of (re) + (im) x j
-            fft /= n
-            df = pd.DataFrame(fft, columns=epochs.ch_names)
-            df = df.applymap(lambda e: f"{np.real(e)},{np.imag(e)}")
+            return df
 
-            df["_freq"] = np.linspace(0, evoked.info["sfreq"], n)
-            df = df.iloc[: int(n / 2)]
+        df = await zce.run_cheap(session.name, _compute)
+
+        return mk_frame_response(df, request, format)
+
+    except Exception:
+        fail_reason = traceback.format_exc()
+        resp, _ = handle_known_failure(fail_reason, zec.FAIL_PROCESSING, res)
+        return resp
+
+
+@app.get("/zcc/getEEGSpectrum.csv")
+async def get_eeg_spectrum_csv(
+    request: Request,
+    event: str = "",
+    experimentName: str = "",
+    subjectID: str = "",
+    method: str = "rfft",
+    part: str = "",
+    format: str = "",
+):
+    """
+    Gets the spectrum of the event label, the columns are the channels and _freq.
+    The part is amplitude (default) or phase for rfft, and psd for welch and multitaper.
+    """
+    username, session = await fetch_user_identity_and_session(request)
+
+    res = mk_res(session, experimentName, subjectID)
+
+    epochs, res = get_attr_from_session(session, res, attr_name="epochs")
+    if res["_successFlag"] > 0:
+        return epochs
+
+    try:
+        spectrum = await zce.run(session.name, session.eeg_data.compute_spectrum, method)
+        part = part or next(iter(spectrum["data"]))
+        data = spectrum["data"][part][spectrum["labels"].index(event)]
 
-        csv = df2csv(df)
+        # Data shape is (freqs x channels)
+        df = pd.DataFrame(data.transpose(), columns=spectrum["ch_names"])
+        df["_freq"] = spectrum["freqs"]
 
-        return Response(csv, media_type="text/csv")
+        return mk_frame_response(df, request, format)
 
     except Exception:
         fail_reason = traceback.format_exc()
@@ -560,6 +827,79 @@ async def get_eeg_evoked_data_csv(
         return resp
 
 
+# %% ----------------------------------------------------------------
+"""
+The admin requests, only the admin users can access them.
+"""
+
+
+@app.get("/zcc/admin/sessions.json")
+async def get_admin_sessions(request: Request):
+    username = check_admin_name(request)
+    if username is None:
+        resp, _ = handle_known_failure("Only admin users are allowed", zec.OTHERS)
+        return resp
+
+    res = dict(
+        _successFlag=0,
+        memoryBudget=zss.memory_budget,
+        totalBytes=zss.total_nbytes(),
+        sessions=zss.list_sessions().to_dict(orient="records"),
+        recordings=zrc.list_recordings(),
+        evictions=list(zss.evictions),
+    )
+    return Response(json.dumps(res, default=lambda o: f"{o}"), media_type="text/json")
+
+
+@app.get("/zcc/admin/trace.json")
+async def get_admin_trace(request: Request, sessionName: str, format: str = ""):
+    """
+    Gets the spans of the pipeline stages of any session, see /zcc/getTrace.json.
+    """
+    username = check_admin_name(request)
+    if username is None:
+        resp, _ = handle_known_failure("Only admin users are allowed", zec.OTHERS)
+        return resp
+
+    with zss.lock:
+        session = zss.sessions.get(sessionName)
+    if session is None or session.eeg_data is None:
+        resp, _ = handle_known_failure(
+            f"Invalid session {sessionName}", zec.SHOULD_NOT_NONE
+        )
+        return resp
+
+    res = mk_res(session, "", session.subjectID or "")
+    return mk_trace_response(session.eeg_data.trace, res, format)
+
+
+@app.get("/zcc/admin/errors.json")
+async def get_admin_errors(request: Request, limit: int = 50, detail: bool = False):
+    """
+    Gets the recent errors, they are deduplicated by the fingerprint, the most recently seen is the first.
+    The detail=true includes the tracebacks.
+    """
+    username = check_admin_name(request)
+    if username is None:
+        resp, _ = handle_known_failure("Only admin users are allowed", zec.OTHERS)
+        return resp
+
+    errors = eb.list_errors(limit=max(limit, 0))
+    if not detail:
+        errors = [{k: v for k, v in e.items() if k != "detail"} for e in errors]
+
+    res = dict(_successFlag=0, **eb.summary(), errors=errors)
+    return Response(json.dumps(res, default=lambda o: f"{o}"), media_type="text/json")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Exposes the metrics in the Prometheus text format, see util/metrics.py for the metrics.
+    """
+    return Response(zm.render(), media_type=zm.content_type)
+
+
 # %% ----------------------------------------------------------------
 """
 The post requests which are designed submitting from button click with posting the HTML form.
@@ -576,7 +916,7 @@ async def post_template_setup_html(
     experimentName: str = "",
     subjectID: str = "",
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     # Make sure the session is using the same EEG data
     if session.subjectID != subjectID:
@@ -602,7 +942,7 @@ async def post_template_setup_html(
 async def post_template_single_sensor_analysis_html(
     request: Request, experimentName: str = "", subjectID: str = ""
 ):
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     # Make sure the session is using the same EEG data
     if session.subjectID != subjectID:
@@ -644,7 +984,7 @@ async def post_template_analysis_html(
     )
     LOGGER.debug(f"Received setup: {setup}")
 
-    username, session = fetch_user_identity_and_session(request)
+    username, session = await fetch_user_identity_and_session(request)
 
     # Make sure the session is using the same EEG data
     if session.subjectID != subjectID:
@@ -673,10 +1013,12 @@ async def post_template_analysis_html(
         l_freq = setup["filter"]["lFreq"]
         h_freq = setup["filter"]["hFreq"]
         decim = setup["filter"]["downSampling"]
-        session.collect_epochs(events, event_id, tmin, tmax, l_freq, h_freq, decim)
+        job = session.collect_epochs(
+            events, event_id, tmin, tmax, l_freq, h_freq, decim
+        )
 
         return RedirectResponse(
-            url=f"/template/analysis.html?experimentName={experimentName}&subjectID={subjectID}",
+            url=f"/template/analysis.html?experimentName={experimentName}&subjectID={subjectID}&jobID={job.id}",
             status_code=status.HTTP_303_SEE_OTHER,
         )
 
@@ -0,0 +1,132 @@
+"""
+File: bench_fast_epochs.py
+Author: Chuncheng Zhang
+Date: 2024-01-18
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Benchmark of the fast-path epoching engine against the mne.Epochs.
+
+    The synthetic raw of the RSVP-like session is used, the trials are dense and many.
+    Run it from the root of the repository:
+        python benchmark/bench_fast_epochs.py
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-18 ------------------------
+# Requirements and constants
+import sys
+import time
+import mne
+import numpy as np
+
+from pathlib import Path
+from rich import print
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from util.fast_epochs import ZccFastEpochs  # noqa: E402
+
+n_channels = 32
+sfreq = 500
+n_trials = [1000, 3000, 6000]
+tmin, tmax, decim = -0.2, 0.8, 4
+
+
+# %% ---- 2024-01-18 ------------------------
+# Function and class
+def mk_raw(n_trials: int):
+    """
+    Makes the synthetic raw with the events every 0.25 seconds.
+
+    Args:
+        n_trials (int): The number of the trials.
+
+    Returns:
+        tuple: The raw, events and event_id."""
+
+    n_times = int((n_trials * 0.25 + 2) * sfreq)
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((n_channels, n_times)).astype(np.float64) * 1e-5
+    info = mne.create_info(
+        [f"EEG{i:03d}" for i in range(n_channels)], sfreq, ch_types="eeg"
+    )
+    raw = mne.io.RawArray(data, info, verbose=False)
+
+    onsets = (np.arange(n_trials) * 0.25 * sfreq + sfreq).astype(np.int64)
+    labels = rng.integers(1, 3, n_trials)
+    events = np.column_stack([onsets, np.zeros(n_trials, dtype=np.int64), labels])
+    event_id = {"1": 1, "2": 2}
+    return raw, events, event_id
+
+
+def timeit(fn, repeat: int = 3):
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def bench(n: int):
+    raw, events, event_id = mk_raw(n)
+
+    def _mne():
+        epochs = mne.Epochs(
+            raw,
+            events=events,
+            event_id=event_id,
+            tmin=tmin,
+            tmax=tmax,
+            baseline=(tmin, None),
+            picks=["eeg"],
+            preload=True,
+            event_repeated="merge",
+            verbose=False,
+        )
+        return epochs.decimate(decim, verbose=False)
+
+    def _fast():
+        return ZccFastEpochs(
+            raw, events, event_id, tmin, tmax, baseline=(tmin, None), decim=decim
+        )
+
+    def _fast_wrapped():
+        return _fast().to_epochs_array()
+
+    a = _mne().get_data(copy=False)
+    b = _fast().data
+    assert np.allclose(a, b), "The fast path differs from the mne.Epochs"
+
+    return dict(
+        trials=n,
+        mne=timeit(_mne),
+        fast=timeit(_fast),
+        fastEpochsArray=timeit(_fast_wrapped),
+    )
+
+
+# %% ---- 2024-01-18 ------------------------
+# Play ground
+if __name__ == "__main__":
+    for n in n_trials:
+        res = bench(n)
+        res["speedUp"] = res["mne"] / res["fast"]
+        print(res)
+
+
+# %% ---- 2024-01-18 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-18 ------------------------
+# Pending
@@ -0,0 +1,138 @@
+"""
+File: bench_import_time.py
+Author: Chuncheng Zhang
+Date: 2024-01-24
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Benchmark of the startup, it checks the import time of the app against the budget.
+
+    The app is imported in the fresh interpreter, and the import is timed inside it,
+    so the startup of the interpreter is not counted.
+    The import of the fastapi alone is timed as well, it is the floor of the app on the box.
+    The slowest modules are listed by the separate run with the -X importtime option, since the option slows the import.
+    The exit code is 1 if the import is over the budget, or any of the deferred modules is imported.
+    Run it from the root of the repository:
+        python benchmark/bench_import_time.py
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-24 ------------------------
+# Requirements and constants
+import sys
+import json
+import subprocess
+
+from pathlib import Path
+from rich import print
+
+root = Path(__file__).parent.parent
+
+module = "app"
+budget_secs = 1.0
+n_repeats = 3
+n_slowest = 15
+
+# The heavy modules are imported at their first use, see util.LazyModule
+deferred_modules = ["mne", "pandas", "numpy", "scipy", "matplotlib", "omegaconf"]
+
+
+# %% ---- 2024-01-24 ------------------------
+# Function and class
+def run_python(args: list, module: str):
+    completed = subprocess.run(
+        [sys.executable, *args], cwd=root, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        print(completed.stderr[-2000:])
+        raise RuntimeError(f"Failed importing {module}")
+    return completed
+
+
+def import_once(module: str):
+    """
+    Imports the module in the fresh interpreter, and times the import inside it.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        tuple: The import time in seconds, and the deferred modules which are imported."""
+
+    code = "\n".join(
+        [
+            "import sys, json, time",
+            "t = time.perf_counter()",
+            f"import {module}",
+            "secs = time.perf_counter() - t",
+            f"print(json.dumps([secs, [m for m in {deferred_modules!r} if m in sys.modules]]))",
+        ]
+    )
+    completed = run_python(["-c", code], module)
+    secs, imported = json.loads(completed.stdout.strip().splitlines()[-1])
+    return secs, imported
+
+
+def import_records(module: str):
+    """
+    Imports the module in the fresh interpreter with the -X importtime option.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        list: The import times of (self us, cumulative us, name)."""
+
+    completed = run_python(["-X", "importtime", "-c", f"import {module}"], module)
+
+    records = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        records.append((int(self_us), int(cumulative_us), name.rstrip()))
+
+    return records
+
+
+# %% ---- 2024-01-24 ------------------------
+# Play ground
+if __name__ == "__main__":
+    records = import_records(module)
+    print(f"Slowest modules (self time) of importing {module}:")
+    for self_us, cumulative_us, name in sorted(records, reverse=True)[:n_slowest]:
+        print(f"{self_us / 1e3:10.1f} ms | {cumulative_us / 1e3:10.1f} ms | {name}")
+
+    best_secs, imported = min(import_once(module) for _ in range(n_repeats))
+    floor_secs, _ = min(import_once("fastapi") for _ in range(n_repeats))
+
+    print(f"Import fastapi: {floor_secs:.3f} secs (best of {n_repeats}), the floor of the box")
+    print(f"Import {module}: {best_secs:.3f} secs (best of {n_repeats}), budget {budget_secs} secs")
+
+    failed = False
+    if imported:
+        print(f"Imported the deferred modules: {imported}")
+        failed = True
+
+    if best_secs > budget_secs:
+        print("Over the budget")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+# %% ---- 2024-01-24 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-24 ------------------------
+# Pending
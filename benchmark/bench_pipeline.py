@@ -0,0 +1,285 @@
+"""
+File: bench_pipeline.py
+Author: Chuncheng Zhang
+Date: 2024-01-25
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Benchmark of the whole pipeline with the synthetic recordings.
+
+    The synthetic data root and the cache root are made in the temporary folder,
+    and the app uses them by the ZCC_DATA_ROOT and ZCC_CACHE_ROOT environment variables.
+    - stages: load_raw, fix_montage, get_events, collect_epochs and compute_tfr_morlet,
+      they are timed for every format, the first repeat runs with the cold caches;
+    - endpoints: the /zcc/ routes are timed through the in-process ASGI client,
+      the epochs are collected by the analysis form, the same as the browser.
+    The results are written into the JSON file, so the runs on different boxes are comparable.
+    Run it from the root of the repository:
+        python benchmark/bench_pipeline.py --secs 600 --channels 32 --output bench-pipeline.json
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-25 ------------------------
+# Requirements and constants
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic_data import mk_recording  # noqa: E402
+
+setup = dict(tmin=-0.2, tmax=0.8, l_freq=1.0, h_freq=30.0, decim=2)
+
+
+# %% ---- 2024-01-25 ------------------------
+# Function and class
+def summary(secs: list):
+    return dict(
+        secs=[round(s, 6) for s in secs],
+        cold=round(secs[0], 6),
+        min=round(min(secs), 6),
+        median=round(statistics.median(secs), 6),
+    )
+
+
+def timeit(records: dict, name: str, fn, *args, **kwargs):
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    records.setdefault(name, []).append(time.perf_counter() - t)
+    return result
+
+
+def bench_stages(path: Path, repeats: int):
+    """
+    Times the stages of the pipeline, every repeat uses the new ZccEEGEpochs,
+    so only the disk caches are shared between the repeats.
+
+    Args:
+        path (Path): The path of the recording.
+        repeats (int): The number of the repeats.
+
+    Returns:
+        dict: The summary of the stages."""
+
+    from util.phase_2nd_collect_epochs import ZccEEGEpochs
+
+    records = {}
+    for _ in range(repeats):
+        eeg = ZccEEGEpochs(path)
+        timeit(records, "load_raw", eeg.load_raw)
+        assert eeg.raw is not None, f"Failed loading {path}"
+        timeit(records, "fix_montage", eeg.fix_montage)
+        events, event_id = timeit(records, "get_events", eeg.get_events)
+        timeit(
+            records,
+            "collect_epochs",
+            eeg.collect_epochs,
+            sorted(set(events[:, 2])),
+            event_id,
+            setup["tmin"],
+            setup["tmax"],
+            setup["l_freq"],
+            setup["h_freq"],
+            setup["decim"],
+        )
+        timeit(
+            records,
+            "compute_tfr_morlet",
+            eeg.compute_tfr_morlet,
+            eeg.epochs.ch_names[0],
+            sorted(event_id)[0],
+        )
+
+    return {k: summary(v) for k, v in records.items()}
+
+
+def bench_endpoints(subjectID: str, repeats: int, timeout: float = 600):
+    """
+    Times the endpoints through the in-process ASGI client.
+
+    Args:
+        subjectID (str): The subjectID of the synthetic recording.
+        repeats (int): The number of the repeats of every endpoint.
+        timeout (float): The timeout of the epochs collection in seconds.
+
+    Returns:
+        dict: The summary of the endpoints, and their status codes."""
+
+    from starlette.testclient import TestClient
+
+    import app as zcc_app
+
+    records = {}
+    status_codes = {}
+
+    def _get(client: TestClient, url: str, name: str = None):
+        name = name or url.split("?")[0]
+        resp = timeit(records, name, client.get, url)
+        status_codes.setdefault(name, set()).add(resp.status_code)
+        return resp
+
+    with TestClient(zcc_app.app) as client:
+        zcc_app.ZccSession.zfs.refresh()
+
+        _get(client, "/zcc/getDataFiles.csv")
+        _get(client, f"/zcc/startWithEEGRaw.json?subjectID={subjectID}")
+
+        for _ in range(repeats):
+            _get(client, "/zcc/getDataFiles.csv")
+            _get(client, "/zcc/getEEGRawInfo.json")
+            _get(client, "/zcc/getEEGRawMontage.json")
+            _get(client, "/zcc/getEEGRawEvents.csv")
+            _get(client, "/zcc/getEEGRawData.csv?seconds=10&windowLength=10")
+            _get(client, "/zcc/getEEGRawData.csv?seconds=0&windowLength=600&maxPoints=2000", "/zcc/getEEGRawData.csv(overview)")
+
+        # The epochs are collected by the analysis form, and the job is polled until it is done
+        session = zcc_app.zss.get_session(check_user_name_default(zcc_app))
+        labels = sorted(session.eeg_data.event_id)
+        form = dict(
+            events=json.dumps(dict(value=[dict(label=e) for e in labels])),
+            filter=json.dumps(
+                dict(value=dict(lFreq=setup["l_freq"], hFreq=setup["h_freq"], downSampling=setup["decim"]))
+            ),
+            crop=json.dumps(dict(value=dict(tMin=setup["tmin"], tMax=setup["tmax"]))),
+        )
+        t = time.perf_counter()
+        resp = client.post(
+            f"/template/analysis.html?subjectID={subjectID}", data=form, follow_redirects=False
+        )
+        status_codes["/template/analysis.html(job)"] = {resp.status_code}
+        while time.perf_counter() - t < timeout:
+            job = client.get("/zcc/getJobStatus.json").json()
+            if job.get("status") in ("done", "failed", "cancelled"):
+                break
+            time.sleep(0.05)
+        records["/template/analysis.html(job)"] = [time.perf_counter() - t]
+        assert job.get("status") == "done", f"Failed collecting epochs: {job}"
+
+        ch_name = session.eeg_data.epochs.ch_names[0]
+        for _ in range(repeats):
+            _get(client, "/zcc/getEEGEpochsEvents.csv")
+            _get(client, f"/zcc/getEEGEvokedData.csv?event={labels[0]}")
+            _get(client, f"/zcc/getEEGEvokedData.csv?event={labels[0]}&dataType=freqDomain", "/zcc/getEEGEvokedData.csv(freqDomain)")
+            _get(client, f"/zcc/getEEGSpectrum.csv?event={labels[0]}&method=welch")
+            _get(client, f"/zcc/getEEGSingleSensorData.csv?sensorName={ch_name}")
+            _get(client, f"/zcc/getEEGSingleSensorAveragedData.csv?sensorName={ch_name}&eventLabel={labels[0]}")
+            _get(client, f"/zcc/getEEGSingleSensorAveragedTfrMorlet.csv?sensorName={ch_name}&eventLabel={labels[0]}")
+
+    return {
+        k: summary(v) | dict(status_codes=sorted(status_codes.get(k, [])))
+        for k, v in records.items()
+    }
+
+
+def check_user_name_default(zcc_app):
+    # The requests without the access_token use the default username
+    from starlette.requests import Request
+
+    return zcc_app.check_user_name(Request(dict(type="http", headers=[])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline with the synthetic recordings.")
+    parser.add_argument("--formats", nargs="+", default=["bdf", "cnt"], choices=["bdf", "cnt"])
+    parser.add_argument("--channels", type=int, default=32)
+    parser.add_argument("--secs", type=float, default=600)
+    parser.add_argument("--sfreq", type=int, default=500)
+    parser.add_argument("--events-per-sec", type=float, default=1.0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-endpoints", action="store_true")
+    parser.add_argument("--workdir", type=Path, default=None, help="Default is the temporary folder")
+    parser.add_argument("--output", type=Path, default=Path("bench-pipeline.json"))
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="zcc-bench-"))
+    data_root = workdir.joinpath("data")
+    cache_root = workdir.joinpath("cache")
+    cache_root.mkdir(parents=True, exist_ok=True)
+
+    # The roots are read when the util is imported
+    os.environ["ZCC_DATA_ROOT"] = str(data_root)
+    os.environ["ZCC_CACHE_ROOT"] = str(cache_root)
+
+    import mne
+    import numpy as np
+
+    from util import LOGGER
+
+    if not args.verbose:
+        mne.set_log_level("ERROR")
+        LOGGER.remove()
+
+    recording = dict(
+        n_channels=args.channels,
+        secs=args.secs,
+        sfreq=args.sfreq,
+        events_per_sec=args.events_per_sec,
+    )
+
+    results = dict(
+        meta=dict(
+            time=datetime.now().isoformat(timespec="seconds"),
+            platform=platform.platform(),
+            python=platform.python_version(),
+            cpu_count=os.cpu_count(),
+            numpy=np.__version__,
+            mne=mne.__version__,
+            workdir=str(workdir),
+        ),
+        recording=recording,
+        setup=setup,
+        repeats=args.repeats,
+        stages={},
+        endpoints={},
+    )
+
+    for fmt in args.formats:
+        t = time.perf_counter()
+        path = mk_recording(data_root.joinpath("MI", fmt.upper()), fmt, **recording)
+        print(f"Generated {path} in {time.perf_counter() - t:.2f} secs")
+
+        results["stages"][fmt] = bench_stages(path, args.repeats)
+        for stage, s in results["stages"][fmt].items():
+            print(f"{fmt:4s} | {stage:20s} | cold {s['cold']:8.3f} | median {s['median']:8.3f} secs")
+
+    # The app searches the data.bdf files only
+    if not args.no_endpoints and "bdf" in args.formats:
+        results["endpoints"] = bench_endpoints("MI-BDF-data.bdf", args.repeats)
+        for name, s in results["endpoints"].items():
+            print(f"{name:60s} | cold {s['cold']:8.3f} | median {s['median']:8.3f} secs | {s['status_codes']}")
+
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Wrote {args.output}")
+
+
+# %% ---- 2024-01-25 ------------------------
+# Play ground
+if __name__ == "__main__":
+    main()
+
+
+# %% ---- 2024-01-25 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-25 ------------------------
+# Pending
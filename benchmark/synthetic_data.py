@@ -0,0 +1,323 @@
+"""
+File: synthetic_data.py
+Author: Chuncheng Zhang
+Date: 2024-01-25
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Generator of the synthetic recordings, they are used by the benchmarks.
+
+    The recordings are written in the formats the app reads,
+    - bdf: the data.bdf of the 24-bit BioSemi data, and the evt.bdf of the BDF+ annotations;
+    - cnt: the Neuroscan .cnt file of the 16-bit data, and the event table of type 1.
+    The length, channel count, sampling frequency and event density are configurable,
+    the data is the white noise of 10 uV with the evoked bump after every event.
+    Generate the data root with the folders of the experiments like:
+        python benchmark/synthetic_data.py /tmp/zcc-data --secs 600 --channels 32
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-25 ------------------------
+# Requirements and constants
+import struct
+import argparse
+import numpy as np
+
+from pathlib import Path
+
+ch_names_1020 = [
+    "FP1", "FP2", "F7", "F3", "FZ", "F4", "F8", "FC5", "FC1", "FC2", "FC6",
+    "T7", "C3", "CZ", "C4", "T8", "CP5", "CP1", "CP2", "CP6",
+    "P7", "P3", "PZ", "P4", "P8", "PO3", "PO4", "O1", "OZ", "O2",
+    "AF3", "AF4", "F5", "F1", "F2", "F6", "FT7", "FC3", "FC4", "FT8",
+    "C5", "C1", "C2", "C6", "TP7", "CP3", "CPZ", "CP4", "TP8",
+    "P5", "P1", "P2", "P6", "PO7", "POZ", "PO8", "FPZ", "AFZ", "FCZ", "IZ",
+]  # fmt: skip
+
+event_labels = ["1", "2", "3"]
+
+
+# %% ---- 2024-01-25 ------------------------
+# Function and class
+def mk_signal(n_channels: int, secs: float, sfreq: int, events_per_sec: float, seed: int = 0):
+    """
+    Makes the synthetic signal and its events.
+
+    Args:
+        n_channels (int): The number of channels.
+        secs (float): The length of the recording in seconds.
+        sfreq (int): The sampling frequency.
+        events_per_sec (float): The density of the events.
+        seed (int): The random seed.
+
+    Returns:
+        tuple: The data in uV of (channels x times), the channel names, the onsets in seconds and the labels."""
+
+    rng = np.random.default_rng(seed)
+    n_times = int(secs * sfreq)
+
+    ch_names = [
+        ch_names_1020[i] if i < len(ch_names_1020) else f"E{i}" for i in range(n_channels)
+    ]
+    data = rng.standard_normal((n_channels, n_times)) * 10
+
+    # The events keep 1 second away from the edges
+    n_events = max(1, int((secs - 2) * events_per_sec))
+    onsets = np.sort(rng.uniform(1, secs - 1, n_events))
+    labels = rng.choice(event_labels, n_events)
+
+    # The evoked bump of 20 uV, its amplitude depends on the label
+    bump = np.hanning(int(0.3 * sfreq)) * 20
+    for onset, label in zip(onsets, labels):
+        start = int(onset * sfreq) + int(0.1 * sfreq)
+        stop = min(start + len(bump), n_times)
+        data[:, start:stop] += bump[: stop - start] * int(label) / len(event_labels)
+
+    return data, ch_names, onsets, labels
+
+
+def _field(value, n: int):
+    s = f"{value}".encode("ascii")[:n]
+    return s + b" " * (n - len(s))
+
+
+def _bdf_header(labels, n_samples, n_records, reserved, phys, dig, units):
+    ns = len(labels)
+    header = b"\xffBIOSEMI" + _field("X X X X", 80) + _field("Startdate X X X X", 80)
+    header += _field("01.01.24", 8) + _field("00.00.00", 8)
+    header += _field(256 * (ns + 1), 8) + _field(reserved, 44)
+    header += _field(n_records, 8) + _field(1, 8) + _field(ns, 4)
+    columns = [
+        (labels, 16),
+        ([""] * ns, 80),
+        (units, 8),
+        ([phys[0]] * ns, 8),
+        ([phys[1]] * ns, 8),
+        ([dig[0]] * ns, 8),
+        ([dig[1]] * ns, 8),
+        ([""] * ns, 80),
+        (n_samples, 8),
+        ([""] * ns, 32),
+    ]
+    for values, n in columns:
+        header += b"".join(_field(v, n) for v in values)
+    return header
+
+
+def write_bdf(path: Path, data_uv, sfreq: int, ch_names: list):
+    """
+    Writes the data into the 24-bit BDF file, the records are 1 second long.
+
+    Args:
+        path (Path): The path of the data.bdf.
+        data_uv (array): The data in uV of (channels x times).
+        sfreq (int): The sampling frequency.
+        ch_names (list): The channel names."""
+
+    n_channels, n_times = data_uv.shape
+    n_records = int(np.ceil(n_times / sfreq))
+    data = np.pad(data_uv, ((0, 0), (0, n_records * sfreq - n_times)))
+
+    dig = (-8388608, 8388607)
+    phys = (-262144, 262143)
+    # The same linear mapping of the digital values as the readers
+    gain = (phys[1] - phys[0]) / (dig[1] - dig[0])
+    ints = np.round((data - phys[0]) / gain + dig[0]).astype("<i4")
+
+    with open(path, "wb") as f:
+        f.write(
+            _bdf_header(
+                ch_names, [sfreq] * n_channels, n_records, "24BIT", phys, dig, ["uV"] * n_channels
+            )
+        )
+        # The records of (channels x samples), every sample is the 3 little-endian bytes
+        blocks = ints.reshape(n_channels, n_records, sfreq).transpose(1, 0, 2)
+        f.write(np.ascontiguousarray(blocks).view(np.uint8).reshape(-1, 4)[:, :3].tobytes())
+
+
+def write_evt_bdf(path: Path, onsets, labels, n_records: int):
+    """
+    Writes the events into the BDF+ annotations file.
+
+    Args:
+        path (Path): The path of the evt.bdf.
+        onsets (array): The onsets in seconds.
+        labels (array): The labels.
+        n_records (int): The number of the 1 second records."""
+
+    tals = {}
+    for onset, label in zip(onsets, labels):
+        tals.setdefault(int(onset), []).append(f"+{onset:.4f}\x14{label}\x14\x00".encode())
+
+    records = [
+        f"+{r}\x14\x14\x00".encode() + b"".join(tals.get(r, [])) for r in range(n_records)
+    ]
+    n_samples = max(60, *(int(np.ceil(len(b) / 3)) for b in records))
+
+    with open(path, "wb") as f:
+        f.write(
+            _bdf_header(
+                ["BDF Annotations"], [n_samples], n_records, "BDF+C", (-1, 1), (-8388608, 8388607), [""]
+            )
+        )
+        for b in records:
+            f.write(b + b"\x00" * (n_samples * 3 - len(b)))
+
+
+def write_cnt(path: Path, data_uv, sfreq: int, ch_names: list, onsets, labels):
+    """
+    Writes the data and events into the Neuroscan .cnt file.
+    The SETUP header is 900 bytes, every ELECTLOC is 75 bytes,
+    the 16-bit data is multiplexed, and the event table of type 1 follows the data.
+
+    Args:
+        path (Path): The path of the .cnt file.
+        data_uv (array): The data in uV of (channels x times), 1 uV per count.
+        sfreq (int): The sampling frequency.
+        ch_names (list): The channel names, they are at most 10 bytes.
+        onsets (array): The onsets in seconds.
+        labels (array): The labels, they are integers."""
+
+    n_channels, n_times = data_uv.shape
+    data_offset = 900 + 75 * n_channels
+    event_table_pos = data_offset + 2 * n_channels * n_times
+
+    setup = bytearray(900)
+    setup[0:12] = b"Version 3.0\x00"
+    setup[225:235] = b"01/01/24\x00\x00"
+    setup[235:247] = b"00:00:00\x00\x00\x00\x00"
+    struct.pack_into("<H", setup, 370, n_channels)
+    struct.pack_into("<H", setup, 376, sfreq)
+    struct.pack_into("<i", setup, 864, n_times)
+    struct.pack_into("<i", setup, 886, event_table_pos)
+    struct.pack_into("<f", setup, 890, n_times / sfreq)
+    struct.pack_into("<i", setup, 894, 0)  # The data is multiplexed
+
+    electrodes = bytearray(75 * n_channels)
+    for i, name in enumerate(ch_names):
+        offset = 75 * i
+        electrodes[offset : offset + 10] = name.encode("ascii")[:9].ljust(10, b"\x00")
+        # The 1 uV per count
+        struct.pack_into("<f", electrodes, offset + 59, 204.8)
+        struct.pack_into("<f", electrodes, offset + 71, 1.0)
+
+    # The event offsets are the file offsets of the samples
+    samples = (np.asarray(onsets) * sfreq).astype(np.int64)
+    events = b"".join(
+        struct.pack("<HBcl", int(label), 0, b"\x00", data_offset + (s + 1) * 2 * n_channels)
+        for s, label in zip(samples, labels)
+    )
+
+    with open(path, "wb") as f:
+        f.write(setup)
+        f.write(electrodes)
+        f.write(np.clip(np.round(data_uv), -32768, 32767).astype("<i2").T.tobytes())
+        f.write(struct.pack("<Bll", 1, len(events), 0))
+        f.write(events)
+
+
+def mk_recording(
+    folder: Path,
+    fmt: str = "bdf",
+    n_channels: int = 32,
+    secs: float = 600,
+    sfreq: int = 500,
+    events_per_sec: float = 1.0,
+    seed: int = 0,
+):
+    """
+    Makes the synthetic recording in the folder.
+
+    Args:
+        folder (Path): The folder of the recording.
+        fmt (str): The format, bdf or cnt.
+        n_channels (int): The number of channels.
+        secs (float): The length of the recording in seconds.
+        sfreq (int): The sampling frequency.
+        events_per_sec (float): The density of the events.
+        seed (int): The random seed.
+
+    Returns:
+        Path: The path of the data.bdf or data.cnt."""
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    data, ch_names, onsets, labels = mk_signal(n_channels, secs, sfreq, events_per_sec, seed)
+
+    if fmt == "bdf":
+        path = folder.joinpath("data.bdf")
+        write_bdf(path, data, sfreq, ch_names)
+        write_evt_bdf(folder.joinpath("evt.bdf"), onsets, labels, int(np.ceil(secs)))
+        return path
+
+    if fmt == "cnt":
+        path = folder.joinpath("data.cnt")
+        write_cnt(path, data, sfreq, ch_names, onsets, labels)
+        return path
+
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def mk_data_root(root: Path, experiments: list = None, subjects: int = 1, **kwargs):
+    """
+    Makes the data root of <experiment>/S<n>/ folders, the same layout as the real data root.
+
+    Args:
+        root (Path): The data root.
+        experiments (list): The experiment folders, default is ['MI'].
+        subjects (int): The number of subjects of every experiment.
+        **kwargs: The arguments of the mk_recording.
+
+    Returns:
+        list: The paths of the recordings."""
+
+    paths = []
+    for experiment in experiments or ["MI"]:
+        for i in range(subjects):
+            folder = Path(root).joinpath(experiment, f"S{i + 1}")
+            paths.append(mk_recording(folder, seed=len(paths), **kwargs))
+    return paths
+
+
+# %% ---- 2024-01-25 ------------------------
+# Play ground
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic data root.")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--format", default="bdf", choices=["bdf", "cnt"])
+    parser.add_argument("--experiments", nargs="+", default=["MI"])
+    parser.add_argument("--subjects", type=int, default=1)
+    parser.add_argument("--channels", type=int, default=32)
+    parser.add_argument("--secs", type=float, default=600)
+    parser.add_argument("--sfreq", type=int, default=500)
+    parser.add_argument("--events-per-sec", type=float, default=1.0)
+    args = parser.parse_args()
+
+    for path in mk_data_root(
+        args.root,
+        args.experiments,
+        args.subjects,
+        fmt=args.format,
+        n_channels=args.channels,
+        secs=args.secs,
+        sfreq=args.sfreq,
+        events_per_sec=args.events_per_sec,
+    ):
+        print(path)
+
+
+# %% ---- 2024-01-25 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-25 ------------------------
+# Pending
@@ -18,6 +18,8 @@ Functions:
 
 # %% ---- 2023-11-27 ------------------------
 # Requirements and constants
+import time
+
 from rich import print, inspect
 from pathlib import Path
 
@@ -28,17 +30,81 @@ from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.gzip import GZipMiddleware
 
+from starlette.routing import Match
 from starlette.middleware.sessions import SessionMiddleware
 
+from util.metrics import ZccMetrics
+
 from .tools import unique_md5
 from .auth import *
 
+zm = ZccMetrics()
+
 
 # %% ---- 2023-11-27 ------------------------
 # Function and class
+class ZccGZipMiddleware(GZipMiddleware):
+    """
+    The GZipMiddleware except the Server-Sent Events,
+    since the gzip compressor holds the pushed events until its buffer is full.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            accept = dict(scope["headers"]).get(b"accept", b"")
+            if b"text/event-stream" in accept:
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+
+class ZccMetricsMiddleware(object):
+    """
+    Records the latency, response bytes and in-flight requests of the routes into the ZccMetrics.
+    The route is the path template, like /template/{template_name}, so the paths do not explode the labels.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _route(self, scope):
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+        nbytes = 0
+
+        async def _send(message):
+            nonlocal status, nbytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                nbytes += len(message.get("body", b""))
+            await send(message)
+
+        zm.in_flight.inc((method, route))
+        t = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            zm.in_flight.dec((method, route))
+            zm.observe_request(method, route, status, time.perf_counter() - t, nbytes)
+
+
 app = FastAPI()
-app.add_middleware(GZipMiddleware)
+app.add_middleware(ZccGZipMiddleware)
 app.add_middleware(SessionMiddleware, secret_key="secret_key")
+app.add_middleware(ZccMetricsMiddleware)
 app.mount("/static", StaticFiles(directory="web/static"), name="static")
 app.mount("/src", StaticFiles(directory="web/src"), name="src")
 app.mount("/asset", StaticFiles(directory="asset"), name="asset")
@@ -67,6 +133,20 @@ def check_user_name(request: Request):
     return default
 
 
+def check_admin_name(request: Request):
+    """
+    Checks the user is one of the admin users.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Returns:
+        str or None: The username if the user is an admin user, None otherwise."""
+
+    username = check_user_name(request)
+    return username if username in admin_users else None
+
+
 # %%
 
 # %% ----------------------------------------------------------------
@@ -15,7 +15,9 @@ Functions:
     4. Pending
     5. Pending
 """
-import subprocess
+import os
+import time
+import secrets
 
 
 from datetime import datetime, timedelta, timezone
@@ -27,6 +29,8 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
+from util import _folders
+
 # %%
 
 
@@ -108,6 +112,37 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     return user
 
 
+def load_secret_key():
+    """
+    Loads the secret key of the tokens, every worker process must use the same key,
+    otherwise the token issued by one worker fails to decode on the others.
+    The key is the ZCC_SECRET_KEY environment variable,
+    or it is generated once into the secret_key file of the cache root, and the workers read it.
+
+    Returns:
+        str: The secret key."""
+
+    if key := os.environ.get("ZCC_SECRET_KEY"):
+        return key
+
+    path = _folders["cache_root"].joinpath("secret_key")
+    try:
+        # Only one worker creates the file
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # The creator may be still writing it
+        for _ in range(100):
+            if key := path.read_text().strip():
+                return key
+            time.sleep(0.05)
+        raise RuntimeError(f"Empty secret key file: {path}")
+
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key
+
+
 async def get_current_active_user(
     current_user: Annotated[User, Depends(get_current_user)]
 ):
@@ -119,31 +154,37 @@ async def get_current_active_user(
 # Play ground
 
 # ? I do not quite sure if it crushes when the variables are set below
-# to get a string like this run:
-# openssl rand -hex 32
+# The same as running: openssl rand -hex 32, but without the subprocess,
+# and it is shared by the workers of uvicorn app:app --workers N
 # "f67dd244499e46a3a3aca6eae90f5a6f95a3925d0a0f5f2d4556cf109d16b6b1"
-SECRET_KEY = subprocess.check_output(['openssl', 'rand', '-hex', '32'])
+SECRET_KEY = load_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# The bcrypt hash of 'secret', hashing it at import costs the startup hundreds of milliseconds
+# get_password_hash('secret')
+_secret_hash = "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW"
+
 fake_users_db = {
     "chuncheng": {
         "username": "chuncheng",
         "full_name": "Chuncheng Zhang",
         "email": "chuncheng.zhang@ia.ac.cn",
-        # "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW",
-        "hashed_password": get_password_hash('secret'),
+        "hashed_password": _secret_hash,
         "disabled": False,
     },
     "noone": {
         "username": "noone",
         "full_name": "No one can save me",
         "email": "nobody@nowhere.com",
-        "hashed_password": get_password_hash('secret'),
+        "hashed_password": _secret_hash,
         "disabled": False,
     },
 }
 
+# The users who can access the /zcc/admin/ routes
+admin_users = ["chuncheng"]
+
 
 # %% ---- 2023-11-30 ------------------------
 # Pending
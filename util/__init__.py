@@ -18,23 +18,26 @@ Functions:
 
 # %% ---- 2023-11-23 ------------------------
 # Requirements and constants
+import os
+import importlib
 
 from loguru import logger
 
 from enum import Enum
 from pathlib import Path
 from datetime import datetime
-from omegaconf import OmegaConf
+from threading import Lock
 
 from dataclasses import dataclass
 
 # %%
 root = Path(__file__).parent.parent
 
+# The roots can be changed by the environment variables, like the benchmarks with the synthetic data
 _folders = dict(
     log=root.joinpath("log"),
-    cache_root=root.joinpath("filesystem"),
-    data_root=Path("D:\脑机接口专项"),
+    cache_root=Path(os.environ.get("ZCC_CACHE_ROOT", root.joinpath("filesystem"))),
+    data_root=Path(os.environ.get("ZCC_DATA_ROOT", "D:\脑机接口专项")),
 )
 
 [v.mkdir(exist_ok=True) for k, v in _folders.items()]
@@ -67,6 +70,38 @@ def singleton(cls, *args, **kw):
     return _singleton
 
 
+class LazyModule(object):
+    """
+    LazyModule class.
+
+    The module is imported at its first attribute access, so the heavy modules, like mne and pandas,
+    do not slow down the startup of the app.
+    The importing is locked, since the first access may come from the threads concurrently.
+    The annotations of the lazy modules should be the strings, like "pd.DataFrame",
+    otherwise they are evaluated at the definition.
+
+    Args:
+        name (str): The name of the module.
+
+    Examples:
+        pd = LazyModule("pandas")
+        df = pd.DataFrame()"""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_lock"] = Lock()
+
+    def __getattr__(self, attr: str):
+        with self._lock:
+            module = importlib.import_module(self._name)
+            # The later accesses skip the __getattr__
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name}>"
+
+
 # %%
 # CONF
 @dataclass
@@ -95,8 +130,22 @@ class Dynamic(Runtime):
     protocol: AllowedProtocol = AllowedProtocol.MI
 
 
-CONF = OmegaConf.structured(Dynamic)
-LOGGER.debug(f"Started with {CONF}")
+_conf = None
+
+
+def __getattr__(name: str):
+    # The CONF is built at its first use, the omegaconf is slow to import
+    global _conf
+    if name == "CONF":
+        if _conf is None:
+            from omegaconf import OmegaConf
+
+            _conf = OmegaConf.structured(Dynamic)
+        return _conf
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+LOGGER.debug(f"Started with {Dynamic()}")
 
 # %% ---- 2023-11-23 ------------------------
 # Play ground
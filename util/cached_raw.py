@@ -0,0 +1,76 @@
+"""
+File: cached_raw.py
+Author: Chuncheng Zhang
+Date: 2024-01-28
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    The raw of the memory-mapped data.npy, it is used by the decoded cache and the filtered raw cache.
+
+    The class subclasses the mne.io.BaseRaw, so the module imports the mne,
+    and it is imported by the functions which make the raw, not at the startup of the app.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-28 ------------------------
+# Requirements and constants
+import mne
+import numpy as np
+
+from pathlib import Path
+
+
+# %% ---- 2024-01-28 ------------------------
+# Function and class
+class ZccCachedRaw(mne.io.BaseRaw):
+    """
+    ZccCachedRaw class.
+
+    The raw whose data is read from the memory-mapped data.npy on demand.
+    The calibrations of the info are 1, since the data is stored in volts.
+
+    Args:
+        info (mne.Info): The info of the raw.
+        fname (Path): The path of the data.npy.
+        n_times (int): The number of time points.
+    """
+
+    def __init__(self, info, fname: Path, n_times: int):
+        super(ZccCachedRaw, self).__init__(
+            info,
+            preload=False,
+            last_samps=(n_times - 1,),
+            filenames=(str(fname),),
+            orig_format="single",
+            verbose=False,
+        )
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        # Open the memmap on every read, so copying the raw never copies the data
+        one = np.load(self._filenames[fi], mmap_mode="r")[:, start:stop]
+        one = np.asarray(one, dtype=data.dtype)
+        if mult is not None:
+            data[:] = mult @ one[idx]
+        else:
+            data[:] = one[idx]
+            data *= cals
+
+
+# %% ---- 2024-01-28 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-28 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-28 ------------------------
+# Pending
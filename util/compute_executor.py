@@ -0,0 +1,150 @@
+"""
+File: compute_executor.py
+Author: Chuncheng Zhang
+Date: 2024-01-23
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Compute executor, it keeps the CPU-bound work off the asyncio event loop.
+
+    The handlers await the heavy calls in the bounded thread pool,
+    the calls using the session's MNE objects run in threads, since the objects live in this process,
+    and the numerical work spends most of its time in NumPy and SciPy, which release the GIL.
+    The pure array functions can run in the process pool, their arguments are pickled,
+    only the TFR cube of the large epochs uses it, see ZccEEGEpochs.compute_tfr_cube.
+    Every user runs at most per_user_limit calls at the same time,
+    so one user's heavy requests do not occupy all the workers.
+    The cheap calls, like searching the data files, syncing the session state and building the small CSVs,
+    run in their own small thread pool, so they never queue behind the heavy calls, like loading the raw and the TFR.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-23 ------------------------
+# Requirements and constants
+import os
+import asyncio
+import multiprocessing
+
+from functools import partial
+from threading import Lock
+from weakref import WeakValueDictionary
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import LOGGER, singleton
+
+
+# %% ---- 2024-01-23 ------------------------
+# Function and class
+@singleton
+class ZccComputeExecutor(object):
+    """
+    ZccComputeExecutor class.
+
+    Examples:
+        zce = ZccComputeExecutor()
+        df = await zce.run(session.name, compute, *args)  # Inside the handler
+        df = await zce.run_cheap(session.name, search, *args)  # The cheap call inside the handler
+        future = zce.submit_process(fn, array)  # From any thread
+        result = future.result()"""
+
+    thread_workers = 8
+    cheap_workers = 4
+    process_workers = max(1, (os.cpu_count() or 2) // 2)
+    per_user_limit = 2
+
+    def __init__(self):
+        self.lock = Lock()
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=self.thread_workers, thread_name_prefix="zcc-compute"
+        )
+        self.cheap_pool = ThreadPoolExecutor(
+            max_workers=self.cheap_workers, thread_name_prefix="zcc-cheap"
+        )
+        self.process_pool = None
+        # The semaphores are removed when no call of the user is running or waiting
+        self.semaphores = WeakValueDictionary()
+
+    def _semaphore(self, owner: str):
+        with self.lock:
+            semaphore = self.semaphores.get(owner)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.per_user_limit)
+                self.semaphores[owner] = semaphore
+            return semaphore
+
+    async def run(self, owner: str, fn, *args, **kwargs):
+        """
+        Runs the fn in the thread pool, and waits for its result without blocking the event loop.
+
+        Args:
+            owner (str): The user, the calls of the same user are limited by the per_user_limit.
+            fn (callable): The computation.
+
+        Returns:
+            object: The return of the fn."""
+
+        return await self._run(self.thread_pool, owner, fn, *args, **kwargs)
+
+    async def run_cheap(self, owner: str, fn, *args, **kwargs):
+        """
+        Runs the cheap fn in the cheap thread pool, so it does not queue behind the heavy calls.
+        The fn should return in milliseconds, the waiting or the heavy computation should use the run.
+
+        Args:
+            owner (str): The user, the cheap calls of the same user are limited by the per_user_limit.
+            fn (callable): The computation.
+
+        Returns:
+            object: The return of the fn."""
+
+        return await self._run(self.cheap_pool, f"{owner}/cheap", fn, *args, **kwargs)
+
+    async def _run(self, pool: ThreadPoolExecutor, key: str, fn, *args, **kwargs):
+        semaphore = self._semaphore(key)
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+
+    def _process_pool(self):
+        with self.lock:
+            if self.process_pool is None:
+                # Spawn the workers, since forking the process with threads is unsafe
+                self.process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                LOGGER.debug(f"Started process pool of {self.process_workers} workers")
+            return self.process_pool
+
+    def submit_process(self, fn, *args):
+        """
+        Submits the pure function into the process pool.
+        The fn and args must be picklable, and the fn must be defined at the module level.
+
+        Args:
+            fn (callable): The computation.
+
+        Returns:
+            concurrent.futures.Future: The future of the result."""
+
+        return self._process_pool().submit(fn, *args)
+
+
+# %% ---- 2024-01-23 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-23 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-23 ------------------------
+# Pending
@@ -0,0 +1,370 @@
+"""
+File: data_index.py
+Author: Chuncheng Zhang
+Date: 2024-01-10
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Incremental and persisted index of the data files.
+
+    The index is the SQLite database in the cache_root, it records
+    - dirs: the mtime and the sub-directories of every directory;
+    - files: the data files inside the directories.
+    Refreshing the index only lists the directories whose mtime changed,
+    the unchanged directories are descended by their recorded sub-directories.
+    The directories are visited by the bounded thread pool concurrently,
+    and the found data files are written into the index as soon as they are found.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-10 ------------------------
+# Requirements and constants
+import os
+import json
+import time
+import sqlite3
+
+from pathlib import Path
+from threading import RLock
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import LOGGER
+
+
+# %% ---- 2024-01-10 ------------------------
+# Function and class
+def set_wal_mode(conn: sqlite3.Connection, timeout: float = 30):
+    """
+    Sets the journal mode of the database to WAL.
+    Switching the mode fails at once if the other worker is writing, instead of waiting for the busy timeout,
+    so it is retried until the timeout.
+
+    Args:
+        conn (sqlite3.Connection): The connection.
+        timeout (float): The timeout in seconds."""
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError as err:
+            if "locked" not in f"{err}" or time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class ZccDataIndex(object):
+    """
+    ZccDataIndex class.
+
+    The persisted index of the data files under the data_root.
+
+    Args:
+        db_path (Path): The path of the SQLite database.
+        data_root (Path): The root directory of the data files.
+        exts (list): The extensions of the data files.
+
+    Examples:
+        index = ZccDataIndex(Path('index.sqlite'), Path('D:/data'), ['data.bdf'])
+        delta = index.refresh()
+        rows = index.list_files()"""
+
+    max_workers = 16
+
+    def __init__(self, db_path: Path, data_root: Path, exts: list):
+        self.db_path = Path(db_path)
+        self.data_root = Path(data_root)
+        self.exts = list(exts)
+        self.lock = RLock()
+        # The transactions are explicit, and the workers sharing the index wait for its write lock
+        self.conn = sqlite3.connect(
+            self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._init_tables()
+
+    @contextmanager
+    def _transaction(self):
+        # Take the write lock before reading, so the crawlers of the workers wait for each other,
+        # instead of failing with "database is locked" when the read lock is upgraded
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _init_tables(self):
+        # The index can be rebuilt anytime, so the durability is traded for the writing speed
+        set_wal_mode(self.conn)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER, children TEXT)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, mtime INTEGER, size INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+
+            # Reset the index if it is built for other root or extensions
+            signature = json.dumps([str(self.data_root), self.exts])
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key='signature'"
+            ).fetchone()
+            if row is None or row[0] != signature:
+                LOGGER.debug(f"Reset data index for {signature}")
+                self.conn.execute("DELETE FROM dirs")
+                self.conn.execute("DELETE FROM files")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)",
+                    (signature,),
+                )
+
+    def _match(self, name: str):
+        return any(name.endswith(ext) for ext in self.exts)
+
+    def _scan_dir(self, path: str):
+        """
+        Lists the directory.
+
+        Args:
+            path (str): The directory.
+
+        Returns:
+            tuple: The names of sub-directories and the [(path, mtime, size)] of the data files."""
+
+        children = []
+        files = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        children.append(entry.name)
+                    elif entry.is_file() and self._match(entry.name):
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                except OSError as err:
+                    LOGGER.warning(f"Failed scanning {entry.path}: {err}")
+        return sorted(children), files
+
+    def _update_dir(self, path: str, mtime: int, children: list, files: list):
+        """
+        Replaces the records of the directory.
+
+        Returns:
+            tuple: The added, removed and modified data files."""
+
+        with self._transaction():
+            old = {
+                e[0]: (e[1], e[2])
+                for e in self.conn.execute(
+                    "SELECT path, mtime, size FROM files WHERE dir=?", (path,)
+                )
+            }
+            new = {e[0]: (e[1], e[2]) for e in files}
+            modified = sorted(e for e in set(old) & set(new) if old[e] != new[e])
+
+            row = self.conn.execute(
+                "SELECT children FROM dirs WHERE path=?", (path,)
+            ).fetchone()
+            old_children = set(json.loads(row[0])) if row else set()
+
+            # Forget the removed sub-directories, with everything inside them
+            removed = sorted(set(old) - set(new))
+            for name in old_children - set(children):
+                removed.extend(self._forget_tree(os.path.join(path, name)))
+
+            self.conn.execute("DELETE FROM files WHERE dir=?", (path,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, dir, mtime, size) VALUES (?, ?, ?, ?)",
+                [(p, path, m, s) for p, m, s in files],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime, children) VALUES (?, ?, ?)",
+                (path, mtime, json.dumps(children)),
+            )
+
+        return sorted(set(new) - set(old)), removed, modified
+
+    def _forget_tree(self, path: str):
+        prefix = path.rstrip(os.sep) + os.sep
+        pattern = prefix.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+        where = "(dir=? OR dir LIKE ? ESCAPE '!')"
+        removed = [
+            e[0]
+            for e in self.conn.execute(
+                f"SELECT path FROM files WHERE {where}", (path, pattern)
+            )
+        ]
+        self.conn.execute(f"DELETE FROM files WHERE {where}", (path, pattern))
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path=? OR path LIKE ? ESCAPE '!'", (path, pattern)
+        )
+        return removed
+
+    def _visit(self, path: str, force: bool = False):
+        """
+        Visits the directory, it is listed only if its mtime changed.
+
+        Args:
+            path (str): The directory.
+            force (bool): Whether to list the directory even if its mtime is not changed.
+
+        Returns:
+            tuple: The sub-directories, the delta of the data files, and whether the directory is listed."""
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as err:
+            LOGGER.warning(f"Failed stat {path}: {err}")
+            with self._transaction():
+                return [], ([], self._forget_tree(path), []), False
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime, children FROM dirs WHERE path=?", (path,)
+            ).fetchone()
+
+        if not force and row is not None and row[0] == mtime:
+            children = json.loads(row[1])
+            return [os.path.join(path, name) for name in children], ([], [], []), False
+
+        try:
+            children, files = self._scan_dir(path)
+        except OSError as err:
+            LOGGER.warning(f"Failed listing {path}: {err}")
+            return [], ([], [], []), False
+
+        changes = self._update_dir(path, mtime, children, files)
+        return [os.path.join(path, name) for name in children], changes, True
+
+    def refresh(self, path: Path = None):
+        """
+        Refreshes the index.
+        Only the directories whose mtime changed are listed.
+        The sub-trees are visited concurrently by the thread pool of max_workers.
+
+        Args:
+            path (Path): The directory to refresh, it is always listed. None refers the data_root.
+
+        Returns:
+            dict: The delta of the added, removed and modified data files."""
+
+        delta = dict(added=[], removed=[], modified=[])
+        n_scanned = 0
+        n_visited = 0
+
+        if path is None:
+            first = (str(self.data_root), False)
+        else:
+            first = (str(path), True)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {pool.submit(self._visit, *first)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    children, changes, scanned = future.result()
+                    n_visited += 1
+                    n_scanned += scanned
+                    for key, paths in zip(["added", "removed", "modified"], changes):
+                        delta[key].extend(paths)
+                    pending |= {pool.submit(self._visit, e) for e in children}
+
+        LOGGER.debug(
+            f"Refreshed data index, listed {n_scanned} of {n_visited} dirs, added {len(delta['added'])}, removed {len(delta['removed'])} files"
+        )
+        return delta
+
+    def check_files(self, paths: list = None):
+        """
+        Checks the mtime and size of the data files.
+        The modified files are updated, and the missing files are removed.
+
+        Args:
+            paths (list): The paths to check, None refers all the data files.
+
+        Returns:
+            dict: The delta of the added, removed and modified data files."""
+
+        delta = dict(added=[], removed=[], modified=[])
+
+        with self.lock:
+            rows = self.conn.execute("SELECT path, mtime, size FROM files").fetchall()
+        if paths is not None:
+            paths = {str(e) for e in paths}
+            rows = [e for e in rows if e[0] in paths]
+
+        for path, mtime, size in rows:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                delta["removed"].append(path)
+                continue
+            except OSError as err:
+                LOGGER.warning(f"Failed stat {path}: {err}")
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                delta["modified"].append((path, stat.st_mtime_ns, stat.st_size))
+
+        with self._transaction():
+            self.conn.executemany(
+                "DELETE FROM files WHERE path=?", [(e,) for e in delta["removed"]]
+            )
+            self.conn.executemany(
+                "UPDATE files SET mtime=?, size=? WHERE path=?",
+                [(m, s, p) for p, m, s in delta["modified"]],
+            )
+
+        delta["modified"] = [e[0] for e in delta["modified"]]
+        return delta
+
+    def list_files(self, exts: list = None):
+        """
+        Lists the data files.
+
+        Args:
+            exts (list): The extensions to select, None refers all the indexed data files.
+                         They should be covered by the extensions of the index.
+
+        Returns:
+            list: The paths of the data files."""
+
+        if exts is None:
+            sql, params = "SELECT path FROM files ORDER BY path", []
+        else:
+            # The case-sensitive suffix match, the same as the _match, the LIKE ignores the case
+            where = " OR ".join(["substr(path, -?) = ?"] * len(exts)) or "0"
+            sql = f"SELECT path FROM files WHERE {where} ORDER BY path"
+            params = [e for ext in exts for e in (len(ext), ext)]
+
+        with self.lock:
+            return [e[0] for e in self.conn.execute(sql, params)]
+
+
+# %% ---- 2024-01-10 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-10 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-10 ------------------------
+# Pending
@@ -0,0 +1,188 @@
+"""
+File: data_watcher.py
+Author: Chuncheng Zhang
+Date: 2024-01-11
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Watcher of the data_root, it keeps the data index live.
+
+    The watchdog package (inotify on linux) is used if it is installed,
+    the changed directories and files are refreshed shortly after the events.
+    Otherwise, the index is refreshed and the data files are checked every poll_secs.
+    The decoded and filtered caches of the removed and modified data files are invalidated.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-11 ------------------------
+# Requirements and constants
+import os
+import time
+
+from pathlib import Path
+from threading import Thread, Lock
+
+from . import LOGGER
+from .error_box import eb
+from .decoded_cache import ZccDecodedCache
+from .filtered_raw import ZccFilteredRawCache
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+zdc = ZccDecodedCache()
+zfrc = ZccFilteredRawCache()
+
+
+# %% ---- 2024-01-11 ------------------------
+# Function and class
+class _ZccEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        self.watcher.on_event(event.src_path, event.is_directory)
+        if dest_path := getattr(event, "dest_path", None):
+            self.watcher.on_event(dest_path, event.is_directory)
+
+
+class ZccDataWatcher(object):
+    """
+    ZccDataWatcher class.
+
+    It watches the data_root of the ZccFileSystem, and applies the changes to its index.
+
+    Args:
+        zfs (ZccFileSystem): The file system to keep live.
+
+    Examples:
+        watcher = ZccDataWatcher(ZccFileSystem())
+        watcher.start()"""
+
+    poll_secs = 30
+    debounce_secs = 1
+
+    def __init__(self, zfs):
+        self.zfs = zfs
+        self.observer = None
+        self.running = False
+        self.lock = Lock()
+        self.dirty_dirs = set()
+        self.dirty_files = set()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+
+        if Observer is not None:
+            try:
+                observer = Observer()
+                observer.schedule(
+                    _ZccEventHandler(self), str(self.zfs.data_root), recursive=True
+                )
+                observer.daemon = True
+                observer.start()
+                self.observer = observer
+                LOGGER.debug(f"Watching {self.zfs.data_root} with {observer}")
+            except Exception as err:
+                LOGGER.warning(f"Failed watching {self.zfs.data_root}, polling: {err}")
+        else:
+            LOGGER.debug(f"Polling {self.zfs.data_root} every {self.poll_secs} secs")
+
+        Thread(target=self._loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def on_event(self, path: str, is_directory: bool):
+        path = Path(path)
+        with self.lock:
+            # The listing of the parent changes when anything is created or removed
+            self.dirty_dirs.add(path.parent)
+            if is_directory:
+                self.dirty_dirs.add(path)
+            elif any(path.name.endswith(ext) for ext in self.zfs.index_exts):
+                self.dirty_files.add(path)
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.debounce_secs if self.observer else self.poll_secs)
+            try:
+                self.tick()
+            except Exception as err:
+                LOGGER.error(f"Failed watching {self.zfs.data_root}: {err}")
+                eb.on_error(err)
+
+    def tick(self):
+        """
+        Applies the changes since the last tick.
+
+        Returns:
+            dict: The delta of the added, removed and modified data files."""
+
+        delta = dict(added=[], removed=[], modified=[])
+
+        def _extend(d):
+            for k in delta:
+                delta[k].extend(d[k])
+
+        if self.observer is None:
+            _extend(self.zfs.refresh())
+            _extend(self.zfs.check_files())
+        else:
+            with self.lock:
+                dirs = self.dirty_dirs
+                files = self.dirty_files
+                self.dirty_dirs = set()
+                self.dirty_files = set()
+
+            root = Path(self.zfs.data_root)
+            for d in sorted(dirs, key=lambda e: len(e.parts)):
+                # The changes outside the data_root are refreshed from the data_root
+                if d != root and root not in d.parents:
+                    d = root
+                if not os.path.isdir(d) and d != root:
+                    d = d.parent
+                _extend(self.zfs.refresh(path=d))
+
+            if files:
+                _extend(self.zfs.check_files(files))
+
+        for path in set(delta["removed"] + delta["modified"]):
+            zdc.invalidate(path)
+            zfrc.invalidate(path)
+
+        if any(delta.values()):
+            LOGGER.debug(f"Applied data changes: {delta}")
+
+        return delta
+
+
+# %% ---- 2024-01-11 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-11 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-11 ------------------------
+# Pending
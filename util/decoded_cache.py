@@ -0,0 +1,300 @@
+"""
+File: decoded_cache.py
+Author: Chuncheng Zhang
+Date: 2024-01-09
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Cache of the decoded recordings under the cache_root.
+
+    Every recording is decoded once, and stored as the folder of
+    - data.npy: the float32 data of (channels x times), it is memory-mapped when reading;
+    - info.fif: the info of the raw;
+    - zcc-annot.fif: the annotations of the raw;
+    - events.npy: the events of the raw;
+    - meta.json: the event_id and the mtime and size of the source files;
+    - pyramid-*.npy and pyramid.json: the min/max pyramid, it is memory-mapped when reading.
+    The cache is invalid if the mtime or size of any source file changes.
+
+    The folder is written into the unique temporary folder and renamed into place,
+    and the writers of the same folder are serialized by its lock,
+    so the concurrent requests of the same recording dump it only once.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-09 ------------------------
+# Requirements and constants
+import os
+import json
+import shutil
+import tempfile
+
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+
+from . import LOGGER, singleton, LazyModule
+from .file_system import BaseFileSystem
+from .lod_pyramid import ZccMinMaxPyramid
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+
+
+# %% ---- 2024-01-09 ------------------------
+# Function and class
+def _source_files(dct: dict):
+    if dct["name"] == "cnt":
+        return [Path(dct["path"])]
+    return [Path(dct["data"]), Path(dct["evt"])]
+
+
+def _stat_source_files(dct: dict):
+    stats = {}
+    for p in _source_files(dct):
+        s = p.stat()
+        stats[p.as_posix()] = [s.st_mtime_ns, s.st_size]
+    return stats
+
+
+@singleton
+class ZccDecodedCache(BaseFileSystem):
+    """
+    ZccDecodedCache class.
+
+    The cache of the decoded recordings, the folder is cache_root/decoded/<md5 of data path>.
+
+    Examples:
+        zdc = ZccDecodedCache()
+        cached = zdc.load(dct)
+        if cached is None:
+            cached = zdc.dump(dct, raw)
+        raw, events, event_id = cached"""
+
+    folder = "decoded"
+    version = 1
+    chunk_secs = 60
+
+    def __init__(self):
+        super().__init__()
+        self.lock = Lock()
+        self.locks = {}
+
+    def _folder_lock(self, folder: Path):
+        with self.lock:
+            return self.locks.setdefault(folder, Lock())
+
+    def _key(self, dct: dict):
+        data_path = _source_files(dct)[0]
+        return md5(data_path.resolve().as_posix().encode()).hexdigest()
+
+    def cache_folder(self, dct: dict):
+        # The missing folder is expected on the first loading, so the touch and its warning are skipped
+        folder = self.cache_root.joinpath(self.folder, self._key(dct))
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+    def _valid_meta(self, folder: Path, dct: dict):
+        meta_path = folder.joinpath("meta.json")
+        if not meta_path.is_file():
+            return None
+
+        meta = json.loads(meta_path.read_text())
+
+        if meta.get("version") != self.version:
+            LOGGER.debug(f"Outdated decoded cache version: {folder}")
+            return None
+
+        if meta["sources"] != _stat_source_files(dct):
+            LOGGER.debug(f"Source files changed, invalid decoded cache: {folder}")
+            return None
+
+        return meta
+
+    def load(self, dct: dict):
+        """
+        Loads the decoded recording if the cache is valid.
+
+        Args:
+            dct (dict): The data type dict, see _multiple_data_type.
+
+        Returns:
+            tuple or None: The (raw, events, event_id), None if the cache is invalid."""
+
+        folder = self.cache_folder(dct)
+
+        try:
+            if (meta := self._valid_meta(folder, dct)) is None:
+                return None
+
+            info = mne.io.read_info(folder.joinpath("info.fif"), verbose=False)
+            from .cached_raw import ZccCachedRaw
+
+            raw = ZccCachedRaw(info, folder.joinpath("data.npy"), meta["n_times"])
+            annotations = mne.read_annotations(folder.joinpath("zcc-annot.fif"))
+            raw.set_annotations(annotations, verbose=False)
+            events = np.load(folder.joinpath("events.npy"))
+            event_id = meta["event_id"]
+
+            LOGGER.debug(f"Loaded decoded cache: {folder}")
+            return raw, events, event_id
+
+        except Exception as err:
+            LOGGER.warning(f"Failed loading decoded cache: {folder}, {err}")
+            return None
+
+    def dump(self, dct: dict, raw: "mne.io.BaseRaw"):
+        """
+        Dumps the decoded recording into the cache, and loads it back.
+        The data is written chunk by chunk, so the raw is never fully loaded into memory.
+
+        Args:
+            dct (dict): The data type dict, see _multiple_data_type.
+            raw (mne.io.BaseRaw): The decoded raw.
+
+        Returns:
+            tuple or None: The (raw, events, event_id), None if the dumping fails."""
+
+        folder = self.cache_folder(dct)
+
+        with self._folder_lock(folder):
+            # The recording is dumped by the other request while waiting
+            if self._valid_meta(folder, dct) is not None:
+                LOGGER.debug(f"Decoded cache is dumped already: {folder}")
+                return self.load(dct)
+
+            if not self._dump(folder, dct, raw):
+                return None
+
+        return self.load(dct)
+
+    def _dump(self, folder: Path, dct: dict, raw: "mne.io.BaseRaw"):
+        tmp = Path(tempfile.mkdtemp(prefix=f"{folder.name}.tmp-", dir=folder.parent))
+
+        try:
+            sources = _stat_source_files(dct)
+
+            n_times = int(raw.n_times)
+            data = np.lib.format.open_memmap(
+                tmp.joinpath("data.npy"),
+                mode="w+",
+                dtype=np.float32,
+                shape=(len(raw.ch_names), n_times),
+            )
+            chunk = max(1, int(self.chunk_secs * raw.info["sfreq"]))
+            for start in range(0, n_times, chunk):
+                stop = min(start + chunk, n_times)
+                data[:, start:stop] = raw.get_data(start=start, stop=stop)
+            data.flush()
+            del data
+
+            # The data is stored in volts, so the calibrations are 1
+            info = raw.info.copy()
+            with info._unlock():
+                for ch in info["chs"]:
+                    ch["cal"] = 1.0
+                    ch["range"] = 1.0
+            mne.io.write_info(tmp.joinpath("info.fif"), info)
+
+            raw.annotations.save(tmp.joinpath("zcc-annot.fif"), overwrite=True)
+
+            events, event_id = mne.events_from_annotations(raw, verbose=False)
+            np.save(tmp.joinpath("events.npy"), events)
+
+            meta = dict(
+                version=self.version,
+                n_times=n_times,
+                sources=sources,
+                event_id={k: int(v) for k, v in event_id.items()},
+            )
+            tmp.joinpath("meta.json").write_text(json.dumps(meta))
+
+            shutil.rmtree(folder, ignore_errors=True)
+            try:
+                os.replace(tmp, folder)
+            except OSError:
+                # The other process has renamed its copy into place meanwhile
+                LOGGER.debug(f"Decoded cache is dumped by the other process: {folder}")
+            LOGGER.debug(f"Dumped decoded cache: {folder}")
+            return True
+
+        except Exception as err:
+            LOGGER.warning(f"Failed dumping decoded cache: {folder}, {err}")
+            return False
+
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def load_pyramid(self, dct: dict, raw: "mne.io.BaseRaw"):
+        """
+        Loads the pyramid of the decoded recording, if the cache is valid and the pyramid is saved.
+
+        Args:
+            dct (dict): The data type dict, see _multiple_data_type.
+            raw (mne.io.BaseRaw): The raw loaded from the cache.
+
+        Returns:
+            ZccMinMaxPyramid or None: The pyramid."""
+
+        folder = self.cache_folder(dct)
+        try:
+            if self._valid_meta(folder, dct) is None:
+                return None
+            return ZccMinMaxPyramid.load(raw, folder)
+
+        except Exception as err:
+            LOGGER.warning(f"Failed loading pyramid: {folder}, {err}")
+            return None
+
+    def dump_pyramid(self, dct: dict, pyramid: ZccMinMaxPyramid):
+        """
+        Saves the pyramid next to the decoded recording, if the cache is valid.
+        The pyramid is removed with the folder when the source files change.
+
+        Args:
+            dct (dict): The data type dict, see _multiple_data_type.
+            pyramid (ZccMinMaxPyramid): The pyramid."""
+
+        folder = self.cache_folder(dct)
+        try:
+            with self._folder_lock(folder):
+                if self._valid_meta(folder, dct) is not None:
+                    pyramid.save(folder)
+
+        except Exception as err:
+            LOGGER.warning(f"Failed dumping pyramid: {folder}, {err}")
+
+    def invalidate(self, data_path: Path):
+        """
+        Removes the cache of the data file.
+
+        Args:
+            data_path (Path): The path of the data file.
+        """
+
+        key = md5(Path(data_path).resolve().as_posix().encode()).hexdigest()
+        folder = self.cache_root.joinpath(self.folder, key)
+        with self._folder_lock(folder):
+            if folder.is_dir():
+                shutil.rmtree(folder, ignore_errors=True)
+                LOGGER.debug(f"Invalidated decoded cache: {folder}")
+
+
+# %% ---- 2024-01-09 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-09 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-09 ------------------------
+# Pending
@@ -0,0 +1,245 @@
+"""
+File: epochs_cache.py
+Author: Chuncheng Zhang
+Date: 2024-01-16
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Content-keyed cache of the collected epochs.
+
+    The key is built from the identity of the recording (the mtime and size of its source files)
+    and the setup of the epochs (events, tmin, tmax, l_freq, h_freq and decim).
+    The epochs are kept in memory in the LRU order inside the memory_budget,
+    the evicted epochs are spilled into cache_root/epochs as the -epo.fif files,
+    and loaded back when the same setup is used again.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-16 ------------------------
+# Requirements and constants
+import os
+import json
+
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+from collections import OrderedDict
+
+from . import LOGGER, singleton, LazyModule
+from .file_system import BaseFileSystem
+from .decoded_cache import _stat_source_files
+from .phase_1st_load_raw import _multiple_data_type
+
+mne = LazyModule("mne")
+
+
+# %% ---- 2024-01-16 ------------------------
+# Function and class
+def _epochs_nbytes(epochs: "mne.Epochs"):
+    if epochs.preload:
+        return epochs._data.nbytes
+    return 0
+
+
+@singleton
+class ZccEpochsCache(BaseFileSystem):
+    """
+    ZccEpochsCache class.
+
+    The LRU cache of the epochs, keyed by the content.
+
+    Examples:
+        zepc = ZccEpochsCache()
+        key = zepc.key(path, events, event_id, tmin, tmax, l_freq, h_freq, decim)
+        if (epochs := zepc.get(key)) is None:
+            epochs = ...
+            zepc.put(key, epochs)"""
+
+    folder = "epochs"
+    version = 1
+    memory_budget = 1024**3  # 1 GB
+    disk_budget = 10 * 1024**3  # 10 GB
+    spill = True
+    # Spill the epochs as soon as they are put, it is used in the shared session state mode
+    spill_on_put = False
+
+    def __init__(self):
+        super().__init__()
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def key(
+        self,
+        path: Path,
+        events,
+        event_id,
+        tmin,
+        tmax,
+        l_freq,
+        h_freq,
+        decim,
+        filter_continuous=False,
+    ):
+        """
+        Builds the key of the epochs.
+
+        Args:
+            path (Path): The path of the data file.
+            events (list): The selected event codes.
+            event_id (dict): The event_id of the selected events.
+            The others are the parameters of the collect_epochs.
+            filter_continuous (bool): Whether the epochs are cut from the filtered continuous raw.
+
+        Returns:
+            str: The key, None if the recording is not found."""
+
+        try:
+            sources = _stat_source_files(_multiple_data_type(Path(path)))
+        except Exception as err:
+            LOGGER.warning(f"Failed building epochs key for {path}: {err}")
+            return None
+
+        setup = [
+            self.version,
+            sources,
+            sorted(int(e) for e in events),
+            sorted((k, int(v)) for k, v in event_id.items()),
+            tmin,
+            tmax,
+            l_freq,
+            h_freq,
+            decim,
+            filter_continuous,
+        ]
+        return md5(json.dumps(setup).encode()).hexdigest()
+
+    def _spill_path(self, key: str):
+        return self.cache_root.joinpath(self.folder, f"{key}-epo.fif")
+
+    def get(self, key: str):
+        """
+        Gets the epochs of the key, from the memory or the spilled file.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            mne.Epochs or None: The epochs, None if not cached."""
+
+        if key is None:
+            return None
+
+        with self.lock:
+            if epochs := self.entries.get(key):
+                self.entries.move_to_end(key)
+                LOGGER.debug(f"Using cached epochs: {key}")
+                return epochs
+
+        path = self._spill_path(key)
+        if not self.spill or not path.is_file():
+            return None
+
+        try:
+            epochs = mne.read_epochs(path, preload=True, verbose=False)
+            os.utime(path)
+        except Exception as err:
+            LOGGER.warning(f"Failed reading spilled epochs: {path}, {err}")
+            return None
+
+        LOGGER.debug(f"Loaded spilled epochs: {path}")
+        self.put(key, epochs)
+        return epochs
+
+    def put(self, key: str, epochs: "mne.Epochs"):
+        if key is None:
+            return
+
+        with self.lock:
+            self.entries[key] = epochs
+            self.entries.move_to_end(key)
+            evicted = self._evict()
+
+        if self.spill_on_put:
+            self._spill(key, epochs)
+
+        for k, e in evicted:
+            self._spill(k, e)
+
+    def holds(self, epochs: "mne.Epochs"):
+        """
+        Checks if the epochs object is kept in the memory of the cache.
+
+        Args:
+            epochs (mne.Epochs): The epochs.
+
+        Returns:
+            bool: True if it is kept, its memory is bounded by the memory_budget of the cache."""
+
+        with self.lock:
+            return any(e is epochs for e in self.entries.values())
+
+    def total_nbytes(self):
+        return sum(_epochs_nbytes(e) for e in self.entries.values())
+
+    def _evict(self):
+        # The least recently used comes first, the latest one is always kept
+        evicted = []
+        while len(self.entries) > 1 and self.total_nbytes() > self.memory_budget:
+            key, epochs = self.entries.popitem(last=False)
+            evicted.append((key, epochs))
+            LOGGER.debug(f"Evicted cached epochs: {key}")
+        return evicted
+
+    def _spill(self, key: str, epochs: "mne.Epochs"):
+        if not self.spill:
+            return
+
+        path = self.touch(Path(self.folder, f"{key}-epo.fif"))
+        if path.is_file():
+            return
+
+        tmp = path.with_name(f"{key}.tmp-{os.getpid()}-epo.fif")
+        try:
+            epochs.save(tmp, overwrite=True, verbose=False)
+            os.replace(tmp, path)
+            LOGGER.debug(f"Spilled epochs: {path}")
+        except Exception as err:
+            LOGGER.warning(f"Failed spilling epochs: {path}, {err}")
+            tmp.unlink(missing_ok=True)
+            return
+
+        self._trim_disk()
+
+    def _trim_disk(self):
+        # Remove the least recently used spilled files over the disk_budget
+        files = sorted(
+            self.cache_root.joinpath(self.folder).glob("*-epo.fif"),
+            key=lambda p: p.stat().st_mtime,
+        )
+        total = sum(p.stat().st_size for p in files)
+        for p in files:
+            if total <= self.disk_budget:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            LOGGER.debug(f"Removed spilled epochs: {p}")
+
+
+# %% ---- 2024-01-16 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-16 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-16 ------------------------
+# Pending
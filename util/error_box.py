@@ -6,6 +6,14 @@ Copyright & Email: chuncheng.zhang@ia.ac.cn
 
 Purpose:
     Amazing things
+    The box of the errors, it is bounded and keeps the strings only.
+
+    The errors are deduplicated by the fingerprint of the exception type and the frames of its traceback,
+    so the same failure of the different inputs is counted in one record.
+    - the exception object is not kept, since its frames refer to the local variables, like the arrays;
+    - the records are at most max_records, the least recently seen record is evicted first;
+    - the detail is the traceback, it is truncated to its last max_detail_chars characters.
+    The records are served by the /zcc/admin/errors.json route.
 
 Functions:
     1. Requirements and constants
@@ -19,24 +27,120 @@ Functions:
 # %% ---- 2023-11-23 ------------------------
 # Requirements and constants
 import time
+import hashlib
 import traceback
-from . import LOGGER, CONF, singleton
+
+from threading import Lock
+from collections import OrderedDict
+
+from . import LOGGER, singleton
 
 
 # %% ---- 2023-11-23 ------------------------
 # Function and class
+def fingerprint(err, detail: str = None):
+    """
+    Computes the fingerprint of the error, the message is not used since it often contains the inputs.
+
+    Args:
+        err (Exception): The error.
+        detail (str): The traceback text, it is used when the error has no traceback.
+
+    Returns:
+        str: The fingerprint."""
+
+    frames = [
+        f"{f.filename}:{f.name}:{f.lineno}"
+        for f in traceback.extract_tb(getattr(err, "__traceback__", None))
+    ]
+    if not frames:
+        frames = [detail or f"{err}"]
+    text = "|".join([type(err).__name__] + frames)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
 @singleton
 class ErrorBox(object):
-    buffer = []
+    """
+    ErrorBox class.
+
+    Examples:
+        try:
+            do_something()
+        except Exception as err:
+            eb.on_error(err)
+        eb.list_errors(limit=10)"""
+
+    max_records = 200
+    max_message_chars = 1000
+    max_detail_chars = 8000
 
     def __init__(self):
-        pass
+        self.lock = Lock()
+        self.records = OrderedDict()
+        self.total = 0
+        self.evicted = 0
 
     def on_error(self, err, detail=None):
         t = time.time()
         if detail is None:
-            detail = traceback.format_exc()
-        self.buffer.append(dict(t=t, err=err, detail=detail))
+            if isinstance(err, BaseException) and err.__traceback__ is not None:
+                detail = "".join(
+                    traceback.format_exception(type(err), err, err.__traceback__)
+                )
+            else:
+                detail = traceback.format_exc()
+        detail = f"{detail}"[-self.max_detail_chars :]
+        fp = fingerprint(err, detail)
+
+        with self.lock:
+            self.total += 1
+
+            if record := self.records.get(fp):
+                record["count"] += 1
+                record["last"] = t
+                record["message"] = f"{err}"[: self.max_message_chars]
+                record["detail"] = detail
+                self.records.move_to_end(fp)
+                return
+
+            self.records[fp] = dict(
+                fingerprint=fp,
+                type=type(err).__name__,
+                message=f"{err}"[: self.max_message_chars],
+                detail=detail,
+                count=1,
+                first=t,
+                last=t,
+            )
+
+            while len(self.records) > self.max_records:
+                _, record = self.records.popitem(last=False)
+                self.evicted += 1
+                LOGGER.debug(f"Evicted error record: {record['fingerprint']} | {record['type']}")
+
+    def list_errors(self, limit: int = None):
+        """
+        Lists the error records, the most recently seen is the first.
+
+        Args:
+            limit (int): The number of the records, default is all of them.
+
+        Returns:
+            list: The records."""
+
+        with self.lock:
+            records = [dict(r) for r in reversed(self.records.values())]
+        return records[:limit] if limit is not None else records
+
+    def summary(self):
+        with self.lock:
+            return dict(
+                total=self.total,
+                distinct=len(self.records),
+                evicted=self.evicted,
+                maxRecords=self.max_records,
+            )
 
 
 eb = ErrorBox()
@@ -19,9 +19,10 @@ Functions:
 # %% ---- 2023-12-04 ------------------------
 # Requirements and constants
 import io
-import pandas as pd
 
-from . import LOGGER
+from . import LOGGER, singleton, LazyModule
+
+pd = LazyModule("pandas")
 
 
 # %% ---- 2023-12-04 ------------------------
@@ -71,6 +72,7 @@ class SSVEP(BaseExperiment):
         self.update()
 
 
+@singleton
 class Experiments(dict):
     experiments = [RSVP, MI, SSVEP]
 
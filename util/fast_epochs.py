@@ -0,0 +1,268 @@
+"""
+File: fast_epochs.py
+Author: Chuncheng Zhang
+Date: 2024-01-18
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Fast-path epoching engine.
+
+    The epochs of the fixed-length windows around the events are gathered
+    from the continuous data as the (events x channels x samples) array, in vectorized steps of the channel chunks.
+    Only the samples of the windows are read from the memory-mapped data,
+    and the temporary memory is bounded by the chunk_bytes.
+    The baseline correction and the decimation are applied in bulk.
+    The channels and the epochs are selected as the mne.Epochs does,
+    - the bad channels are kept and marked in the info["bads"], like picks=["eeg"],
+      so the MNE methods, like the average, exclude them as well;
+    - the epochs overlapping the annotations starting with "bad" are rejected, like reject_by_annotation=True.
+    The result is wrapped as the mne.EpochsArray only when the MNE features are needed,
+    the wrapping shares the data array without copying.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-18 ------------------------
+# Requirements and constants
+from . import LOGGER, LazyModule
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+
+
+# %% ---- 2024-01-18 ------------------------
+# Function and class
+def _continuous_data(raw: "mne.io.BaseRaw", picks):
+    """
+    Gets the continuous data without copying if possible, the picks are selected when the windows are gathered,
+    so only the samples of the windows are read from the memory-mapped data.
+
+    Args:
+        raw (mne.io.BaseRaw): The raw.
+        picks (array): The indices of the channels.
+
+    Returns:
+        tuple: The array like data of (channels x times) in volts, and the rows of the picks in it."""
+
+    if raw.preload:
+        continuous = raw._data
+    else:
+        from .cached_raw import ZccCachedRaw
+
+        if isinstance(raw, ZccCachedRaw):
+            # The calibrations of the cached raw are 1
+            continuous = np.load(raw._filenames[0], mmap_mode="r")
+        else:
+            continuous = raw.get_data(picks=picks)
+            picks = np.arange(len(picks))
+
+    return continuous, np.asarray(picks, dtype=np.int64)
+
+
+def _bad_annotations(raw: "mne.io.BaseRaw"):
+    """
+    Gets the annotations which reject the epochs, their descriptions start with "bad", as the mne.Epochs.
+
+    Args:
+        raw (mne.io.BaseRaw): The raw.
+
+    Returns:
+        tuple: The onsets in seconds from the first sample of the raw, and the durations in seconds."""
+
+    annotations = raw.annotations
+    bad = np.array(
+        [d.lower().startswith("bad") for d in annotations.description], dtype=bool
+    )
+    return annotations.onset[bad] - raw.first_time, annotations.duration[bad]
+
+
+class ZccFastEpochs(object):
+    """
+    ZccFastEpochs class.
+
+    The epochs gathered in the vectorized way, like the mne.Epochs with the same arguments.
+
+    Args:
+        raw (mne.io.BaseRaw): The continuous raw.
+        events (array): The (N, 3) events.
+        event_id (dict): The event_id.
+        tmin (float): The start time of the epochs.
+        tmax (float): The end time of the epochs, it is included.
+        baseline (tuple): The (bmin, bmax) of the baseline correction, None for no correction.
+        decim (int): The decimation factor.
+        picks (str): The type of the channels to pick, the bad channels are kept and marked in the info["bads"].
+        reject_by_annotation (bool): Whether to reject the epochs overlapping the bad annotations.
+
+    Examples:
+        fast = ZccFastEpochs(raw, events, event_id, -0.2, 0.8, (-0.2, None), decim=4)
+        data = fast.data  # (events x channels x samples)
+        epochs = fast.to_epochs_array()"""
+
+    # The memory of the chunks of the channels, when gathering the windows and summing the baseline
+    chunk_bytes = 16 * 1024**2  # 16 MB
+
+    def __init__(
+        self,
+        raw: "mne.io.BaseRaw",
+        events,
+        event_id: dict,
+        tmin: float,
+        tmax: float,
+        baseline=None,
+        decim: int = 1,
+        picks: str = "eeg",
+        reject_by_annotation: bool = True,
+    ):
+        sfreq = raw.info["sfreq"]
+        # The mne.Epochs keeps the bad channels of the picked type, and marks them as bads
+        picks = mne.pick_types(raw.info, **{picks: True}, exclude=[])
+        events = np.array(events, dtype=np.int64).reshape(-1, 3)
+
+        # The samples of the window, the same rounding as the mne.Epochs
+        start = int(np.round(tmin * sfreq))
+        stop = int(np.round(tmax * sfreq))
+        offsets = np.arange(start, stop + 1)
+        times = offsets / sfreq
+
+        # Drop the events whose windows are outside the raw
+        onsets = events[:, 0] - raw.first_samp
+        valid = (onsets + start >= 0) & (onsets + stop < raw.n_times)
+        if not valid.all():
+            LOGGER.warning(f"Dropped {(~valid).sum()} events outside the raw")
+        events = events[valid]
+        onsets = onsets[valid]
+
+        # Reject the events whose windows overlap the bad annotations, the same as the mne.Epochs
+        if reject_by_annotation and len(raw.annotations) > 0:
+            bad_onsets, bad_durations = _bad_annotations(raw)
+            starts = (onsets + start)[:, np.newaxis] / sfreq
+            stops = (onsets + stop + 1)[:, np.newaxis] / sfreq
+            rejected = (
+                (bad_onsets[np.newaxis, :] < stops)
+                & (bad_onsets[np.newaxis, :] + bad_durations[np.newaxis, :] > starts)
+            ).any(axis=1)
+            if rejected.any():
+                LOGGER.debug(f"Rejected {rejected.sum()} events by the bad annotations")
+            events = events[~rejected]
+            onsets = onsets[~rejected]
+
+        # Keep the time zero, the same as the mne.Epochs.decimate
+        first = int(np.round(-times[0] * sfreq)) % decim
+        keep = slice(first, None, decim)
+
+        # Only the kept samples are gathered, as (events x channels x samples) in one step
+        continuous, rows = _continuous_data(raw, picks)
+        data = self._gather(continuous, rows, onsets, offsets[keep])
+
+        # The baseline is computed on the samples before the decimation
+        if baseline is not None:
+            bmin, bmax = baseline
+            bmin = times[0] if bmin is None else bmin
+            bmax = times[-1] if bmax is None else bmax
+            mask = (times >= bmin) & (times <= bmax)
+            data -= self._baseline(continuous, rows, onsets, offsets[mask])
+
+        times = times[keep]
+
+        self.info = mne.pick_info(raw.info, picks)
+        with self.info._unlock():
+            self.info["sfreq"] = sfreq / decim
+        self.data = data
+        self.times = times
+        self.events = events
+        self.event_id = {k: v for k, v in event_id.items() if v in events[:, 2]}
+        self.baseline = baseline
+
+    def _windows(self, continuous, rows, onsets, offsets):
+        # Only the samples of the windows of the picked channels are read, chunk by chunk of the channels,
+        # it yields the start channel and the windows of (channels x events x samples)
+        index = onsets[:, np.newaxis] + offsets[np.newaxis, :]
+        n = max(1, self.chunk_bytes // max(index.size * 8, 1))
+        for c in range(0, len(rows), n):
+            chunk = rows[c : c + n]
+            yield c, continuous[chunk[:, np.newaxis, np.newaxis], index[np.newaxis]]
+
+    def _gather(self, continuous, rows, onsets, offsets):
+        data = np.empty((len(onsets), len(rows), len(offsets)))
+        for c, one in self._windows(continuous, rows, onsets, offsets):
+            data[:, c : c + len(one)] = one.transpose(1, 0, 2)
+        return data
+
+    def _baseline(self, continuous, rows, onsets, offsets):
+        """
+        Computes the baseline of (events x channels x 1).
+        When the baseline windows cover more samples than the raw,
+        the prefix sum of the raw is cheaper than gathering the windows,
+        it is computed for the chunks of the channels, inside the chunk_bytes."""
+
+        n_times = continuous.shape[1]
+        mean = np.zeros((len(onsets), len(rows), 1))
+
+        if len(onsets) * len(offsets) <= n_times:
+            for c, one in self._windows(continuous, rows, onsets, offsets):
+                mean[:, c : c + len(one), 0] = one.mean(axis=2, dtype=np.float64).transpose()
+            return mean
+
+        a = onsets + offsets[0]
+        b = onsets + offsets[-1] + 1
+
+        n = max(1, self.chunk_bytes // ((n_times + 1) * 8))
+        cumsum = np.zeros((min(n, len(rows)), n_times + 1))
+        for c in range(0, len(rows), n):
+            chunk = rows[c : c + n]
+            np.cumsum(continuous[chunk], axis=1, out=cumsum[: len(chunk), 1:])
+            one = (cumsum[: len(chunk), b] - cumsum[: len(chunk), a]) / len(offsets)
+            mean[:, c : c + len(chunk), 0] = one.transpose()
+        return mean
+
+    def to_epochs_array(self):
+        """
+        Wraps the data as the mne.EpochsArray, the data array is shared without copying.
+        It is needed when the epochs are cached, spilled or averaged by the MNE.
+
+        Returns:
+            mne.EpochsArray: The epochs."""
+
+        return mne.EpochsArray(
+            self.data,
+            self.info,
+            events=self.events,
+            tmin=self.times[0],
+            event_id=self.event_id,
+            baseline=None,
+            verbose=False,
+        )
+
+
+def can_use_fast_epochs(events):
+    """
+    Whether the fast path is equivalent to the mne.Epochs(..., event_repeated="merge").
+    The events at the same sample are merged by the mne.Epochs, the fast path does not merge them.
+
+    Args:
+        events (array): The (N, 3) events.
+
+    Returns:
+        bool: True if no events share the same sample."""
+
+    events = np.array(events).reshape(-1, 3)
+    return len(np.unique(events[:, 0])) == len(events)
+
+
+# %% ---- 2024-01-18 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-18 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-18 ------------------------
+# Pending
@@ -19,13 +19,15 @@ Functions:
 # %% ---- 2023-12-04 ------------------------
 # Requirements and constants
 import os
-import pandas as pd
 
 from pathlib import Path
-from tqdm.auto import tqdm
+from threading import Thread, Lock
 
-from . import LOGGER, _folders, singleton
+from . import LOGGER, _folders, singleton, LazyModule
 from .experiments import Experiments
+from .data_index import ZccDataIndex
+
+pd = LazyModule("pandas")
 
 # %% ---- 2023-12-04 ------------------------
 # Function and class
@@ -49,54 +51,172 @@ class BaseFileSystem(object):
         return p
 
 
-def _guess_experiment_by_relative_path(relative_path: Path):
-    # It is safe because the last parents is always '.'
-    pattern = list(relative_path.parents)[-2].name
+def _mk_data_files_df(data_files: list, data_root: Path):
+    """
+    Makes the dataframe of the data files.
+    The subjectID and experiment are parsed from the relative paths, in vectorized string operations.
+
+    Args:
+        data_files (list): The paths of the data files.
+        data_root (Path): The root directory of the data files.
+
+    Returns:
+        pd.DataFrame: The dataframe of path, subjectID and experiment columns."""
+
+    df = pd.DataFrame(data_files, columns=["path"], dtype=str)
+
+    # The relative path in posix format, like MI/S1/data.bdf
+    relative = df["path"].str.slice(len(str(data_root).rstrip(os.sep)) + 1)
+    relative = relative.str.replace(os.sep, "/", regex=False)
 
-    if pattern in experiments:
-        LOGGER.debug(f"Found experiment: {pattern} | {relative_path}")
-        return pattern
+    df["subjectID"] = relative.str.replace("/", "-", regex=False)
 
-    return "na"
+    # The experiment is the top folder of the relative path
+    parts = relative.str.split("/")
+    top = parts.str[0].where(parts.str.len() > 1, "")
+    df["experiment"] = top.where(top.isin(list(experiments)), "na")
+
+    return df
 
 
 @singleton
 class ZccFileSystem(BaseFileSystem):
     found_data_files = []
     df = None
+    # The data files are searched by the exts, the index records all the formats the loader reads
+    exts = ["data.bdf"]
+    index_exts = ["data.bdf", ".cnt"]
+    crawler = None
 
     def __init__(self):
         super(BaseFileSystem, self).__init__()
-        self.search_data()
+        self.refresh_lock = Lock()
+        # The refresh_lock is held during crawling, so the start uses its own lock
+        self.start_lock = Lock()
+        self.index = ZccDataIndex(
+            self.touch(Path("data-index.sqlite")), self.data_root, self.index_exts
+        )
+
+    def start(self):
+        """
+        Starts crawling the changes in the background, the persisted index is served meanwhile.
+        The app calls it after the startup, the other callers start it at the first search.
+        """
+
+        with self.start_lock:
+            if self.crawler is not None:
+                return
+            self.crawler = Thread(target=self._refresh, daemon=True)
+            self.crawler.start()
+
+    def is_crawling(self):
+        return self.crawler is not None and self.crawler.is_alive()
 
     def search_data(self, exts: list = None, using_existing_df: bool = True):
+        """
+        Searches the data files.
+        The partial index is served during crawling, so the first rows are returned before the crawling finishes,
+        use find_subject to wait for the data file which is not crawled yet.
+        The callers in the event loop should call it in the thread pool.
+
+        Args:
+            exts (list): The extensions, None refers the exts. They are selected from the index by the query.
+            using_existing_df (bool): Whether to use the built dataframe.
+
+        Returns:
+            pd.DataFrame: The dataframe of path, subjectID and experiment columns."""
+
+        self.start()
+
+        if exts is not None and list(exts) != self.exts:
+            uncovered = [e for e in exts if not any(e.endswith(i) for i in self.index_exts)]
+            if uncovered:
+                LOGGER.warning(f"Not indexed extensions: {uncovered}, {self.index_exts}")
+            return _mk_data_files_df(self.index.list_files(list(exts)), self.data_root)
+
+        # The data files are streaming into the index during crawling
+        if self.is_crawling():
+            return self._build_df()
+
         if using_existing_df and self.df is not None:
             return self.df
 
-        if exts is None:
-            exts = ["data.bdf"]
-
-        files = list(os.walk(self.data_root))
-        data_files = []
-        for f in tqdm(files, "List data"):
-            parent = f[0]
-            names = [e for e in f[2] if any(e.endswith(ext) for ext in exts)]
-            data_files.extend([Path(parent, e) for e in names])
-
-        self.found_data_files = data_files
-        LOGGER.debug(f"Found data files: {data_files}")
-
-        df = pd.DataFrame(data_files, columns=["path"])
-        df['subjectID'] = df['path'].map(
-            lambda e: e.relative_to(self.data_root).as_posix().replace('/', '-'))
-        df["experiment"] = df["path"].map(
-            lambda e: _guess_experiment_by_relative_path(
-                e.relative_to(self.data_root))
-        )
-        self.df = df
+        self.refresh()
+        return self.df
+
+    def find_subject(self, subjectID: str):
+        """
+        Finds the data files of the subjectID.
+        The crawling is waited only if the subjectID is not in the index yet.
+        The callers in the event loop should call it in the thread pool.
+
+        Args:
+            subjectID (str): The subjectID, like MI-S1-data.bdf.
+
+        Returns:
+            pd.DataFrame: The dataframe of path, subjectID and experiment columns."""
+
+        df = self.search_data()
+        found = df[df["subjectID"] == subjectID]
+
+        if len(found) == 0 and (crawler := self.crawler) is not None and crawler.is_alive():
+            LOGGER.debug(f"Waiting for the crawling to find {subjectID}")
+            crawler.join()
+            df = self.search_data()
+            found = df[df["subjectID"] == subjectID]
+
+        return found
+
+    def refresh(self, background: bool = False, path: Path = None):
+        """
+        Refreshes the data files.
+        It is cheap, since only the changed directories are listed.
+
+        Args:
+            background (bool): Whether to crawl in the background thread.
+            path (Path): The directory to refresh, None refers the data_root.
+
+        Returns:
+            dict: The delta of the added, removed and modified data files, None if crawling in the background."""
+
+        if background:
+            self.crawler = Thread(target=self._refresh, args=(path,), daemon=True)
+            self.crawler.start()
+            return None
+
+        return self._refresh(path)
+
+    def _refresh(self, path: Path = None):
+        with self.refresh_lock:
+            delta = self.index.refresh(path)
+            self._build_df()
+        return delta
+
+    def check_files(self, paths: list = None):
+        """
+        Checks the data files for modifications and removals.
+
+        Args:
+            paths (list): The paths to check, None refers all the data files.
+
+        Returns:
+            dict: The delta of the added, removed and modified data files."""
+
+        with self.refresh_lock:
+            delta = self.index.check_files(paths)
+            if delta["removed"]:
+                self._build_df()
+        return delta
+
+    def _build_df(self):
+        data_files = self.index.list_files(self.exts)
+        self.found_data_files = [Path(e) for e in data_files]
+        LOGGER.debug(f"Found data files: {len(data_files)}")
+
+        self.df = _mk_data_files_df(data_files, self.data_root)
         LOGGER.debug("Built data frame")
 
-        return df
+        return self.df
 
 
 # %% ---- 2023-12-04 ------------------------
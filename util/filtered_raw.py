@@ -0,0 +1,284 @@
+"""
+File: filtered_raw.py
+Author: Chuncheng Zhang
+Date: 2024-01-17
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Cache of the band-pass filtered continuous recordings.
+
+    The continuous recording is filtered once per (l_freq, h_freq),
+    channel by channel, into the float32 data.npy under cache_root/filtered.
+    The filtered copy is memory-mapped as the ZccCachedRaw,
+    so cutting epochs from it costs only slicing.
+    The filter artifacts of the short epoch edges are also avoided.
+
+    The filtered copies are kept inside the disk_budget in the LRU order,
+    the mtime of the meta.json is the time of the last use.
+    The lock of the copy is dropped together with its folder, and the copy in use is never removed.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-17 ------------------------
+# Requirements and constants
+import os
+import json
+import shutil
+import tempfile
+
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+from contextlib import contextmanager
+
+from . import LOGGER, singleton, LazyModule
+from .file_system import BaseFileSystem
+from .decoded_cache import _stat_source_files
+from .phase_1st_load_raw import _multiple_data_type
+from .metrics import ZccMetrics
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+
+zm = ZccMetrics()
+
+
+# %% ---- 2024-01-17 ------------------------
+# Function and class
+@singleton
+class ZccFilteredRawCache(BaseFileSystem):
+    """
+    ZccFilteredRawCache class.
+
+    The cache of the filtered recordings,
+    the folder is cache_root/filtered/<md5 of data path>/<md5 of sources and band>.
+
+    Examples:
+        zfrc = ZccFilteredRawCache()
+        with zfrc.use(path, raw, l_freq=1, h_freq=40) as filtered:
+            epochs = mne.Epochs(filtered, ..., preload=True)"""
+
+    folder = "filtered"
+    version = 1
+    disk_budget = 10 * 1024**3  # 10 GB
+
+    def __init__(self):
+        super().__init__()
+        self.lock = Lock()
+        self.locks = {}
+
+    def _path_folder(self, data_path: Path):
+        key = md5(Path(data_path).resolve().as_posix().encode()).hexdigest()
+        return self.cache_root.joinpath(self.folder, key)
+
+    def _band_folder(self, data_path: Path, l_freq, h_freq):
+        sources = _stat_source_files(_multiple_data_type(Path(data_path)))
+        key = md5(
+            json.dumps([self.version, sources, l_freq, h_freq]).encode()
+        ).hexdigest()
+        return self._path_folder(data_path).joinpath(key)
+
+    def _acquire(self, folder: Path):
+        # The lock may be dropped with its folder while waiting, then the new one is used
+        while True:
+            with self.lock:
+                lock = self.locks.setdefault(folder, Lock())
+            lock.acquire()
+            with self.lock:
+                if self.locks.get(folder) is lock:
+                    return lock
+            lock.release()
+
+    def _remove(self, folder: Path):
+        """
+        Removes the filtered copy and drops its lock, the copy in use is skipped.
+
+        Args:
+            folder (Path): The folder of the copy.
+
+        Returns:
+            bool: True if it is removed."""
+
+        trash = None
+        with self.lock:
+            lock = self.locks.get(folder)
+            if lock is not None and not lock.acquire(blocking=False):
+                return False
+            try:
+                # Rename it away at once, so it is not found by the following get
+                trash = Path(tempfile.mkdtemp(prefix=f"{folder.name}.trash-", dir=folder.parent))
+                os.replace(folder, trash.joinpath(folder.name))
+            except OSError as err:
+                LOGGER.warning(f"Failed removing filtered raw: {folder}, {err}")
+            finally:
+                self.locks.pop(folder, None)
+                if lock is not None:
+                    lock.release()
+
+        if trash is not None:
+            shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def _load(self, folder: Path):
+        meta = json.loads(folder.joinpath("meta.json").read_text())
+        info = mne.io.read_info(folder.joinpath("info.fif"), verbose=False)
+        from .cached_raw import ZccCachedRaw
+
+        raw = ZccCachedRaw(info, folder.joinpath("data.npy"), meta["n_times"])
+        return raw
+
+    @contextmanager
+    def use(
+        self, data_path: Path, raw: "mne.io.BaseRaw", l_freq, h_freq, on_progress=None
+    ):
+        """
+        Uses the filtered copy of the raw, it is filtered if not cached.
+        The copy is locked inside the context, so it is not removed while it is read.
+
+        Args:
+            data_path (Path): The path of the data file, it identifies the recording.
+            raw (mne.io.BaseRaw): The continuous raw of the recording.
+            l_freq (float): The lower frequency bound.
+            h_freq (float): The upper frequency bound.
+            on_progress (callable): It is called with the fraction of the filtered channels (optional).
+
+        Yields:
+            ZccCachedRaw: The filtered raw, with the annotations of the raw."""
+
+        folder = self._band_folder(data_path, l_freq, h_freq)
+
+        # The same band is filtered only once, even if it is required concurrently
+        lock = self._acquire(folder)
+        try:
+            hit = folder.joinpath("meta.json").is_file()
+            zm.cache("filtered", hit)
+            if hit:
+                os.utime(folder.joinpath("meta.json"))
+            else:
+                with zm.stage("filtering"):
+                    self._filter(folder, raw, l_freq, h_freq, on_progress)
+            filtered = self._load(folder)
+            filtered.set_annotations(raw.annotations, verbose=False)
+            LOGGER.debug(f"Using filtered raw: {folder}")
+            yield filtered
+        finally:
+            lock.release()
+
+        if not hit:
+            self._trim_disk(keep=folder)
+
+    def _filter(self, folder: Path, raw: "mne.io.BaseRaw", l_freq, h_freq, on_progress):
+        folder.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix=f"{folder.name}.tmp-", dir=folder.parent))
+
+        try:
+            n_channels = len(raw.ch_names)
+            n_times = int(raw.n_times)
+            picks = set(mne.pick_types(raw.info, eeg=True, exclude=[]))
+            data = np.lib.format.open_memmap(
+                tmp.joinpath("data.npy"),
+                mode="w+",
+                dtype=np.float32,
+                shape=(n_channels, n_times),
+            )
+
+            # Channel by channel, only one channel is in memory at the time
+            for i in range(n_channels):
+                one = raw.get_data(picks=[i])
+                if i in picks:
+                    one = mne.filter.filter_data(
+                        one, raw.info["sfreq"], l_freq, h_freq, n_jobs=1, verbose=False
+                    )
+                data[i] = one[0]
+                if on_progress is not None:
+                    on_progress((i + 1) / n_channels)
+            data.flush()
+            del data
+
+            # The data is stored in volts, so the calibrations are 1
+            info = raw.info.copy()
+            with info._unlock():
+                for ch in info["chs"]:
+                    ch["cal"] = 1.0
+                    ch["range"] = 1.0
+                info["highpass"] = l_freq if l_freq is not None else info["highpass"]
+                info["lowpass"] = h_freq if h_freq is not None else info["lowpass"]
+            mne.io.write_info(tmp.joinpath("info.fif"), info)
+
+            meta = dict(version=self.version, n_times=n_times, band=[l_freq, h_freq])
+            tmp.joinpath("meta.json").write_text(json.dumps(meta))
+
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(tmp, folder)
+            LOGGER.debug(f"Filtered raw into {folder}")
+
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _copies(self):
+        # The folders of the filtered copies, the temporary ones are not included
+        return [
+            p.parent
+            for p in self.cache_root.joinpath(self.folder).glob("*/*/meta.json")
+            if "." not in p.parent.name
+        ]
+
+    def _trim_disk(self, keep: Path = None):
+        # Remove the least recently used copies over the disk_budget
+        sizes = {}
+        for folder in self._copies():
+            try:
+                mtime = folder.joinpath("meta.json").stat().st_mtime
+                size = sum(p.stat().st_size for p in folder.iterdir())
+            except OSError:
+                continue
+            sizes[folder] = (mtime, size)
+
+        total = sum(size for _, size in sizes.values())
+        for folder, (_, size) in sorted(sizes.items(), key=lambda e: e[1][0]):
+            if total <= self.disk_budget:
+                break
+            if folder == keep:
+                continue
+            if self._remove(folder):
+                total -= size
+                LOGGER.debug(f"Removed filtered raw: {folder}, {size} bytes")
+
+    def invalidate(self, data_path: Path):
+        """
+        Removes the filtered copies of the data file.
+
+        Args:
+            data_path (Path): The path of the data file.
+        """
+
+        folder = self._path_folder(data_path)
+        if folder.is_dir():
+            for band_folder in [p for p in folder.iterdir() if "." not in p.name]:
+                self._remove(band_folder)
+            # The copy in use is kept, the folder is removed with the last copy
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+            LOGGER.debug(f"Invalidated filtered raw: {folder}")
+
+
+# %% ---- 2024-01-17 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-17 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-17 ------------------------
+# Pending
@@ -0,0 +1,225 @@
+"""
+File: job_system.py
+Author: Chuncheng Zhang
+Date: 2024-01-15
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Job system for the heavy computations, like collecting epochs.
+
+    The jobs run in the bounded worker pool.
+    The job reports its stage and progress at the check points,
+    and it is cancelled at the next check point when it is superseded by a newer job.
+    The progress and the end of the job are published to the owner's subscribers.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-15 ------------------------
+# Requirements and constants
+import time
+import uuid
+
+from threading import Event, Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import LOGGER, singleton
+from .error_box import eb
+from .notifier import ZccNotifier
+
+zn = ZccNotifier()
+
+
+# %% ---- 2024-01-15 ------------------------
+# Function and class
+class ZccJobCancelled(Exception):
+    pass
+
+
+class ZccJob(object):
+    """
+    ZccJob class.
+
+    The job of the computation, the computation calls check_point between its stages.
+
+    Args:
+        owner (str): The owner of the job, it is the session name.
+        name (str): The name of the job, like "collectEpochs".
+    """
+
+    publish_secs = 0.5
+
+    def __init__(self, owner: str, name: str):
+        self.id = uuid.uuid4().hex.upper()
+        self.owner = owner
+        self.name = name
+        self.status = "pending"
+        self.stage = "pending"
+        self.progress = 0.0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = Event()
+        self.published = 0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_point(self, stage: str, progress: float):
+        """
+        Reports the stage and progress, and raises if the job is cancelled.
+
+        Args:
+            stage (str): The stage, like "epoching", "filtering" and "decimating".
+            progress (float): The progress from 0 to 1.
+
+        Raises:
+            ZccJobCancelled: If the job is cancelled."""
+
+        if self.cancelled():
+            raise ZccJobCancelled(f"Job {self.id} is cancelled at {stage}")
+        changed = stage != self.stage
+        self.stage = stage
+        self.progress = progress
+        LOGGER.debug(f"Job {self.id} ({self.name}) is {stage}, {progress:.2f}")
+
+        # Publish the stage changes, and the progress at most every publish_secs
+        if changed or time.time() - self.published > self.publish_secs:
+            self.publish("jobProgress")
+
+    def publish(self, event: str):
+        self.published = time.time()
+        zn.publish(self.owner, event, self.to_dict())
+
+    def to_dict(self):
+        return dict(
+            jobID=self.id,
+            owner=self.owner,
+            name=self.name,
+            status=self.status,
+            stage=self.stage,
+            progress=self.progress,
+            error=self.error,
+            created=self.created,
+            started=self.started,
+            finished=self.finished,
+        )
+
+
+@singleton
+class ZccJobSystem(object):
+    """
+    ZccJobSystem class.
+
+    The bounded worker pool of the jobs.
+    Submitting the job cancels the owner's previous job with the same name.
+
+    Examples:
+        zjs = ZccJobSystem()
+        job = zjs.submit("user123", "collectEpochs", fn, *args)
+        zjs.get(job.id).to_dict()"""
+
+    max_workers = 2
+    max_jobs = 200  # The number of the jobs to remember
+
+    def __init__(self):
+        self.lock = Lock()
+        self.jobs = OrderedDict()
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="zcc-job"
+        )
+
+    def submit(self, owner: str, name: str, fn, *args, **kwargs):
+        """
+        Submits the job, the fn is called as fn(*args, job=job, **kwargs).
+
+        Args:
+            owner (str): The owner of the job.
+            name (str): The name of the job.
+            fn (callable): The computation.
+
+        Returns:
+            ZccJob: The job."""
+
+        job = ZccJob(owner, name)
+
+        with self.lock:
+            # The newer job supersedes the older ones
+            for other in self.jobs.values():
+                if (
+                    other.owner == owner
+                    and other.name == name
+                    and other.status in ("pending", "running")
+                ):
+                    other.cancel()
+                    LOGGER.debug(f"Cancelling superseded job {other.id}")
+
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+
+        self.pool.submit(self._run, job, fn, args, kwargs)
+        LOGGER.debug(f"Submitted job {job.id} ({name}) for {owner}")
+        return job
+
+    def _run(self, job: ZccJob, fn, args, kwargs):
+        try:
+            job.check_point("starting", 0.0)
+            job.status = "running"
+            job.started = time.time()
+            fn(*args, job=job, **kwargs)
+            job.check_point("done", 1.0)
+            job.status = "done"
+            event = "jobDone"
+
+        except ZccJobCancelled as err:
+            job.status = "cancelled"
+            event = "jobCancelled"
+            LOGGER.debug(f"{err}")
+
+        except Exception as err:
+            job.status = "failed"
+            job.error = f"{err}"
+            event = "jobFailed"
+            LOGGER.error(f"Failed job {job.id} ({job.name}): {err}")
+            eb.on_error(err)
+
+        finally:
+            job.finished = time.time()
+
+        job.publish(event)
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def latest(self, owner: str, name: str = None):
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if job.owner == owner and (name is None or job.name == name):
+                    return job
+        return None
+
+
+# %% ---- 2024-01-15 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-15 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-15 ------------------------
+# Pending
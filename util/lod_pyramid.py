@@ -0,0 +1,291 @@
+"""
+File: lod_pyramid.py
+Author: Chuncheng Zhang
+Date: 2024-01-08
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Level-of-detail pyramid of the raw data.
+    The levels are the min/max envelopes of the raw data,
+    at the power-of-two decimations.
+    The levels are saved next to the decoded cache, and memory-mapped when the recording is opened again.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-08 ------------------------
+# Requirements and constants
+import os
+import json
+import tempfile
+
+from pathlib import Path
+
+from . import LOGGER, LazyModule
+
+np = LazyModule("numpy")
+
+
+# %% ---- 2024-01-08 ------------------------
+# Function and class
+def _envelope(data: "np.ndarray", bucket: int):
+    """
+    Computes the min/max envelope of the data.
+
+    Args:
+        data (np.ndarray): The data of (time points x channels).
+        bucket (int): The number of time points in every bucket.
+
+    Returns:
+        tuple: The mins and maxs of (buckets x channels).
+        The last bucket is padded with its edge value if it is not full."""
+
+    n = data.shape[0]
+    n_buckets = int(np.ceil(n / bucket))
+    pad = n_buckets * bucket - n
+    if pad > 0:
+        data = np.pad(data, ((0, pad), (0, 0)), mode="edge")
+    data = data.reshape((n_buckets, bucket, data.shape[1]))
+    return data.min(axis=1), data.max(axis=1)
+
+
+class ZccMinMaxPyramid(object):
+    """
+    ZccMinMaxPyramid class.
+
+    The min/max envelopes of the raw data, at the power-of-two decimations.
+    The level k refers the envelope of 2^k time points per bucket.
+    The levels below the min_level are not stored,
+    since they are computed from the raw data on the fly.
+
+    Args:
+        raw (mne.io.Raw): The raw data.
+        build (bool): Whether to build the levels, False for loading them.
+
+    Examples:
+        pyramid = ZccMinMaxPyramid(raw)
+        data, samples = pyramid.envelope(0, raw.n_times, 2000)
+        pyramid.save(folder)
+        pyramid = ZccMinMaxPyramid.load(raw, folder)"""
+
+    min_level = 3
+    chunk_secs = 60
+    dtype = "float32"
+
+    def __init__(self, raw, build: bool = True):
+        self.raw = raw
+        self.levels = {}
+        self.ch_sums = None
+        if build:
+            self.build()
+
+    def build(self):
+        """
+        Builds the levels chunk by chunk.
+        The sums of the channels are also accumulated during the building.
+        """
+
+        raw = self.raw
+        n_times = raw.n_times
+        bucket = 2**self.min_level
+
+        # Use the chunk of multiple buckets, so the buckets are not split between the chunks
+        chunk = max(1, int(self.chunk_secs * raw.info["sfreq"]) // bucket) * bucket
+
+        mins = []
+        maxs = []
+        sums = np.zeros(len(raw.ch_names))
+        for start in range(0, n_times, chunk):
+            stop = min(start + chunk, n_times)
+            data = raw.get_data(start=start, stop=stop).transpose()
+            sums += data.sum(axis=0)
+            _min, _max = _envelope(data, bucket)
+            mins.append(_min.astype(self.dtype))
+            maxs.append(_max.astype(self.dtype))
+
+        self.ch_sums = sums
+
+        if not mins:
+            LOGGER.warning(f"Empty raw for building pyramid: {raw}")
+            return
+
+        level = self.min_level
+        _min = np.concatenate(mins, axis=0)
+        _max = np.concatenate(maxs, axis=0)
+        self.levels[level] = (_min, _max)
+
+        # Every upper level halves the lower level
+        while len(_min) > 1:
+            level += 1
+            _min = _envelope(_min, 2)[0]
+            _max = _envelope(_max, 2)[1]
+            self.levels[level] = (_min, _max)
+
+        LOGGER.debug(
+            f"Built pyramid with levels {self.min_level}-{level}, {self.nbytes()} bytes"
+        )
+
+    def nbytes(self):
+        # The memory-mapped levels cost nothing, since their pages belong to the page cache
+        return sum(
+            _min.nbytes + _max.nbytes
+            for _min, _max in self.levels.values()
+            if not isinstance(_min, np.memmap)
+        )
+
+    def save(self, folder: Path):
+        """
+        Saves the levels into the folder, every level is the pyramid-<level>.npy of (2 x buckets x channels).
+        Every file is replaced atomically, and the pyramid.json is written the last,
+        so the incomplete pyramid is never loaded.
+
+        Args:
+            folder (Path): The folder."""
+
+        def _replace(name: str, write):
+            fd, tmp = tempfile.mkstemp(dir=folder, prefix=f"{name}.tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmp, folder.joinpath(name))
+            except Exception:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+
+        folder = Path(folder)
+        for level, (_min, _max) in self.levels.items():
+            _replace(f"pyramid-{level}.npy", lambda f: np.save(f, np.stack([_min, _max])))
+        _replace("pyramid-sums.npy", lambda f: np.save(f, self.ch_sums))
+
+        meta = dict(
+            min_level=self.min_level,
+            levels=sorted(self.levels),
+            n_times=int(self.raw.n_times),
+            n_channels=len(self.raw.ch_names),
+        )
+        _replace("pyramid.json", lambda f: f.write(json.dumps(meta).encode()))
+        LOGGER.debug(f"Saved pyramid into {folder}")
+
+    @classmethod
+    def load(cls, raw, folder: Path):
+        """
+        Loads the levels saved by the save, they are memory-mapped.
+
+        Args:
+            raw (mne.io.Raw): The raw data.
+            folder (Path): The folder.
+
+        Returns:
+            ZccMinMaxPyramid or None: The pyramid, None if it is not saved or mismatches the raw."""
+
+        folder = Path(folder)
+        meta_path = folder.joinpath("pyramid.json")
+        if not meta_path.is_file():
+            return None
+
+        meta = json.loads(meta_path.read_text())
+        if meta != dict(
+            min_level=cls.min_level,
+            levels=meta["levels"],
+            n_times=int(raw.n_times),
+            n_channels=len(raw.ch_names),
+        ):
+            LOGGER.debug(f"Mismatched pyramid: {folder}")
+            return None
+
+        pyramid = cls(raw, build=False)
+        for level in meta["levels"]:
+            data = np.load(folder.joinpath(f"pyramid-{level}.npy"), mmap_mode="r")
+            pyramid.levels[level] = (data[0], data[1])
+        pyramid.ch_sums = np.load(folder.joinpath("pyramid-sums.npy"))
+        LOGGER.debug(f"Loaded pyramid from {folder}")
+        return pyramid
+
+    def select_level(self, n_samples: int, max_points: int):
+        """
+        Selects the level for the samples.
+        It is the finest level whose envelope does not exceed the max_points.
+        Every bucket costs two points, the min and the max.
+
+        Args:
+            n_samples (int): The number of samples.
+            max_points (int): The max number of points.
+
+        Returns:
+            int: The level, 0 refers the raw data is used."""
+
+        if n_samples <= max_points:
+            return 0
+
+        level = 1
+        while 2 * np.ceil(n_samples / 2**level) > max_points:
+            level += 1
+
+        if self.levels:
+            level = min(level, max(self.levels))
+
+        return level
+
+    def envelope(self, start: int, stop: int, max_points: int):
+        """
+        Fetches the envelope of the samples in [start, stop).
+
+        Args:
+            start (int): The first sample.
+            stop (int): The stop sample, it is not included.
+            max_points (int): The max number of points.
+
+        Returns:
+            tuple: The data of (points x channels) and the sample indexes of the points.
+            The points are the min and max of every bucket in turn.
+            The data is None if the raw data should be used."""
+
+        level = self.select_level(stop - start, max_points)
+        if level == 0:
+            return None, None
+
+        bucket = 2**level
+
+        # Align to the buckets
+        b0 = start // bucket
+        b1 = int(np.ceil(stop / bucket))
+
+        if level < self.min_level or level not in self.levels:
+            # The low levels are cheap to compute, since the window is short
+            data = self.raw.get_data(
+                start=b0 * bucket, stop=min(b1 * bucket, self.raw.n_times)
+            ).transpose()
+            _min, _max = _envelope(data, bucket)
+        else:
+            _min, _max = self.levels[level]
+            _min = _min[b0:b1]
+            _max = _max[b0:b1]
+
+        n = len(_min)
+        data = np.empty((n * 2, _min.shape[1]), dtype=np.float64)
+        data[0::2] = _min
+        data[1::2] = _max
+
+        samples = np.empty(n * 2, dtype=np.int64)
+        samples[0::2] = np.arange(b0, b0 + n) * bucket
+        samples[1::2] = samples[0::2] + bucket // 2
+
+        return data, samples
+
+
+# %% ---- 2024-01-08 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-08 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-08 ------------------------
+# Pending
@@ -0,0 +1,240 @@
+"""
+File: metrics.py
+Author: Chuncheng Zhang
+Date: 2024-01-26
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Metrics of the app, they are exposed in the Prometheus text format by the /metrics route.
+
+    - zcc_http_request_duration_seconds: the latency histogram of the routes;
+    - zcc_http_response_size_bytes: the response bytes histogram of the routes;
+    - zcc_http_requests_in_flight: the requests being handled of the routes;
+    - zcc_stage_duration_seconds: the pipeline stages, like file_decode, epoching, filtering, tfr and csv_encoding;
+    - zcc_cache_requests_total and zcc_cache_hit_ratio: the hits and misses of the caches.
+    The metrics are kept in the memory of the process, the prometheus_client is not required.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-26 ------------------------
+# Requirements and constants
+import time
+import bisect
+
+from threading import Lock
+from contextlib import contextmanager
+
+from . import LOGGER, singleton
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+size_buckets = tuple(1024 * 4**i for i in range(10))  # 1 KB to 256 MB
+
+
+# %% ---- 2024-01-26 ------------------------
+# Function and class
+def _escape(value):
+    return f"{value}".replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = ""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class ZccCounter(object):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, label_names: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = label_names
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, label_values: tuple = (), n: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + n
+
+    def samples(self):
+        with self.lock:
+            return [
+                (self.name, _labels(self.label_names, k), v)
+                for k, v in sorted(self.values.items())
+            ]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{n}{l} {v}" for n, l, v in self.samples())
+        return lines
+
+
+class ZccGauge(ZccCounter):
+    kind = "gauge"
+
+    def dec(self, label_values: tuple = (), n: float = 1):
+        self.inc(label_values, -n)
+
+    def set(self, label_values: tuple, value: float):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class ZccHistogram(ZccCounter):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, label_names: tuple = (), buckets: tuple = latency_buckets):
+        super().__init__(name, doc, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, label_values: tuple, value: float):
+        with self.lock:
+            if (record := self.values.get(label_values)) is None:
+                record = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                record[0][i] += 1
+            record[1] += value
+            record[2] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for k, (counts, total, n) in sorted(self.values.items()):
+                cumulative = 0
+                for le, c in zip(self.buckets, counts):
+                    cumulative += c
+                    samples.append(
+                        (f"{self.name}_bucket", _labels(self.label_names, k, f'le="{le}"'), cumulative)
+                    )
+                samples.append((f"{self.name}_bucket", _labels(self.label_names, k, 'le="+Inf"'), n))
+                samples.append((f"{self.name}_sum", _labels(self.label_names, k), total))
+                samples.append((f"{self.name}_count", _labels(self.label_names, k), n))
+        return samples
+
+
+@singleton
+class ZccMetrics(object):
+    """
+    ZccMetrics class.
+
+    Examples:
+        zm = ZccMetrics()
+        with zm.stage('filtering'):
+            filter_the_raw()
+        zm.cache('epochs', hit=epochs is not None)
+        text = zm.render()"""
+
+    content_type = "text/plain; version=0.0.4"
+
+    def __init__(self):
+        self.request_duration = ZccHistogram(
+            "zcc_http_request_duration_seconds",
+            "The latency of the requests.",
+            ("method", "route", "status"),
+            latency_buckets,
+        )
+        self.response_size = ZccHistogram(
+            "zcc_http_response_size_bytes",
+            "The body bytes of the responses.",
+            ("method", "route"),
+            size_buckets,
+        )
+        self.in_flight = ZccGauge(
+            "zcc_http_requests_in_flight",
+            "The requests being handled.",
+            ("method", "route"),
+        )
+        self.stage_duration = ZccHistogram(
+            "zcc_stage_duration_seconds",
+            "The duration of the pipeline stages.",
+            ("stage",),
+            latency_buckets,
+        )
+        self.cache_requests = ZccCounter(
+            "zcc_cache_requests_total",
+            "The requests of the caches.",
+            ("cache", "result"),
+        )
+        self.metrics = [
+            self.request_duration,
+            self.response_size,
+            self.in_flight,
+            self.stage_duration,
+            self.cache_requests,
+        ]
+        LOGGER.debug(f"Initialized {self.__class__}")
+
+    def observe_request(self, method: str, route: str, status: int, secs: float, nbytes: int):
+        self.request_duration.observe((method, route, status), secs)
+        self.response_size.observe((method, route), nbytes)
+
+    def observe_stage(self, stage: str, secs: float):
+        self.stage_duration.observe((stage,), secs)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """
+        Times the stage, the failed stage is timed too.
+
+        Args:
+            stage (str): The name of the stage."""
+
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - t)
+
+    def cache(self, cache: str, hit: bool):
+        self.cache_requests.inc((cache, "hit" if hit else "miss"))
+
+    def hit_ratios(self):
+        with self.cache_requests.lock:
+            counts = dict(self.cache_requests.values)
+
+        ratios = {}
+        for cache in sorted({c for c, _ in counts}):
+            hits = counts.get((cache, "hit"), 0)
+            total = hits + counts.get((cache, "miss"), 0)
+            ratios[cache] = hits / total if total else 0.0
+        return ratios
+
+    def render(self):
+        """
+        Renders the metrics in the Prometheus text format.
+
+        Returns:
+            str: The text of the metrics."""
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        lines.append("# HELP zcc_cache_hit_ratio The hit ratio of the caches.")
+        lines.append("# TYPE zcc_cache_hit_ratio gauge")
+        for cache, ratio in self.hit_ratios().items():
+            lines.append(f'zcc_cache_hit_ratio{{cache="{_escape(cache)}"}} {ratio}')
+
+        return "\n".join(lines) + "\n"
+
+
+# %% ---- 2024-01-26 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-26 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-26 ------------------------
+# Pending
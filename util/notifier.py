@@ -0,0 +1,146 @@
+"""
+File: notifier.py
+Author: Chuncheng Zhang
+Date: 2024-01-19
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Notifier of the session events, they are pushed to the browser as the Server-Sent Events.
+
+    The events are published by the session and job layers from any thread,
+    and delivered into the asyncio queues of the subscribers of the session.
+    The events are like
+    - rawLoading, rawLoaded: the loading of the raw;
+    - jobProgress: the stage and progress of the job;
+    - jobDone, jobFailed, jobCancelled: the end of the job;
+    - epochsReady: the epochs are ready for the analysis.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-19 ------------------------
+# Requirements and constants
+import json
+import asyncio
+
+from threading import Lock
+
+from . import LOGGER, singleton
+
+
+# %% ---- 2024-01-19 ------------------------
+# Function and class
+def format_sse(event: str, data: dict):
+    """
+    Formats the event as the Server-Sent Event message.
+
+    Args:
+        event (str): The name of the event.
+        data (dict): The data of the event.
+
+    Returns:
+        str: The message."""
+
+    return f"event: {event}\ndata: {json.dumps(data, default=lambda o: f'{o}')}\n\n"
+
+
+class ZccSubscriber(object):
+    """
+    ZccSubscriber class.
+
+    The subscriber of the session's events, it is created inside the event loop.
+
+    Args:
+        owner (str): The session name.
+    """
+
+    max_size = 100
+
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+
+    def put(self, event: str, data: dict):
+        # Called from any thread
+        self.loop.call_soon_threadsafe(self._put, (event, data))
+
+    def _put(self, message: tuple):
+        # The slow subscriber loses the oldest events
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+@singleton
+class ZccNotifier(object):
+    """
+    ZccNotifier class.
+
+    Examples:
+        zn = ZccNotifier()
+        subscriber = zn.subscribe("user123")  # Inside the event loop
+        zn.publish("user123", "epochsReady", dict(jobID="..."))  # From any thread
+        event, data = await subscriber.queue.get()
+        zn.unsubscribe(subscriber)"""
+
+    keepalive_secs = 15
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subscribers = {}
+
+    def subscribe(self, owner: str):
+        subscriber = ZccSubscriber(owner)
+        with self.lock:
+            self.subscribers.setdefault(owner, set()).add(subscriber)
+        LOGGER.debug(f"Subscribed events of {owner}")
+        return subscriber
+
+    def unsubscribe(self, subscriber: ZccSubscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.owner, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self.subscribers.pop(subscriber.owner, None)
+        LOGGER.debug(f"Unsubscribed events of {subscriber.owner}")
+
+    def publish(self, owner: str, event: str, data: dict = None):
+        """
+        Publishes the event to the subscribers of the owner.
+
+        Args:
+            owner (str): The session name.
+            event (str): The name of the event.
+            data (dict): The data of the event.
+        """
+
+        with self.lock:
+            subscribers = list(self.subscribers.get(owner, []))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put(event, data or {})
+            except RuntimeError as err:
+                # The event loop is closed
+                LOGGER.warning(f"Failed publishing {event} to {owner}: {err}")
+                self.unsubscribe(subscriber)
+
+
+# %% ---- 2024-01-19 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-19 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-19 ------------------------
+# Pending
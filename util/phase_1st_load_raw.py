@@ -18,14 +18,22 @@ Functions:
 
 # %% ---- 2023-11-23 ------------------------
 # Requirements and constants
-import mne
-
 from rich import print
 from pathlib import Path
 from collections import OrderedDict
 
-from . import LOGGER, CONF
+from . import LOGGER, LazyModule
 from .error_box import eb
+from .lod_pyramid import ZccMinMaxPyramid
+from .decoded_cache import ZccDecodedCache
+from .metrics import ZccMetrics
+from .tracing import ZccTrace
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+
+zdc = ZccDecodedCache()
+zm = ZccMetrics()
 
 
 # %% ---- 2023-11-23 ------------------------
@@ -75,9 +83,14 @@ class ZccEEGRaw(object):
     event_id = None
     epochs = None
     evoked = None
+    ch_means = None
+    pyramid = None
+    trace = None
+    use_decoded_cache = True
 
     def __init__(self, path):
         self.path = Path(path)
+        self.trace = ZccTrace()
         self.check_progress()
 
     def check_progress(self):
@@ -96,10 +109,40 @@ class ZccEEGRaw(object):
         LOGGER.debug(f"Current progress: {progress}")
         return progress
 
+    def trace_sizes(self):
+        """
+        Returns the input sizes of the spans, like the channels, samples and events.
+
+        Returns:
+            dict: The sizes."""
+
+        sizes = dict(path=self.path.as_posix())
+        if self.raw is not None:
+            sizes |= dict(
+                channels=len(self.raw.ch_names),
+                samples=int(self.raw.n_times),
+                sfreq=self.raw.info["sfreq"],
+            )
+        if self.events is not None:
+            sizes["events"] = len(self.events)
+        return sizes
+
     def load_raw(self):
         def _load_raw(path):
             dct = _multiple_data_type(path)
 
+            if self.use_decoded_cache:
+                cached = zdc.load(dct)
+                zm.cache("decoded", cached is not None)
+                if cached:
+                    raw, self.events, self.event_id = cached
+                    LOGGER.debug(f"Loaded {raw} from decoded cache")
+                    return raw
+
+            with zm.stage("file_decode"):
+                return _decode_raw(dct)
+
+        def _decode_raw(dct):
             if dct["name"] == "cnt":
                 raw = mne.io.read_raw(dct["path"])
             elif dct["name"] == "bdf":
@@ -116,6 +159,10 @@ class ZccEEGRaw(object):
             raw.rename_channels(mapping)
 
             LOGGER.debug(f"Loaded {raw}")
+
+            if self.use_decoded_cache and (cached := zdc.dump(dct, raw)):
+                raw, self.events, self.event_id = cached
+
             return raw
 
         try:
@@ -126,8 +173,12 @@ class ZccEEGRaw(object):
             self.event_id = None
             self.epochs = None
             self.evoked = None
+            self.ch_means = None
+            self.pyramid = None
 
-            self.raw = _load_raw(self.path)
+            with self.trace.span("load_raw") as span:
+                self.raw = _load_raw(self.path)
+                span["args"] |= self.trace_sizes()
 
         except Exception as err:
             LOGGER.error(f"Failed to load raw ({self.path}): {err}")
@@ -135,6 +186,128 @@ class ZccEEGRaw(object):
 
         return
 
+    def share_from(self, recording):
+        """
+        Shares the loaded objects of the other recording, the derived objects are reset.
+        The raw is shared without copying, so it should not be modified in place.
+
+        Args:
+            recording (ZccEEGRaw): The loaded recording."""
+
+        self.raw = recording.raw
+        self.trace.extend(recording.trace)
+        self.montage = recording.montage
+        self.events = recording.events
+        self.event_id = recording.event_id
+        self.ch_means = recording.ch_means
+        self.pyramid = recording.pyramid
+        self.epochs = None
+        self.evoked = None
+
+    def get_ch_means(self, chunk_secs: float = 60):
+        """
+        Computes the per-channel means of the raw data, and caches them.
+        The raw data is read chunk by chunk, so the whole recording is never allocated at once.
+
+        Args:
+            chunk_secs (float): The length of each chunk in seconds.
+
+        Returns:
+            np.ndarray: The means of the channels, shape is (channels,)."""
+
+        if self.ch_means is not None:
+            return self.ch_means
+
+        assert self.raw is not None, "Failed get_ch_means, since raw is invalid."
+
+        n_times = self.raw.n_times
+        chunk = max(1, int(chunk_secs * self.raw.info["sfreq"]))
+        total = np.zeros(len(self.raw.ch_names))
+        for start in range(0, n_times, chunk):
+            stop = min(start + chunk, n_times)
+            total += self.raw.get_data(start=start, stop=stop).sum(axis=1)
+
+        self.ch_means = total / max(n_times, 1)
+        LOGGER.debug(f"Computed channel means for {self.path}")
+        return self.ch_means
+
+    def build_pyramid(self):
+        """
+        Builds the min/max pyramid of the raw data.
+        The channel means are cached on the way, since the building reads the whole raw data.
+        The pyramid is saved with the decoded cache, so the recording is reopened without building it again.
+
+        Returns:
+            ZccMinMaxPyramid: The pyramid."""
+
+        try:
+            assert self.raw is not None, "Failed build_pyramid, since raw is invalid."
+
+            dct = _multiple_data_type(self.path) if self.use_decoded_cache else None
+            pyramid = None
+            if dct is not None:
+                pyramid = zdc.load_pyramid(dct, self.raw)
+                zm.cache("pyramid", pyramid is not None)
+
+            if pyramid is None:
+                pyramid = ZccMinMaxPyramid(self.raw)
+                if dct is not None:
+                    zdc.dump_pyramid(dct, pyramid)
+
+            self.pyramid = pyramid
+            if self.ch_means is None:
+                self.ch_means = self.pyramid.ch_sums / max(self.raw.n_times, 1)
+            return self.pyramid
+
+        except Exception as err:
+            LOGGER.error(f"Failed build_pyramid ({self.path}): {err}")
+            eb.on_error(err)
+
+    def get_data_window(
+        self, seconds: float, window_length: float, max_points: int = 0
+    ):
+        """
+        Reads the de-meaned raw data inside the window of (seconds +/- window_length / 2).
+        Only the samples inside the window are read from the raw.
+        If the window has more samples than max_points, the min/max envelope from the pyramid is used instead.
+
+        Args:
+            seconds (float): The center of the window in seconds.
+            window_length (float): The length of the window in seconds.
+            max_points (int): The max number of time points, 0 refers no limit.
+
+        Returns:
+            tuple: The data of (time points x channels) and the sample indexes of the time points.
+
+        Examples:
+            >>> data, samples = eeg_raw.get_data_window(10, 4)
+            >>> data.shape
+            (4000, 64)"""
+
+        assert self.raw is not None, "Failed get_data_window, since raw is invalid."
+
+        sfreq = self.raw.info["sfreq"]
+        lower = seconds - window_length / 2
+        upper = seconds + window_length / 2
+
+        # The samples strictly inside the (lower, upper) range
+        start = int(np.floor(lower * sfreq)) + 1
+        stop = int(np.ceil(upper * sfreq))
+        start = min(max(start, 0), self.raw.n_times)
+        stop = min(max(stop, start), self.raw.n_times)
+
+        if max_points > 0 and self.pyramid is not None:
+            data, samples = self.pyramid.envelope(start, stop, max_points)
+            if data is not None:
+                data -= self.get_ch_means()
+                return data, samples
+
+        # Data size is converted into (time points x channels)
+        data = self.raw.get_data(start=start, stop=stop).transpose()
+        data -= self.get_ch_means()
+
+        return data, np.arange(start, stop)
+
     def fix_montage(
         self, montage_name: str = "standard_1020", rename_channels: dict = None
     ):
@@ -159,7 +332,8 @@ class ZccEEGRaw(object):
 
         try:
             assert self.raw is not None, "Failed fix_montage, since raw is invalid."
-            return _reset_montage(montage_name, rename_channels)
+            with self.trace.span("fix_montage", **self.trace_sizes(), montage=montage_name):
+                return _reset_montage(montage_name, rename_channels)
 
         except Exception as err:
             LOGGER.error(
@@ -172,10 +346,13 @@ class ZccEEGRaw(object):
     def get_events(self):
         try:
             assert self.raw is not None, "Failed get_events, since raw is invalid."
-            events, event_id = mne.events_from_annotations(self.raw)
-            self.events = events
-            self.event_id = event_id
-            return events, event_id
+
+            with self.trace.span("get_events", **self.trace_sizes()) as span:
+                # The events are known if the raw is loaded from the decoded cache
+                if self.events is None or self.event_id is None:
+                    self.events, self.event_id = mne.events_from_annotations(self.raw)
+                span["args"] |= dict(events=len(self.events), labels=len(self.event_id))
+            return self.events, self.event_id
 
         except Exception as err:
             LOGGER.error("Failed get_events")
@@ -18,27 +18,258 @@ Functions:
 
 # %% ---- 2023-12-25 ------------------------
 # Requirements and constants
-import mne
 import time
 import traceback
 
-import numpy as np
-
 from rich import print
 from pathlib import Path
+from contextlib import ExitStack
+from threading import Lock
 
-from . import LOGGER, CONF
+from . import LOGGER, LazyModule
 from .error_box import eb
 from .phase_1st_load_raw import ZccEEGRaw
+from .epochs_cache import ZccEpochsCache
+from .filtered_raw import ZccFilteredRawCache
+from .fast_epochs import ZccFastEpochs, can_use_fast_epochs
+from .wavelet_bank import ZccWaveletBankCache
+from .compute_executor import ZccComputeExecutor
+from .metrics import ZccMetrics
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+
+zepc = ZccEpochsCache()
+zfrc = ZccFilteredRawCache()
+zwbc = ZccWaveletBankCache()
+zce = ZccComputeExecutor()
+zm = ZccMetrics()
 
 
 # %% ---- 2023-12-25 ------------------------
 # Function and class
 class ZccEEGEpochs(ZccEEGRaw):
     timestamp = time.time()
+    # The jobs run in the bounded pool, so every job filters in one thread
+    filter_n_jobs = 1
+    use_epochs_cache = True
+    # Filter the continuous raw once per band, and cut the epochs from the filtered copy.
+    # It is off by default, since the filter edges differ, the filtered epochs differ from the epochs filtered one by one
+    filter_continuous = False
+    # Gather the epochs in the vectorized way, the same epochs as the mne.Epochs
+    use_fast_epochs = True
+    # Serve the single sensor TFR from the all-sensor TFR cube
+    use_tfr_cube = True
+    # Compute the labels of the large TFR cube in the process pool concurrently
+    use_tfr_processes = True
+    tfr_process_min_bytes = 32 * 1024**2  # 32 MB
+    tfr_cubes = None
+    spectra = None
+    spectrum_methods = ["rfft", "welch", "multitaper"]
 
     def __init__(self, path: Path):
         super(ZccEEGEpochs, self).__init__(path)
+        self.derived_lock = Lock()
+
+    def derived_nbytes(self):
+        """
+        Estimates the memory size of the derived data, like epochs and evoked, which is owned only by the object.
+        The raw is not counted, since it is shared by the recording cache.
+        The epochs kept by the epochs cache are not counted either,
+        since they are bounded by its budget, and dropping them here frees nothing.
+
+        Returns:
+            int: The size in bytes."""
+
+        n = 0
+        if (
+            self.epochs is not None
+            and self.epochs.preload
+            and not zepc.holds(self.epochs)
+        ):
+            n += self.epochs._data.nbytes
+        if self.evoked is not None:
+            n += self.evoked.data.nbytes
+        if self.tfr_cubes:
+            n += sum(e["data"].nbytes for e in self.tfr_cubes.values())
+        if self.spectra:
+            n += sum(
+                sum(v.nbytes for v in e["data"].values()) for e in self.spectra.values()
+            )
+        return n
+
+    def drop_derived(self):
+        """
+        Drops the derived data, the raw is kept.
+
+        Returns:
+            int: The freed size in bytes, see derived_nbytes."""
+
+        n = self.derived_nbytes()
+        self.epochs = None
+        self.evoked = None
+        self.tfr_cubes = None
+        self.spectra = None
+        return n
+
+    def _tfr_freqs(self, epochs, n_cycles: float, segments: int):
+        # Compute the min frequency the epochs support
+        # Ref: https://mne.tools/stable/generated/mne.time_frequency.tfr_morlet.html#mne.time_frequency.tfr_morlet
+        freq_min = np.ceil(
+            (5 / np.pi) / (len(epochs.times) + 1) * n_cycles * epochs.info["sfreq"]
+        )
+        freq_max = np.max([freq_min * 2, epochs.info["lowpass"]])
+        freqs = np.linspace(freq_min, freq_max, segments)
+        LOGGER.debug(f"Using freq range: {freq_min}, {freq_max}, {freqs}")
+        return freqs
+
+    def compute_tfr_cube(self, n_cycles: float = 4.0, segments: int = 16):
+        """
+        Computes the baseline-corrected averaged TFR of all the channels and all the event labels.
+        The cube is cached until the epochs change,
+        the labels are computed one by one, with all the channels in one batched FFT-based pass.
+        The wavelets in the frequency domain are reused from the wavelet bank cache.
+
+        Args:
+            n_cycles (float): The number of cycles of the wavelets.
+            segments (int): The number of frequencies.
+
+        Returns:
+            dict: The cube of labels, ch_names, freqs, times and data of (label, channel, freq, time)."""
+
+        epochs = self.epochs
+        key = (n_cycles, segments)
+
+        with self.derived_lock:
+            if self.tfr_cubes is None:
+                self.tfr_cubes = {}
+
+            cube = self.tfr_cubes.get(key)
+            hit = cube is not None and cube["epochs"] is epochs
+            zm.cache("tfr_cube", hit)
+            if hit:
+                return cube
+
+            t = time.perf_counter()
+            freqs = self._tfr_freqs(epochs, n_cycles, segments)
+            times = epochs.times
+            baseline = (times >= times[0]) & (times <= 0)
+            labels = list(epochs.event_id)
+            bank = zwbc.get(epochs.info["sfreq"], freqs, n_cycles, len(times))
+
+            data = np.zeros(
+                (len(labels), len(epochs.ch_names), len(freqs), len(times)),
+                dtype=np.float32,
+            )
+            powers = None
+            if (
+                self.use_tfr_processes
+                and len(labels) > 1
+                and epochs._data.nbytes > self.tfr_process_min_bytes
+            ):
+                try:
+                    futures = [
+                        zce.submit_process(bank.avg_power, epochs[label].get_data())
+                        for label in labels
+                    ]
+                    powers = [future.result() for future in futures]
+                except Exception as err:
+                    LOGGER.warning(f"Failed computing tfr cube in processes: {err}")
+
+            if powers is None:
+                powers = (bank.avg_power(epochs[label].get_data()) for label in labels)
+
+            for i, power in enumerate(powers):
+                # The mean baseline is linear, so it is applied after the average
+                power -= power[:, :, baseline].mean(axis=2, keepdims=True)
+                data[i] = power
+
+            cube = dict(
+                epochs=epochs,
+                labels=labels,
+                ch_names=epochs.ch_names,
+                freqs=freqs,
+                times=times,
+                data=data,
+            )
+            self.tfr_cubes = {k: v for k, v in self.tfr_cubes.items() if v["epochs"] is epochs}
+            self.tfr_cubes[key] = cube
+            zm.observe_stage("tfr", time.perf_counter() - t)
+            LOGGER.debug(f"Computed tfr cube: {labels}, label x chs x freqs x times: {data.shape}")
+
+        return cube
+
+    def compute_spectrum(self, method: str = "rfft"):
+        """
+        Computes the spectrum of all the channels and all the event labels in batch.
+        The spectrum is cached until the epochs change.
+
+        - rfft: the amplitude and phase of the rfft of the evoked, like the freqDomain of the evoked data;
+        - welch: the Welch PSD averaged across the epochs;
+        - multitaper: the multitaper PSD averaged across the epochs.
+
+        Args:
+            method (str): The method, one of the spectrum_methods.
+
+        Returns:
+            dict: The spectrum of labels, ch_names, freqs and data.
+                  The data is the dict of the (label, channel, freq) arrays,
+                  they are amplitude and phase for rfft, and psd for the others."""
+
+        assert method in self.spectrum_methods, f"Unknown spectrum method: {method}"
+
+        epochs = self.epochs
+
+        with self.derived_lock:
+            if self.spectra is None:
+                self.spectra = {}
+
+            spectrum = self.spectra.get(method)
+            hit = spectrum is not None and spectrum["epochs"] is epochs
+            zm.cache("spectrum", hit)
+            if hit:
+                return spectrum
+
+            sfreq = epochs.info["sfreq"]
+            labels = list(epochs.event_id)
+            codes = epochs.events[:, 2]
+            x = epochs.get_data()
+
+            def _label_mean(values):
+                return np.array(
+                    [values[codes == epochs.event_id[e]].mean(axis=0) for e in labels]
+                )
+
+            if method == "rfft":
+                n = x.shape[-1]
+                fft = np.fft.rfft(_label_mean(x), axis=-1) / n
+                freqs = np.fft.rfftfreq(n, 1 / sfreq)
+                data = dict(amplitude=np.abs(fft), phase=np.angle(fft))
+
+            elif method == "welch":
+                psd, freqs = mne.time_frequency.psd_array_welch(
+                    x, sfreq, n_fft=min(256, x.shape[-1]), verbose=False
+                )
+                data = dict(psd=_label_mean(psd))
+
+            elif method == "multitaper":
+                psd, freqs = mne.time_frequency.psd_array_multitaper(
+                    x, sfreq, verbose=False
+                )
+                data = dict(psd=_label_mean(psd))
+
+            spectrum = dict(
+                epochs=epochs,
+                labels=labels,
+                ch_names=epochs.ch_names,
+                freqs=freqs,
+                data={k: v.astype(np.float32) for k, v in data.items()},
+            )
+            self.spectra = {k: v for k, v in self.spectra.items() if v["epochs"] is epochs}
+            self.spectra[method] = spectrum
+            LOGGER.debug(f"Computed {method} spectrum: {labels}, {list(data)}")
+
+        return spectrum
 
     def compute_tfr_morlet(
         self,
@@ -47,21 +278,41 @@ class ZccEEGEpochs(ZccEEGRaw):
         n_cycles: float = 4.0,
         segments: int = 16,
     ):
+        sizes = self.trace_sizes()
+        if self.epochs is not None:
+            sizes |= dict(epochs=len(self.epochs), epochs_times=len(self.epochs.times))
+
+        with self.trace.span(
+            "compute_tfr_morlet",
+            **sizes,
+            sensor=sensor_name,
+            label=event_label,
+            n_cycles=n_cycles,
+            segments=segments,
+            cube=self.use_tfr_cube,
+        ):
+            return self._compute_tfr_morlet(sensor_name, event_label, n_cycles, segments)
+
+    def _compute_tfr_morlet(
+        self, sensor_name: str, event_label: str, n_cycles: float, segments: int
+    ):
+        if self.use_tfr_cube:
+            # The tfr_epochs is not computed in the cube mode
+            cube = self.compute_tfr_cube(n_cycles, segments)
+            averaged_data = cube["data"][
+                cube["labels"].index(event_label), cube["ch_names"].index(sensor_name)
+            ]
+            return None, averaged_data, cube["freqs"], cube["times"]
+
         epochs = self.epochs.copy().pick([sensor_name])[event_label]
         LOGGER.debug(f"Compute tfr_morlet for epochs: {epochs}, {epochs.ch_names}")
 
-        # Compute the min frequency the epochs support
-        # Ref: https://mne.tools/stable/generated/mne.time_frequency.tfr_morlet.html#mne.time_frequency.tfr_morlet
-        freq_min = np.ceil(
-            (5 / np.pi) / (len(epochs.times) + 1) * n_cycles * epochs.info["sfreq"]
-        )
-        freq_max = np.max([freq_min * 2, epochs.info["lowpass"]])
-        freqs = np.linspace(freq_min, freq_max, segments)
-        LOGGER.debug(f"Using freq range: {freq_min}, {freq_max}, {freqs}")
+        freqs = self._tfr_freqs(epochs, n_cycles, segments)
 
-        tfr_epochs = mne.time_frequency.tfr_morlet(
-            epochs, freqs, n_cycles=n_cycles, average=False, return_itc=False, n_jobs=16
-        )
+        with zm.stage("tfr"):
+            tfr_epochs = mne.time_frequency.tfr_morlet(
+                epochs, freqs, n_cycles=n_cycles, average=False, return_itc=False, n_jobs=16
+            )
         times = epochs.times
         tfr_epochs.apply_baseline(baseline=(times[0], 0))
         data = tfr_epochs.data
@@ -73,8 +324,17 @@ class ZccEEGEpochs(ZccEEGRaw):
         return tfr_epochs, averaged_data, freqs, times
 
     def collect_epochs(
-        self, events, event_id, tmin, tmax, l_freq, h_freq, decim, timestamp=None
-    ) -> mne.Epochs:
+        self,
+        events,
+        event_id,
+        tmin,
+        tmax,
+        l_freq,
+        h_freq,
+        decim,
+        timestamp=None,
+        job=None,
+    ) -> "mne.Epochs":
         """
         Collects epochs from the raw data based on specified events.
 
@@ -87,6 +347,7 @@ class ZccEEGEpochs(ZccEEGRaw):
             h_freq: The upper frequency bound for the bandpass filter.
             decim: The decimation factor for downsampling the epochs.
             timestamp: The timestamp of the current computation (optional).
+            job: The ZccJob of the computation, its check points are reported between the stages (optional).
 
         Returns:
             The collected epochs.
@@ -104,6 +365,25 @@ class ZccEEGEpochs(ZccEEGRaw):
             >>> decim = 10
             >>> epochs = collect_epochs(events, event_id, tmin, tmax, l_freq, h_freq, decim)
         """
+        with self.trace.span(
+            "collect_epochs",
+            **self.trace_sizes(),
+            labels=len(events),
+            tmin=tmin,
+            tmax=tmax,
+            l_freq=l_freq,
+            h_freq=h_freq,
+            decim=decim,
+        ) as span:
+            epochs = self._collect_epochs(
+                span, events, event_id, tmin, tmax, l_freq, h_freq, decim, timestamp, job
+            )
+            span["args"].update(epochs=len(epochs), epochs_times=len(epochs.times))
+        return epochs
+
+    def _collect_epochs(
+        self, span, events, event_id, tmin, tmax, l_freq, h_freq, decim, timestamp, job
+    ):
         # Reset following objects since the new epochs are loading
         self.epochs = None
         self.evoked = None
@@ -113,6 +393,21 @@ class ZccEEGEpochs(ZccEEGRaw):
         # Only use event_id inside the events
         event_id = {k: v for k, v in event_id.items() if v in events}
 
+        # The same setup of the same recording produces the same epochs
+        key = None
+        if self.use_epochs_cache:
+            key = zepc.key(
+                self.path,
+                events,
+                event_id,
+                tmin,
+                tmax,
+                l_freq,
+                h_freq,
+                decim,
+                filter_continuous=self.filter_continuous,
+            )
+
         # Convert events from array of N numbers into shape (N, 3) events record
         events = [e for e in self.events if e[2] in events]
 
@@ -126,9 +421,79 @@ class ZccEEGEpochs(ZccEEGRaw):
             preload=True,
             event_repeated="merge",
         )
-        epochs = mne.Epochs(self.raw, **kwargs)
-        epochs.filter(l_freq, h_freq, n_jobs=8, verbose=True)
-        epochs.decimate(decim, verbose=True)
+
+        def _check_point(stage, progress):
+            if job is not None:
+                job.check_point(stage, progress)
+
+        _check_point("epoching", 0.0)
+        epochs = zepc.get(key)
+        span["args"]["cached"] = epochs is not None
+        if key is not None:
+            zm.cache("epochs", epochs is not None)
+
+        if epochs is None and self.filter_continuous:
+            _check_point("filtering", 0.0)
+            # The filtered copy is kept from removing until the epochs are cut
+            with ExitStack() as stack:
+                with self.trace.span("filter", continuous=True):
+                    filtered = stack.enter_context(
+                        zfrc.use(
+                            self.path,
+                            self.raw,
+                            l_freq,
+                            h_freq,
+                            on_progress=lambda p: _check_point("filtering", 0.8 * p),
+                        )
+                    )
+                _check_point("epoching", 0.8)
+                with zm.stage("epoching"):
+                    if self.use_fast_epochs and can_use_fast_epochs(events):
+                        # The decimation is done by the slicing of the fast epochs
+                        with self.trace.span(
+                            "epoch", fast=True, events=len(events), decim=decim
+                        ):
+                            epochs = ZccFastEpochs(
+                                filtered,
+                                events,
+                                event_id,
+                                tmin,
+                                tmax,
+                                baseline=kwargs["baseline"],
+                                decim=decim,
+                            ).to_epochs_array()
+                    else:
+                        with self.trace.span("epoch", fast=False, events=len(events)):
+                            epochs = mne.Epochs(filtered, **kwargs)
+                        _check_point("decimating", 0.9)
+                        with self.trace.span("decimate", decim=decim):
+                            epochs.decimate(decim, verbose=True)
+            zepc.put(key, epochs)
+
+        elif epochs is None:
+            with zm.stage("epoching"):
+                if self.use_fast_epochs and can_use_fast_epochs(events):
+                    # The baseline is applied before the filter, the same as the mne.Epochs
+                    with self.trace.span("epoch", fast=True, events=len(events), decim=1):
+                        epochs = ZccFastEpochs(
+                            self.raw,
+                            events,
+                            event_id,
+                            tmin,
+                            tmax,
+                            baseline=kwargs["baseline"],
+                        ).to_epochs_array()
+                else:
+                    with self.trace.span("epoch", fast=False, events=len(events)):
+                        epochs = mne.Epochs(self.raw, **kwargs)
+            _check_point("filtering", 0.4)
+            with zm.stage("filtering"), self.trace.span("filter", continuous=False):
+                epochs.filter(l_freq, h_freq, n_jobs=self.filter_n_jobs, verbose=True)
+            _check_point("decimating", 0.9)
+            with self.trace.span("decimate", decim=decim):
+                epochs.decimate(decim, verbose=True)
+            zepc.put(key, epochs)
+        _check_point("decimating", 1.0)
 
         if timestamp is None or timestamp == self.timestamp:
             self.epochs = epochs
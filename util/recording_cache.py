@@ -0,0 +1,219 @@
+"""
+File: recording_cache.py
+Author: Chuncheng Zhang
+Date: 2024-01-12
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Process-wide cache of the loaded recordings, shared by the sessions.
+
+    The recordings are keyed by the path of the data file and the stats of all its source files,
+    so the changed evt.bdf loads the recording again.
+    The sessions hold the handles of the recordings,
+    the recording is loaded once no matter how many sessions use it.
+    The recordings without any handle are evicted in the LRU order,
+    when the total size exceeds the memory_budget.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-12 ------------------------
+# Requirements and constants
+import time
+
+from pathlib import Path
+from threading import Lock
+from collections import OrderedDict
+
+from . import LOGGER, singleton
+from .phase_1st_load_raw import ZccEEGRaw, _multiple_data_type
+from .decoded_cache import _stat_source_files
+from .metrics import ZccMetrics
+
+zm = ZccMetrics()
+
+
+# %% ---- 2024-01-12 ------------------------
+# Function and class
+def _recording_nbytes(recording: ZccEEGRaw):
+    """
+    Estimates the memory size of the recording.
+    The memory-mapped raw counts the size of its data files,
+    since its pages stay in the memory while the recording is used.
+
+    Args:
+        recording (ZccEEGRaw): The recording.
+
+    Returns:
+        int: The size in bytes."""
+
+    n = 0
+    raw = recording.raw
+    if raw is not None and raw.preload:
+        n += raw._data.nbytes
+    elif raw is not None:
+        for fname in raw.filenames:
+            try:
+                n += Path(fname).stat().st_size
+            except (OSError, TypeError):
+                pass
+    if recording.pyramid is not None:
+        n += recording.pyramid.nbytes()
+    return n
+
+
+class ZccRecordingEntry(object):
+    def __init__(self, key: tuple, path: Path):
+        self.key = key
+        self.recording = ZccEEGRaw(path)
+        self.refs = 0
+        self.nbytes = 0
+        self.lock = Lock()
+        self.loaded = False
+        self.time = time.time()
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.recording.load_raw()
+            self.recording.fix_montage()
+            self.recording.get_events()
+            self.recording.build_pyramid()
+            self.nbytes = _recording_nbytes(self.recording)
+            self.loaded = True
+
+
+class ZccRecordingHandle(object):
+    """
+    ZccRecordingHandle class.
+
+    The handle of the shared recording, release it when the recording is no longer used.
+    """
+
+    def __init__(self, cache, entry: ZccRecordingEntry):
+        self.cache = cache
+        self.entry = entry
+        self.recording = entry.recording
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.cache.release(self.entry)
+
+
+@singleton
+class ZccRecordingCache(object):
+    """
+    ZccRecordingCache class.
+
+    The process-wide, reference-counted LRU cache of the loaded recordings.
+
+    Examples:
+        zrc = ZccRecordingCache()
+        handle = zrc.acquire(Path('data.bdf'))
+        raw = handle.recording.raw
+        handle.release()"""
+
+    memory_budget = 4 * 1024**3  # 4 GB
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def _key(self, path: Path):
+        path = Path(path)
+        try:
+            sources = _stat_source_files(_multiple_data_type(path))
+            stats = tuple((p, tuple(v)) for p, v in sorted(sources.items()))
+        except (OSError, AssertionError, ValueError):
+            stats = None
+        return (path.resolve().as_posix(), stats)
+
+    def acquire(self, path: Path):
+        """
+        Acquires the handle of the recording, it is loaded if not cached.
+
+        Args:
+            path (Path): The path of the data file.
+
+        Returns:
+            ZccRecordingHandle: The handle of the recording."""
+
+        key = self._key(path)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            zm.cache("recording", entry is not None)
+            if entry:
+                LOGGER.debug(f"Using shared recording: {key}")
+            else:
+                entry = ZccRecordingEntry(key, path)
+                self.entries[key] = entry
+                LOGGER.debug(f"New shared recording: {key}")
+            entry.refs += 1
+            entry.time = time.time()
+            self.entries.move_to_end(key)
+
+        # Load outside the cache lock, the other recordings are not blocked
+        entry.load()
+
+        with self.lock:
+            if entry.recording.raw is None and self.entries.get(key) is entry:
+                # Do not share the failed loading
+                self.entries.pop(key)
+            self._evict()
+
+        return ZccRecordingHandle(self, entry)
+
+    def release(self, entry: ZccRecordingEntry):
+        with self.lock:
+            entry.refs = max(entry.refs - 1, 0)
+            entry.time = time.time()
+            LOGGER.debug(f"Released shared recording: {entry.key}, refs: {entry.refs}")
+            self._evict()
+
+    def total_nbytes(self):
+        return sum(e.nbytes for e in self.entries.values())
+
+    def _evict(self):
+        # The least recently used comes first
+        for key in list(self.entries):
+            if self.total_nbytes() <= self.memory_budget:
+                break
+            entry = self.entries[key]
+            if entry.refs == 0:
+                self.entries.pop(key)
+                LOGGER.debug(f"Evicted shared recording: {key}, {entry.nbytes} bytes")
+
+    def list_recordings(self):
+        with self.lock:
+            return [
+                dict(
+                    path=e.key[0],
+                    refs=e.refs,
+                    nbytes=e.nbytes,
+                    idleSecs=time.time() - e.time,
+                )
+                for e in self.entries.values()
+            ]
+
+
+# %% ---- 2024-01-12 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-12 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-12 ------------------------
+# Pending
@@ -0,0 +1,161 @@
+"""
+File: session_store.py
+Author: Chuncheng Zhang
+Date: 2024-01-22
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Session state store shared by the worker processes.
+
+    The store is the SQLite database in the cache_root, it records the state of every session,
+    - subjectID and data_path: the recording the session is using;
+    - setup: the setup of the latest epochs collection;
+    - version: it is increased every time the state is saved.
+    The worker which has not seen the latest version rehydrates its session from the state,
+    the recording is reloaded from the memory-mapped decoded cache,
+    and the epochs are collected again, usually from the epochs cache.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-22 ------------------------
+# Requirements and constants
+import json
+import time
+import sqlite3
+
+from pathlib import Path
+from threading import Lock
+
+from . import LOGGER
+from .data_index import set_wal_mode
+
+
+# %% ---- 2024-01-22 ------------------------
+# Function and class
+class ZccSessionStore(object):
+    """
+    ZccSessionStore class.
+
+    Args:
+        db_path (Path): The path of the SQLite database.
+
+    Examples:
+        store = ZccSessionStore(Path('session-state.sqlite'))
+        version = store.save('user123', subjectID='MI-S1', data_path='D:/data/MI/S1/data.bdf')
+        state = store.load('user123')"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.lock = Lock()
+        # The transactions are explicit, see the save
+        self.conn = sqlite3.connect(
+            self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        set_wal_mode(self.conn)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (name TEXT PRIMARY KEY, subjectID TEXT, data_path TEXT, setup TEXT, version INTEGER, time REAL)"
+            )
+
+    def save(self, name: str, **state):
+        """
+        Saves the state of the session, the missing keys are kept.
+
+        Args:
+            name (str): The session name.
+            **state: The subjectID, data_path and setup.
+
+        Returns:
+            int: The new version of the state."""
+
+        with self.lock:
+            # Take the write lock before reading the version,
+            # so the workers saving the same session never write the same version
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._save(name, state)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        LOGGER.debug(f"Saved session state: {name}, version {version}")
+        return version
+
+    def _save(self, name: str, state: dict):
+        old = self._load(name) or dict(subjectID=None, data_path=None, setup=None)
+        old |= state
+        version = (old.get("version") or 0) + 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sessions (name, subjectID, data_path, setup, version, time) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                old["subjectID"],
+                None if old["data_path"] is None else str(old["data_path"]),
+                json.dumps(old["setup"], default=int),
+                version,
+                time.time(),
+            ),
+        )
+        return version
+
+    def _load(self, name: str):
+        row = self.conn.execute(
+            "SELECT subjectID, data_path, setup, version, time FROM sessions WHERE name=?",
+            (name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            subjectID=row[0],
+            data_path=row[1],
+            setup=json.loads(row[2]) if row[2] else None,
+            version=row[3],
+            time=row[4],
+        )
+
+    def load(self, name: str):
+        """
+        Loads the state of the session.
+
+        Args:
+            name (str): The session name.
+
+        Returns:
+            dict or None: The state of subjectID, data_path, setup, version and time."""
+
+        with self.lock:
+            return self._load(name)
+
+    def touch(self, name: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE sessions SET time=? WHERE name=?", (time.time(), name)
+            )
+
+    def prune(self, too_long_secs: float):
+        with self.lock, self.conn:
+            n = self.conn.execute(
+                "DELETE FROM sessions WHERE time<?", (time.time() - too_long_secs,)
+            ).rowcount
+        if n:
+            LOGGER.debug(f"Pruned {n} session states")
+
+
+# %% ---- 2024-01-22 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-22 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-22 ------------------------
+# Pending
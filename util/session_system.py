@@ -18,17 +18,30 @@ Functions:
 
 # %% ---- 2023-12-05 ------------------------
 # Requirements and constants
+import os
 import time
-import pandas as pd
 
 from rich import print, inspect
 from pathlib import Path
-from threading import Thread
+from threading import Thread, RLock
+from collections import deque
 
-from . import LOGGER, singleton
+from . import LOGGER, singleton, LazyModule
+from .error_box import eb
 from .file_system import ZccFileSystem
 from .phase_1st_load_raw import ZccEEGRaw
 from .phase_2nd_collect_epochs import ZccEEGEpochs
+from .recording_cache import ZccRecordingCache
+from .job_system import ZccJobSystem
+from .notifier import ZccNotifier
+from .session_store import ZccSessionStore
+from .epochs_cache import ZccEpochsCache
+
+pd = LazyModule("pandas")
+
+zrc = ZccRecordingCache()
+zjs = ZccJobSystem()
+zn = ZccNotifier()
 
 
 # %% ---- 2023-12-05 ------------------------
@@ -39,6 +52,8 @@ class ZccSession(object):
 
     A class representing a user session.
     It provides methods to refresh the session timestamp, calculate the idle time in seconds, and load raw EEG data.
+    The raw EEG data is shared with the other sessions by the recording cache,
+    the derived data, like epochs, belongs to the session.
 
     Args:
         sessionName (str): The name of the session.
@@ -52,10 +67,15 @@ class ZccSession(object):
     time = time.time()
     eeg_data = None
     subjectID = None
+    recording = None
+    job = None
+    store = None  # The ZccSessionStore in the shared state mode
+    state_version = 0
     zfs = ZccFileSystem()
 
     def __init__(self, sessionName: str):
         self.name = sessionName
+        self.state_lock = RLock()
         self.refresh_time_stamp()
         LOGGER.debug(f"Initialized {self.__class__}")
 
@@ -65,15 +85,63 @@ class ZccSession(object):
     def idle_secs(self):
         return time.time() - self.time
 
-    def starts_with_raw(self, data_path: Path, subjectID: str):
+    def has_running_job(self):
+        return self.job is not None and self.job.status in ("pending", "running")
+
+    def nbytes(self):
+        """
+        Estimates the memory size of the session.
+        It is the derived data owned by the session, and its share of the recording which is shared with other sessions.
+        The cached epochs are not counted, since they are bounded by the epochs cache.
+
+        Returns:
+            int: The size in bytes."""
+
+        n = 0
+        if self.eeg_data is not None:
+            n += self.eeg_data.derived_nbytes()
+        if self.recording is not None:
+            entry = self.recording.entry
+            n += entry.nbytes // max(entry.refs, 1)
+        return n
+
+    def save_state(self, **state):
+        if self.store is not None:
+            self.state_version = self.store.save(self.name, **state)
+
+    def sync_state(self):
+        """
+        Rehydrates the session from the store, if the state is saved by the other worker.
+        The raw is reloaded and the epochs are collected again without saving the state.
+        """
+
+        with self.state_lock:
+            state = self.store.load(self.name)
+            if state is None or state["version"] <= self.state_version:
+                return
+
+            LOGGER.debug(f"Rehydrating session {self.name} from {state}")
+            self.state_version = state["version"]
+
+            if state["subjectID"] is not None and state["subjectID"] != self.subjectID:
+                self.starts_with_raw(
+                    Path(state["data_path"]), state["subjectID"], save_state=False
+                )
+
+            if (setup := state["setup"]) is not None and self.eeg_data is not None:
+                self.collect_epochs(**setup, save_state=False)
+
+    def starts_with_raw(self, data_path: Path, subjectID: str, save_state: bool = True):
         """
         Starts a session with the specified subject ID and returns the associated EEG data.
         If the subject ID is already set to the specified value, the existing EEG data is returned.
-        Otherwise, a new session is started with the specified subject ID, and the EEG data is loaded, fixed, and events are retrieved.
+        Otherwise, a new session is started with the specified subject ID, and the EEG data is acquired from the recording cache.
+        The recording is loaded, fixed, and events are retrieved if it is not cached.
 
         Args:
             data_path (Path): The path to the EEG data.
             subjectID (str): The subject ID to associate with the session.
+            save_state (bool): Whether to save the state into the store.
 
         Returns:
             ZccEEGRaw: The EEG data associated with the session.
@@ -85,19 +153,47 @@ class ZccSession(object):
             LOGGER.debug(f"Session {self.name} is using subjectID {self.subjectID}")
             return self.eeg_data
 
+        zn.publish(self.name, "rawLoading", dict(subjectID=subjectID))
+
+        handle = zrc.acquire(data_path)
+        self.release_recording()
+        self.recording = handle
+
         self.subjectID = subjectID
-        # self.eeg_data = ZccEEGRaw(data_path)
         self.eeg_data = ZccEEGEpochs(data_path)
-        self.eeg_data.load_raw()
-        self.eeg_data.fix_montage()
-        self.eeg_data.get_events()
+        self.eeg_data.share_from(handle.recording)
+
+        zn.publish(
+            self.name,
+            "rawLoaded",
+            dict(subjectID=subjectID, ok=self.eeg_data.raw is not None),
+        )
+
+        if save_state:
+            self.save_state(subjectID=subjectID, data_path=data_path, setup=None)
 
         LOGGER.debug(f"Session {self.name} started with new subjectID {self.subjectID}")
         return self.eeg_data
 
-    def collect_epochs(self, events, event_id, tmin, tmax, l_freq, h_freq, decim):
+    def release_recording(self):
+        if self.recording is not None:
+            self.recording.release()
+            self.recording = None
+
+    def collect_epochs(
+        self,
+        events,
+        event_id,
+        tmin,
+        tmax,
+        l_freq,
+        h_freq,
+        decim,
+        save_state: bool = True,
+    ):
         """
         Collects epochs based on the provided events and parameters asynchronously.
+        The computation is submitted to the job system, it supersedes the session's previous one.
 
         Args:
             events (list): The list of events.
@@ -106,27 +202,54 @@ class ZccSession(object):
             l_freq (float): The low frequency value.
             h_freq (float): The high frequency value.
             decim (int): The decimation value.
+            save_state (bool): Whether to save the setup into the store.
 
         Returns:
-            None
+            ZccJob: The job of the computation.
 
         Raises:
             None"""
 
-        def _collect_epochs():
-            # Newer timestamp prevents older ones from being used.
-            timestamp = time.time()
-            self.eeg_data.timestamp = timestamp
-            epochs = self.eeg_data.collect_epochs(
-                events, event_id, tmin, tmax, l_freq, h_freq, decim, timestamp
+        eeg_data = self.eeg_data
+
+        if save_state:
+            self.save_state(
+                setup=dict(
+                    events=[int(e) for e in events],
+                    event_id={k: int(v) for k, v in event_id.items()},
+                    tmin=tmin,
+                    tmax=tmax,
+                    l_freq=l_freq,
+                    h_freq=h_freq,
+                    decim=decim,
+                )
             )
 
+        # Newer timestamp prevents older ones from being used.
+        timestamp = time.time()
+        eeg_data.timestamp = timestamp
+
+        # The previous setup's epochs are stale from now on, even before the job runs
+        eeg_data.drop_derived()
+
+        def _collect_epochs(job):
+            epochs = eeg_data.collect_epochs(
+                events, event_id, tmin, tmax, l_freq, h_freq, decim, timestamp, job
+            )
+
+            if eeg_data.epochs is epochs:
+                zn.publish(
+                    self.name,
+                    "epochsReady",
+                    dict(jobID=job.id, subjectID=self.subjectID),
+                )
+
             LOGGER.debug(
                 f"Session {self.name} collected epochs for subjectID {self.subjectID}, {epochs}"
             )
 
-        Thread(target=_collect_epochs, daemon=True).start()
-        return
+        self.job = zjs.submit(self.name, "collectEpochs", _collect_epochs)
+        return self.job
 
 
 @singleton
@@ -146,25 +269,45 @@ class ZccSessionSystem(object):
     Raises:
         None.
 
+    In the shared state mode, the states of the sessions are saved into the ZccSessionStore,
+    so the app runs with multiple workers, like uvicorn app:app --workers 4.
+    The mode is enabled by the environment variable ZCC_SHARED_SESSIONS=1.
+
     Examples:
         session_system = ZccSessionSystem()
         session = session_system.get_session("user123")
         session_system.list_sessions()
-        session_system.remove_idle_too_long_sessions()"""
+        session_system.remove_idle_too_long_sessions()
+        session_system.start_reaper()"""
 
     sessions = {}
     too_long_secs = 5 * 60 * 60  # Hours x minutes x seconds, 5 hours
+    memory_budget = 8 * 1024**3  # 8 GB
+    reap_secs = 60
+    reaper = None
+    shared_state = os.environ.get("ZCC_SHARED_SESSIONS", "") == "1"
 
     def __init__(self):
-        pass
+        self.lock = RLock()
+        self.evictions = deque(maxlen=200)
+
+        if self.shared_state:
+            ZccSession.store = ZccSessionStore(
+                ZccSession.zfs.touch("session-state.sqlite")
+            )
+            # The epochs are spilled as soon as they are collected, so the other workers use them
+            ZccEpochsCache().spill_on_put = True
+            LOGGER.debug(f"Using shared session state: {ZccSession.store.db_path}")
 
-    def get_session(self, username: str = None):
+    def get_session(self, username: str = None, sync_state: bool = True):
         """
         Returns the session associated with the given username. If the username is None, an error is logged and None is returned.
         If an existing session is found, its timestamp is refreshed and the session is returned. Otherwise, a new session is created and returned.
 
         Args:
             username (str): The username associated with the session.
+            sync_state (bool): Whether to rehydrate the session from the store,
+                               the async callers use False and call session.sync_state outside the event loop.
 
         Returns:
             ZccSession or None: The session associated with the given username, or None if the username is invalid.
@@ -181,27 +324,128 @@ class ZccSessionSystem(object):
             LOGGER.error(f"Invalid session name: {username}")
             return None
 
-        if session := self.sessions.get(username):
-            session.refresh_time_stamp()
-            LOGGER.debug(f"Using existing session: {username}, {session}")
-        else:
-            session = ZccSession(username)
-            self.sessions[username] = session
-            LOGGER.debug(f"New session: {username}, {session}")
+        with self.lock:
+            if session := self.sessions.get(username):
+                session.refresh_time_stamp()
+                LOGGER.debug(f"Using existing session: {username}, {session}")
+            else:
+                session = ZccSession(username)
+                self.sessions[username] = session
+                LOGGER.debug(f"New session: {username}, {session}")
+
+        if sync_state and session.store is not None:
+            session.sync_state()
 
         return session
 
     def list_sessions(self):
-        data = [(k, v.idle_secs()) for k, v in self.sessions.items()]
-        df = pd.DataFrame(data, columns=["name", "idleSecs"])
+        with self.lock:
+            data = [
+                (k, v.subjectID, v.idle_secs(), v.nbytes())
+                for k, v in self.sessions.items()
+            ]
+        df = pd.DataFrame(data, columns=["name", "subjectID", "idleSecs", "nBytes"])
         LOGGER.debug(f"List sessions: {df}")
         return df
 
+    def _record_eviction(self, session: ZccSession, action: str, nbytes: int, reason: str):
+        self.evictions.append(
+            dict(
+                time=time.time(),
+                name=session.name,
+                subjectID=session.subjectID,
+                action=action,
+                nBytes=nbytes,
+                reason=reason,
+            )
+        )
+        LOGGER.debug(f"Evicted session: {self.evictions[-1]}")
+
+    def _remove_session(self, name: str, reason: str):
+        # The eeg_data is not cleared, since the in-flight handler may still use the session,
+        # it is freed when the last reference drops
+        session = self.sessions.pop(name)
+        nbytes = session.nbytes()
+        session.release_recording()
+        self._record_eviction(session, "removeSession", nbytes, reason)
+
     def remove_idle_too_long_sessions(self):
-        for name, v in self.sessions.items():
-            if v.idle_secs() > self.too_long_secs:
-                session = self.sessions.pop(name)
-                LOGGER.debug(f"Removed expired session: {name} {session}")
+        with self.lock:
+            for name, v in list(self.sessions.items()):
+                if v.idle_secs() > self.too_long_secs and not v.has_running_job():
+                    self._remove_session(name, "idle too long")
+
+    def total_nbytes(self):
+        with self.lock:
+            return sum(v.nbytes() for v in self.sessions.values())
+
+    def evict_over_budget(self):
+        """
+        Evicts the sessions in the LRU order, until the total size is inside the memory_budget.
+        The derived data of all the sessions are dropped before any whole session is removed,
+        removing the session releases its share of the recording, see ZccSession.nbytes.
+        The sessions with the running jobs are not removed.
+        """
+
+        with self.lock:
+            total = self.total_nbytes()
+            if total <= self.memory_budget:
+                return
+
+            reason = f"over memory budget {total} > {self.memory_budget}"
+            lru = sorted(self.sessions.items(), key=lambda e: e[1].time)
+
+            # Drop the heavy derived data first
+            for name, session in lru:
+                if total <= self.memory_budget:
+                    return
+                if session.eeg_data is None or session.eeg_data.derived_nbytes() == 0:
+                    continue
+                nbytes = session.eeg_data.drop_derived()
+                total -= nbytes
+                self._record_eviction(session, "dropDerived", nbytes, reason)
+
+            # Remove the whole sessions
+            for name, session in lru:
+                if total <= self.memory_budget:
+                    return
+                if session.has_running_job():
+                    continue
+                total -= session.nbytes()
+                self._remove_session(name, reason)
+
+    def reap(self):
+        self.remove_idle_too_long_sessions()
+        self.evict_over_budget()
+
+        if ZccSession.store is not None:
+            # Keep the states of the live sessions, and forget the long idle ones
+            with self.lock:
+                names = list(self.sessions)
+            for name in names:
+                ZccSession.store.touch(name)
+            ZccSession.store.prune(self.too_long_secs)
+
+    def start_reaper(self):
+        """
+        Starts the background thread, it reaps the sessions every reap_secs.
+        """
+
+        if self.reaper is not None and self.reaper.is_alive():
+            return
+
+        def _reap_forever():
+            while True:
+                time.sleep(self.reap_secs)
+                try:
+                    self.reap()
+                except Exception as err:
+                    LOGGER.error(f"Failed reaping sessions: {err}")
+                    eb.on_error(err)
+
+        self.reaper = Thread(target=_reap_forever, daemon=True)
+        self.reaper.start()
+        LOGGER.debug(f"Started session reaper every {self.reap_secs} secs")
 
 
 # %% ---- 2023-12-05 ------------------------
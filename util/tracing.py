@@ -0,0 +1,190 @@
+"""
+File: tracing.py
+Author: Chuncheng Zhang
+Date: 2024-01-27
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Stage-level tracing of the processing pipeline.
+
+    Every recording and epochs object has its trace, the spans of its stages are recorded in it,
+    - name: the stage, like load_raw, fix_montage, get_events, collect_epochs and compute_tfr_morlet;
+    - parent: the enclosing span, like collect_epochs of its filter, epoch and decimate spans;
+    - wall and cpu: the wall time and the CPU time of the calling thread in seconds;
+    - peak_bytes: the peak traced memory above the start of the span, by the tracemalloc;
+    - args: the input sizes and parameters, like channels, samples, events, tmin and decim.
+    The memory tracing is opt-in by the environment variable ZCC_TRACE_MEMORY=1,
+    since the tracemalloc slows every allocation of the process, the stages are several times slower.
+    Its peaks are only meaningful for one request at a time, since the tracemalloc peak is process-wide,
+    and the concurrent spans reset each other's peaks.
+    Without it, the peak_bytes is None.
+    The trace is exported as the Chrome trace JSON, it is opened by chrome://tracing or Perfetto.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-27 ------------------------
+# Requirements and constants
+import os
+import time
+import threading
+import tracemalloc
+
+from collections import deque
+from contextlib import contextmanager
+
+from . import LOGGER
+
+# The stack of the open spans of every thread
+_local = threading.local()
+
+
+# %% ---- 2024-01-27 ------------------------
+# Function and class
+def _open_spans():
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    return _local.spans
+
+
+class ZccTrace(object):
+    """
+    ZccTrace class.
+
+    The spans of the stages of one recording or epochs object.
+
+    Examples:
+        trace = ZccTrace()
+        with trace.span('load_raw', path='data.bdf') as span:
+            raw = load()
+            span['args'].update(channels=len(raw.ch_names), samples=raw.n_times)
+        trace.to_chrome_trace()"""
+
+    max_spans = 500
+    trace_memory = os.environ.get("ZCC_TRACE_MEMORY", "0") == "1"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = deque(maxlen=self.max_spans)
+
+    def extend(self, trace):
+        # The spans are not changed after they are closed, so they are shared without copying
+        with trace.lock:
+            spans = list(trace.spans)
+        with self.lock:
+            self.spans.extend(spans)
+
+    def list_spans(self):
+        with self.lock:
+            return [
+                {k: v for k, v in s.items() if not k.startswith("_")} for s in self.spans
+            ]
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """
+        Records the span of the stage, the failed stage is recorded with its error.
+
+        Args:
+            name (str): The name of the stage.
+            **args: The input sizes and parameters, they can be updated inside the span.
+
+        Yields:
+            dict: The span."""
+
+        stack = _open_spans()
+        parent = stack[-1] if stack else None
+
+        span = dict(
+            name=name,
+            parent=parent["name"] if parent else None,
+            start=time.time(),
+            wall=0.0,
+            cpu=0.0,
+            peak_bytes=None,
+            thread=threading.get_ident(),
+            error=None,
+            args=args,
+        )
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                LOGGER.debug("Started tracemalloc for the tracing")
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                # The peak is reset for the span, the parent keeps what it has seen
+                parent["_peak"] = max(parent.get("_peak", 0), peak)
+            tracemalloc.reset_peak()
+            span["_base"] = current
+            span["_peak"] = current
+
+        stack.append(span)
+        t, c = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        except Exception as err:
+            span["error"] = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            span["wall"] = time.perf_counter() - t
+            span["cpu"] = time.thread_time() - c
+            stack.pop()
+
+            if "_base" in span and tracemalloc.is_tracing():
+                peak = max(span["_peak"], tracemalloc.get_traced_memory()[1])
+                span["peak_bytes"] = peak - span["_base"]
+                if parent is not None:
+                    parent["_peak"] = max(parent.get("_peak", 0), peak)
+
+            with self.lock:
+                self.spans.append(span)
+
+    def to_chrome_trace(self, spans: list = None):
+        """
+        Exports the spans as the Chrome trace JSON object of the complete events.
+
+        Args:
+            spans (list): The spans, default is the spans of the trace.
+
+        Returns:
+            dict: The Chrome trace."""
+
+        if spans is None:
+            spans = self.list_spans()
+
+        pid = os.getpid()
+        events = [
+            dict(
+                name=s["name"],
+                cat="zcc",
+                ph="X",
+                ts=s["start"] * 1e6,
+                dur=s["wall"] * 1e6,
+                pid=pid,
+                tid=s["thread"],
+                args=s["args"]
+                | dict(cpu=s["cpu"], peak_bytes=s["peak_bytes"], error=s["error"]),
+            )
+            for s in spans
+        ]
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+
+# %% ---- 2024-01-27 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-27 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-27 ------------------------
+# Pending
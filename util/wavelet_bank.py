@@ -0,0 +1,166 @@
+"""
+File: wavelet_bank.py
+Author: Chuncheng Zhang
+Date: 2024-01-20
+Copyright & Email: chuncheng.zhang@ia.ac.cn
+
+Purpose:
+    Amazing things
+    Cache of the Morlet wavelet banks in the frequency domain.
+
+    The bank is keyed by (sfreq, freqs, n_cycles, n_times),
+    it holds the FFT of the zero-mean Morlet wavelets at the FFT-friendly padded length.
+    Computing the TFR with the bank only pays for the FFT of the data,
+    the multiply and the inverse FFT, the same as the mne.time_frequency.tfr_array_morlet.
+
+Functions:
+    1. Requirements and constants
+    2. Function and class
+    3. Play ground
+    4. Pending
+    5. Pending
+"""
+
+
+# %% ---- 2024-01-20 ------------------------
+# Requirements and constants
+from threading import Lock
+from collections import OrderedDict
+
+from . import LOGGER, singleton, LazyModule
+from .metrics import ZccMetrics
+
+np = LazyModule("numpy")
+mne = LazyModule("mne")
+fft = LazyModule("scipy.fft")
+
+zm = ZccMetrics()
+
+
+# %% ---- 2024-01-20 ------------------------
+# Function and class
+class ZccWaveletBank(object):
+    """
+    ZccWaveletBank class.
+
+    The FFT of the Morlet wavelets.
+
+    Args:
+        sfreq (float): The sampling frequency.
+        freqs (array): The frequencies.
+        n_cycles (float): The number of cycles of the wavelets.
+        n_times (int): The number of time points of the data.
+
+    The data is transformed in the chunks of the epochs and channels,
+    so the complex buffers are bounded by the chunk_bytes, however many epochs the data has.
+    """
+
+    chunk_bytes = 16 * 1024**2  # 16 MB of the complex FFT of the data
+
+    def __init__(self, sfreq: float, freqs, n_cycles: float, n_times: int):
+        wavelets = mne.time_frequency.morlet(
+            sfreq, freqs, n_cycles=n_cycles, zero_mean=True
+        )
+        sizes = [len(w) for w in wavelets]
+        assert max(sizes) <= n_times, "At least one of the wavelets is longer than the data"
+
+        self.n_times = n_times
+        self.n_fft = fft.next_fast_len(n_times + max(sizes) - 1)
+        # The start of the centered convolution, the same as the mne
+        self.starts = [(size - 1) // 2 for size in sizes]
+        self.fft_wavelets = np.array([fft.fft(w, self.n_fft) for w in wavelets])
+
+    def nbytes(self):
+        return self.fft_wavelets.nbytes
+
+    def chunk_sizes(self, n_epochs: int, n_channels: int):
+        """
+        Computes the chunk sizes, the epochs are chunked only when one channel of all the epochs is too large.
+
+        Args:
+            n_epochs (int): The number of epochs.
+            n_channels (int): The number of channels.
+
+        Returns:
+            tuple: The epochs and the channels of the chunk."""
+
+        row_bytes = self.n_fft * np.dtype(np.complex128).itemsize
+        epochs = max(1, min(n_epochs, self.chunk_bytes // row_bytes))
+        channels = max(1, min(n_channels, self.chunk_bytes // (row_bytes * epochs)))
+        return epochs, channels
+
+    def avg_power(self, data):
+        """
+        Computes the power averaged across the epochs.
+        The power is accumulated chunk by chunk, the same as the mne computing one channel at a time.
+
+        Args:
+            data (array): The data of (epochs x channels x times).
+
+        Returns:
+            array: The power of (channels x freqs x times)."""
+
+        n_epochs, n_channels, n_times = data.shape
+        assert n_times == self.n_times, f"Mismatched n_times: {n_times} != {self.n_times}"
+
+        n_ep, n_ch = self.chunk_sizes(n_epochs, n_channels)
+        power = np.zeros((n_channels, len(self.starts), n_times))
+        for c in range(0, n_channels, n_ch):
+            for e in range(0, n_epochs, n_ep):
+                fft_data = fft.fft(data[e : e + n_ep, c : c + n_ch], self.n_fft, axis=-1)
+                for i, (fft_w, start) in enumerate(zip(self.fft_wavelets, self.starts)):
+                    conv = fft.ifft(fft_data * fft_w, axis=-1)[..., start : start + n_times]
+                    power[c : c + n_ch, i] += (conv.real**2 + conv.imag**2).sum(axis=0)
+        power /= n_epochs
+        return power
+
+
+@singleton
+class ZccWaveletBankCache(object):
+    """
+    ZccWaveletBankCache class.
+
+    The LRU cache of the wavelet banks.
+
+    Examples:
+        zwbc = ZccWaveletBankCache()
+        bank = zwbc.get(sfreq, freqs, n_cycles, n_times)
+        power = bank.avg_power(epochs.get_data())"""
+
+    max_banks = 16
+
+    def __init__(self):
+        self.lock = Lock()
+        self.banks = OrderedDict()
+
+    def get(self, sfreq: float, freqs, n_cycles: float, n_times: int):
+        key = (float(sfreq), tuple(float(f) for f in freqs), float(n_cycles), int(n_times))
+
+        with self.lock:
+            bank = self.banks.get(key)
+            zm.cache("wavelet_bank", bank is not None)
+            if bank:
+                self.banks.move_to_end(key)
+                return bank
+
+        bank = ZccWaveletBank(sfreq, freqs, n_cycles, n_times)
+        LOGGER.debug(f"New wavelet bank: {key}, n_fft: {bank.n_fft}")
+
+        with self.lock:
+            self.banks[key] = bank
+            while len(self.banks) > self.max_banks:
+                self.banks.popitem(last=False)
+
+        return bank
+
+
+# %% ---- 2024-01-20 ------------------------
+# Play ground
+
+
+# %% ---- 2024-01-20 ------------------------
+# Pending
+
+
+# %% ---- 2024-01-20 ------------------------
+# Pending
@@ -8,6 +8,8 @@ import { TextGeometry } from "three/addons/geometries/TextGeometry.js";
 import { FontLoader } from "three/addons/loaders/FontLoader.js";
 import normals from "https://cdn.jsdelivr.net/npm/angle-normals@1.0.0/+esm";
 
+import { fetchZccFrame } from "./zccFrame.js";
+
 // Properties and variables
 let colorMap = d3.schemeCategory10,
     // Parameter from form
@@ -83,8 +85,11 @@ let drawEEGRawData = (seconds = 0, windowLength = 3) => {
             svg.style.filter = 'opacity(0.1)'
         }
     }
-    d3.csv(
-        `/zcc/getEEGRawData.csv?experimentName=${_experimentName}&subjectID=${_subjectID}&seconds=${seconds}&windowLength=${windowLength}`
+    // Two points per pixel is enough for the min/max envelope
+    let maxPoints = Math.ceil(_zccEEGDataContainer.clientWidth * 2);
+
+    fetchZccFrame(
+        `/zcc/getEEGRawData.csv?experimentName=${_experimentName}&subjectID=${_subjectID}&seconds=${seconds}&windowLength=${windowLength}&maxPoints=${maxPoints}&format=bin`
     ).then((dataCsv) => {
         let chNames = dataCsv.columns.filter((d) => d && d !== "seconds");
         dataCsv.map((d) => {
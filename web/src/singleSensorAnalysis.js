@@ -1,6 +1,7 @@
 
 import * as d3 from "https://cdn.jsdelivr.net/npm/d3@7.8.5/+esm";
 import * as Plot from "https://cdn.jsdelivr.net/npm/@observablehq/plot@0.6/+esm";
+import { waitForEpochsReady } from "./zccEvents.js";
 
 
 let _experimentName = document.getElementById("_experimentName").value,
@@ -64,9 +65,9 @@ let firstThingFirst = () => {
         })
 
     }).catch((err) => {
-        // If not ready, wait 1000 ms and try again
+        // If not ready, try again when the backend pushes the epochsReady event
         console.log('Waiting for backend computing ...', err)
-        setTimeout(firstThingFirst, 1000)
+        waitForEpochsReady(firstThingFirst)
     })
 }
 
@@ -0,0 +1,98 @@
+/**
+ * Listener of the session's Server-Sent Events, see util/notifier.py for the events.
+ * - rawLoading, rawLoaded: the loading of the raw;
+ * - jobProgress: the stage and progress of the job;
+ * - jobDone, jobFailed, jobCancelled: the end of the job;
+ * - epochsReady: the epochs are ready for the analysis.
+ *
+ * The job is cancelled when it is superseded by the newer job, so the listener keeps waiting for the newer one.
+ * If no newer job shows up, or the job fails, the loading cards stop spinning and show the reason.
+ */
+
+// The newer job is expected to report its progress in the time
+let cancelGraceMs = 5000;
+
+/**
+ * Stops the spinners of the loading cards, and shows the reason instead.
+ *
+ * @param {string} title - The title of the cards.
+ * @param {string} message - The message of the cards.
+ * @returns {void}
+ *
+ * @example
+ * stopLoading("Failed", "Failed computing the epochs")
+ */
+let stopLoading = (title, message) => {
+    document.querySelectorAll(".zcc-loading").forEach((card) => {
+        card.querySelector('[role="status"]')?.remove();
+        let h5 = card.querySelector("h5"),
+            p = card.querySelector("p");
+        h5.textContent = title;
+        h5.classList.remove("opacity-20");
+        p.textContent = message;
+        p.classList.remove("opacity-20");
+    });
+};
+
+/**
+ * Waits until the epochs are ready, then calls the callback once.
+ * The browser without the EventSource polls every second instead.
+ *
+ * @param {Function} callback - It is called when the epochs are ready.
+ * @param {Function} onProgress - It is called with the job of the jobProgress events (optional).
+ * @param {Function} onEnded - It is called with the job when it fails or is cancelled without the newer job,
+ *                             the default stops the loading cards (optional).
+ * @returns {void}
+ *
+ * @example
+ * waitForEpochsReady(() => startsWithEpochsEventsCsv(), (job) => console.log(job.stage))
+ */
+let waitForEpochsReady = (callback, onProgress, onEnded) => {
+    if (typeof EventSource === "undefined") {
+        setTimeout(callback, 1000);
+        return;
+    }
+
+    let source = new EventSource("/zcc/events"),
+        cancelTimer;
+
+    let end = (job, title, message) => {
+        source.close();
+        if (onEnded) {
+            onEnded(job);
+        } else {
+            stopLoading(title, message);
+        }
+    };
+
+    source.addEventListener("epochsReady", () => {
+        clearTimeout(cancelTimer);
+        source.close();
+        callback();
+    });
+
+    source.addEventListener("jobProgress", (event) => {
+        let job = JSON.parse(event.data);
+        clearTimeout(cancelTimer);
+        console.log("Backend computing ...", job.stage, job.progress);
+        if (onProgress) onProgress(job);
+    });
+
+    source.addEventListener("jobFailed", (event) => {
+        let job = JSON.parse(event.data);
+        clearTimeout(cancelTimer);
+        console.error("Failed backend computing", job.error);
+        end(job, "Failed", `Failed computing the epochs: ${job.error}. Please check the setup and submit it again.`);
+    });
+
+    source.addEventListener("jobCancelled", (event) => {
+        let job = JSON.parse(event.data);
+        console.log("Backend computing is cancelled, waiting for the newer job ...", job.id);
+        clearTimeout(cancelTimer);
+        cancelTimer = setTimeout(() => {
+            end(job, "Cancelled", "The computing of the epochs is cancelled. Please submit the setup again.");
+        }, cancelGraceMs);
+    });
+};
+
+export { waitForEpochsReady, stopLoading };
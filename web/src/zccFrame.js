@@ -0,0 +1,62 @@
+/**
+ * Decoder of the binary frame, see util/dataframe_converter.py for the layout.
+ * - 4 bytes: the length of the header, little-endian uint32;
+ * - header: the json of columns, shape, dtypes and offsets;
+ * - body: the little-endian values, column by column, every column starts at the 8 bytes boundary.
+ * The index and the "seconds" column are float64, the others are float32.
+ */
+
+/**
+ * Converts the binary frame into the rows, like the d3.csv does.
+ *
+ * @param {ArrayBuffer} buffer - The binary frame.
+ * @returns {Array} - The rows, the columns are attached as the .columns attribute.
+ *
+ * @example
+ * let data = parseZccFrame(buffer);
+ * console.log(data.columns); // ["", "FP1", "FP2", ..., "seconds"]
+ */
+let parseZccFrame = (buffer) => {
+    let n = new DataView(buffer).getUint32(0, true),
+        header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, n))),
+        [rows, cols] = header.shape,
+        columns = header.columns,
+        arrays = columns.map((c, j) => {
+            let TypedArray = header.dtypes[j] === "<f8" ? Float64Array : Float32Array;
+            return new TypedArray(buffer, 4 + n + header.offsets[j], rows);
+        }),
+        data = [];
+
+    for (let i = 0; i < rows; i++) {
+        let row = {};
+        for (let j = 0; j < cols; j++) {
+            row[columns[j]] = arrays[j][i];
+        }
+        data.push(row);
+    }
+
+    data.columns = columns;
+    return data;
+};
+
+/**
+ * Fetches the url in the binary frame format.
+ *
+ * @param {String} url - The url.
+ * @returns {Promise} - The promise of the rows.
+ *
+ * @example
+ * fetchZccFrame('/zcc/getEEGRawData.csv?seconds=10').then(data => console.log(data))
+ */
+let fetchZccFrame = (url) => {
+    return fetch(url, { headers: { Accept: "application/octet-stream" } })
+        .then((response) => {
+            if (!response.ok) {
+                throw new Error(`Failed fetching ${url}: ${response.status}`);
+            }
+            return response.arrayBuffer();
+        })
+        .then(parseZccFrame);
+};
+
+export { parseZccFrame, fetchZccFrame };